@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import metrics
+from resilience import call_cancelled, start_request, end_request
+from structured_logging import log_event, start_log_context, end_log_context
+from sessions import SessionUnitOfWork, current_unit_of_work
+
+# asyncio 版请求处理：会话读取、正则提取与 LLM 补全并发执行，阻塞的 boto3 调用放入有界线程池
+ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", "8"))
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    return ThreadPoolExecutor(max_workers=ASYNC_POOL_SIZE, thread_name_prefix="handler-io")
+
+
+def run_blocking(function, *args, cancelled=None):
+    """
+    Run a blocking call on the bounded pool, in a copy of the caller's context (deadline, unit of
+    work); with a threading.Event as cancelled, setting it stops the call's pending model calls.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    if cancelled is not None:
+        context.run(call_cancelled.set, cancelled)
+    return loop.run_in_executor(get_pool(), partial(context.run, function, *args))
+
+
+def cancel(future, cancelled):
+    """Drop a pending fallback: its model calls not yet sent are shed and its result is discarded."""
+    cancelled.set()
+    future.cancel()
+
+
+async def extract_turn_async(query, lang, session_task, new_session=False):
+    """
+    extract_turn with the session load overlapped.
+
+    The combined LLM fallback starts before the session arrives only when its fields cannot
+    depend on the session: a new session holds no answers, and the intent is never stored.
+    It is built by missing_turn_fields as on the sync path, so the prompt is the same; should
+    the loaded session settle a different set of fields, it is cancelled and the fallback is
+    rerun for the fields still missing, and when none are, no call is made. Otherwise the
+    fallback waits for the session, exactly as extract_turn does. In sequential mode the four
+    per-field fallbacks run concurrently. Pending fallbacks are cancelled if the session load fails.
+    """
+    if main.EXTRACTION_FALLBACK_MODE != "combined":
+        cancelled = threading.Event()
+        fallbacks = asyncio.gather(
+            run_blocking(main.extract_datetime, query, cancelled=cancelled),
+            run_blocking(main.extract_location, query, cancelled=cancelled),
+            run_blocking(main.extract_category, query, lang, cancelled=cancelled),
+            run_blocking(main.is_non_fortune_telling_query, query, lang, cancelled=cancelled)
+        )
+        try:
+            unit_of_work = await session_task
+        except BaseException:
+            cancel(fallbacks, cancelled)
+            raise
+        return unit_of_work, tuple(await fallbacks)
+
+    values = main.local_turn_values(query, lang)
+    fields = main.missing_turn_fields(values, {})
+    speculative, cancelled = None, threading.Event()
+    if fields and (new_session or fields == ["is_fortune_telling"]):
+        speculative = asyncio.ensure_future(run_blocking(main.extract_missing_fields, query, lang, fields, cancelled=cancelled))
+    try:
+        unit_of_work = await session_task
+    except BaseException:
+        if speculative is not None:
+            cancel(speculative, cancelled)
+        raise
+    missing = main.missing_turn_fields(values, unit_of_work.session)
+    if speculative is not None and missing != fields:
+        cancel(speculative, cancelled)
+        speculative = None
+    if speculative is not None:
+        filled = await speculative
+    elif missing:
+        filled = await run_blocking(main.extract_missing_fields, query, lang, missing)
+    else:
+        filled = {}
+    for field in missing:
+        values[field] = filled.get(field)
+    return unit_of_work, main.turn_result(values)
+
+
+async def handle_request_async(event, context, stream=False):
+    """Same responses and session writes as main.handle_request, with independent steps overlapped."""
+    start_time = time.time()
+    log_event(main.handler_logger, logging.INFO, "Request received", verbose=True, path=event.get('path'), event=event)
+
+    path = event.get('path', '').strip()
+
+    if path == '/calculate-pillars':
+        return await run_blocking(main.calculate_pillars, event)
+    if path == '/calendar':
+        return await run_blocking(main.calendar_days, event)
+
+    query, error_response = main.parse_query(event)
+    if error_response is not None:
+        return error_response
+
+    lang = 'en'
+    if query:
+        lang = main.detect_language(query)
+
+    session_task = asyncio.ensure_future(run_blocking(SessionUnitOfWork, main.get_session_store(), event.get('sessionId')))
+    response = None
+    # Like lambda_handler's flush_session, the loaded session is written even when the turn fails part-way
+    try:
+        if not query:
+            await session_task
+            raise ValueError("No query provided")
+
+        # Includes waiting on the session load it overlaps
+        with metrics.span("extract"):
+            unit_of_work, extracted = await extract_turn_async(query, lang, session_task, not event.get('sessionId'))
+        current_unit_of_work.set(unit_of_work)
+        response = await run_blocking(main.advance_conversation, query, lang, unit_of_work.session,
+                                      unit_of_work.session_id, extracted, start_time, stream)
+        return response
+    finally:
+        try:
+            unit_of_work = await session_task
+        except Exception:
+            # The load failed; that error is already propagating from extract_turn_async
+            unit_of_work = None
+        if response is not None and 'stream' in response:
+            response['stream'] = flush_after(response['stream'], unit_of_work)
+        elif unit_of_work is not None:
+            await run_blocking(unit_of_work.flush)
+
+
+def flush_after(lines, unit_of_work):
+    """Yield a streamed response's lines, then write the session (a streamed fortune stages it last)."""
+    try:
+        yield from lines
+    finally:
+        unit_of_work.flush()
+
+
+def lambda_handler(event, context):
+    deadline = start_request(context)
+    log_token = start_log_context(context)
+    metrics_token = metrics.start_metrics(event.get('path', '').strip() or "/",
+                                          RequestId=getattr(context, 'aws_request_id', None), Streaming=0)
+    response = None
+    try:
+        response = asyncio.run(handle_request_async(event, context))
+        return response
+    finally:
+        end_request(deadline)
+        end_log_context(log_token)
+        if metrics_token is not None:
+            metrics.emit_metrics(metrics_token, **main.request_metrics_properties(response))
+
+
+def lambda_stream_handler(event, context):
+    """
+    Streaming entry point for the async path; yields the same NDJSON lines as main.lambda_stream_handler
+    and, like it, only streams behind the Lambda Web Adapter or on a custom runtime.
+    """
+    deadline = start_request(context)
+    log_token = start_log_context(context)
+    metrics_token = metrics.start_metrics(event.get('path', '').strip() or "/",
+                                          RequestId=getattr(context, 'aws_request_id', None), Streaming=1)
+    response = None
+    try:
+        response = asyncio.run(handle_request_async(event, context, stream=True))
+        yield from main.ndjson_lines(response)
+    finally:
+        end_request(deadline)
+        end_log_context(log_token)
+        metrics.emit_metrics(metrics_token, StatusCode=response.get('statusCode') if response else None)
@@ -1,8 +1,12 @@
 import datetime
 import pytz
-import ephem
-from timezonefinder import TimezoneFinder
 import logging
+from collections import namedtuple
+from functools import lru_cache
+from solar_terms import solar_month, load_term_table, UNIX_EPOCH_JD
+from timezone_cache import TimezoneCache, intern_zone
+from gazetteer import resolve_place
+from structured_logging import log_event
 
 # Constants for BaZi calculation
 GAN = ["Jia", "Yi", "Bing", "Ding", "Wu", "Ji", "Geng", "Xin", "Ren", "Gui"]
@@ -13,8 +17,21 @@ ZHI_HOUR_MAPPING = {
     "Xu": (19, 21), "Hai": (21, 23)
 }
 JD_ORIGIN = 2427879.5
+GAN_INDEX = {stem: i for i, stem in enumerate(GAN)}
+ZHI_INDEX = {branch: i for i, branch in enumerate(ZHI)}
+# The sixty Jiazi, "Jia Zi" to "Gui Hai"
+JIAZI_NAMES = tuple(f"{GAN[i % 10]} {ZHI[i % 12]}" for i in range(60))
+PILLAR_KEYS = ("year_pillar", "month_pillar", "day_pillar", "hour_pillar")
 
-tf = TimezoneFinder()
+logger = logging.getLogger("oracle.bazi")
+
+@lru_cache(maxsize=None)
+def get_timezone_finder():
+    """TimezoneFinder loads its polygon data on construction, so build it on first use."""
+    from timezonefinder import TimezoneFinder
+    return TimezoneFinder()
+
+tz_cache = TimezoneCache(lambda lat, lng: get_timezone_finder().timezone_at(lat=lat, lng=lng))
 
 def to_julian(dt):
     """Convert datetime to Julian date."""
@@ -22,43 +39,80 @@ def to_julian(dt):
     return unix_time / 86400.0 + 2440587.5
 
 def get_timezone(city, longitude, latitude=None):
-    """Get timezone for a given city and longitude."""
+    """Get timezone for a given city and longitude; without a latitude, a city the offline gazetteer knows decides."""
+    if latitude is None and isinstance(city, str):
+        place = resolve_place(city)
+        if place is not None:
+            return intern_zone(place.timezone), None
     if latitude is not None:
-        timezone_str = tf.timezone_at(lat=latitude, lng=longitude)
+        tz, timezone_str = tz_cache.lookup(latitude, longitude)
         if timezone_str is None:
             return pytz.UTC, f"Warning: Cannot determine timezone for city {city} with longitude {longitude} and latitude {latitude}. Using UTC as default."
-        return pytz.timezone(timezone_str), None
+        return tz, None
     try:
         # Note: geopy.geocoders.Nominatim is not used here to avoid network calls
         # Assume longitude-based timezone approximation
-        timezone_str = tf.timezone_at(lat=0, lng=longitude)
+        tz, timezone_str = tz_cache.lookup(0, longitude)
         if timezone_str is None:
             return pytz.UTC, f"Warning: Cannot determine timezone for city {city} with longitude {longitude}. Using UTC as default."
-        return pytz.timezone(timezone_str), None
+        return tz, None
     except Exception as e:
         return pytz.UTC, f"Warning: Failed to determine timezone for city {city} due to {str(e)}. Using UTC as default."
 
 def calc_solar_term(jd):
-    """Calculate the solar term based on Julian date."""
-    sun = ephem.Sun()
-    observer = ephem.Observer()
-    observer.date = ephem.julian_date(jd)
-    sun.compute(observer)
-    hlon = sun.hlon * 180 / 3.14159
-    if 315 <= hlon < 345:
-        return "Yin"
-    return "Mao"
+    """Calculate the month branch (solar term month) based on Julian date."""
+    _, month_branch_idx = solar_month(jd)
+    return ZHI[month_branch_idx]
 
-def get_four_pillars(birth_datetime, location):
+def month_stem_idx(year_stem_idx, month_branch_idx):
+    """Month stem from the year stem (五虎遁): the Yin month of a Jia/Ji year is Bing."""
+    return (year_stem_idx * 2 + 2 + (month_branch_idx - 2) % 12) % 10
+
+class Chart(namedtuple("Chart", ["year", "month", "day", "hour"])):
     """
-    Calculate the Four Pillars (Year, Month, Day, Hour) based on birth date and location.
-    
+    The Four Pillars as sexagenary cycle indices 0-59 (0 = Jia Zi, 1 = Yi Chou, ...): a pillar i
+    has stem GAN[i % 10] and branch ZHI[i % 12]. Four small ints in a tuple, so a chart is cheap
+    to hold and hash; the nested string form is only built by pillars() and names().
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_pillars(cls, four_pillars):
+        """The chart of get_four_pillars()'s dict form."""
+        return cls(*(jiazi(GAN_INDEX[four_pillars[key]["stem"]], ZHI_INDEX[four_pillars[key]["branch"]])
+                     for key in PILLAR_KEYS))
+
+    def pillars(self):
+        """{"year_pillar": {"stem": "Geng", "branch": "Wu"}, ...}, as get_four_pillars returns them."""
+        return {key: {"stem": GAN[i % 10], "branch": ZHI[i % 12]} for key, i in zip(PILLAR_KEYS, self)}
+
+    def names(self):
+        """{"year_pillar": "Geng Wu", ...}"""
+        return {key: JIAZI_NAMES[i] for key, i in zip(PILLAR_KEYS, self)}
+
+
+def jiazi(stem_idx, branch_idx):
+    """Sexagenary cycle index of a stem and branch (of the same parity, as every real pillar is)."""
+    return (6 * stem_idx - 5 * branch_idx) % 60
+
+def clashing_branch(branch_idx):
+    """The branch opposite in the twelve (六冲): Zi-Wu, Chou-Wei, Yin-Shen, ..."""
+    return (branch_idx + 6) % 12
+
+def combining_branch(branch_idx):
+    """The branch's six-harmony partner (六合): Zi-Chou, Yin-Hai, Mao-Xu, Chen-You, Si-Shen, Wu-Wei."""
+    return (1 - branch_idx) % 12
+
+def compute_chart(birth_datetime, location):
+    """
+    The Chart for a birth, with the local datetime it was read from and any timezone warning.
+
     Args:
-        birth_datetime (str): Birth date and time in ISO format (e.g., "1990-03-12T15:00:00Z").
-        location (str or dict): Location as a string (e.g., "Tokyo, Japan") or dict (e.g., {"city": "Tokyo", "longitude": 139.7}).
-    
+        birth_datetime (str or datetime): As for get_four_pillars.
+        location (str or dict): As for get_four_pillars.
+
     Returns:
-        dict: Four Pillars with their Heavenly Stems and Earthly Branches.
+        tuple: (Chart, timezone-aware local datetime, warning or None).
     """
     try:
         # Parse birth datetime
@@ -74,12 +128,14 @@ def get_four_pillars(birth_datetime, location):
             latitude = location.get("latitude", None)
         else:
             city = location
-            longitude = 0  # Simplified for in-browser compatibility
+            # Offline gazetteer; unknown places keep the longitude-only approximation
+            place = resolve_place(location) if location else None
+            longitude = place.longitude if place else 0
             latitude = None
 
         tz, warning = get_timezone(city, longitude, latitude)
         if warning:
-            logging.warning(warning)
+            log_event(logger, logging.WARNING, "Timezone undetermined, using UTC", location=location)
 
         # Localize datetime to the correct timezone
         dt = tz.localize(dt) if dt.tzinfo is None else dt.astimezone(tz)
@@ -87,87 +143,184 @@ def get_four_pillars(birth_datetime, location):
         # Calculate Julian date
         jd = to_julian(dt)
 
-        # Year Pillar
-        year = dt.year
+        # Year Pillar (the solar year starts at Lichun, not on January 1)
+        year, month_branch_idx = solar_month(jd)
         year_stem_idx = (year - 4) % 10
-        year_branch_idx = (year - 4) % 12
-        year_pillar = {"stem": GAN[year_stem_idx], "branch": ZHI[year_branch_idx]}
+        year_pillar = (year - 4) % 60
 
         # Month Pillar
-        month_branch = calc_solar_term(jd)
-        month_branch_idx = ZHI.index(month_branch)
-        month_stem_base = (year_stem_idx * 2 + month_branch_idx) % 10
-        month_pillar = {"stem": GAN[month_stem_base], "branch": month_branch}
+        month_pillar = jiazi(month_stem_idx(year_stem_idx, month_branch_idx), month_branch_idx)
 
         # Day Pillar
-        day_number = int(jd - JD_ORIGIN + 0.5)
-        day_stem_idx = day_number % 10
-        day_branch_idx = day_number % 12
-        day_pillar = {"stem": GAN[day_stem_idx], "branch": ZHI[day_branch_idx]}
-
-        # Hour Pillar
-        hour = dt.hour
-        for zhi, (start, end) in ZHI_HOUR_MAPPING.items():
-            if start <= hour < end or (start > end and (hour >= start or hour < end)):
-                hour_branch = zhi
-                break
-        else:
-            hour_branch = "Zi" if hour == 23 else "Unknown"
-        hour_branch_idx = ZHI.index(hour_branch)
-        hour_stem_base = (day_stem_idx * 2 + hour_branch_idx) % 10
-        hour_pillar = {"stem": GAN[hour_stem_base], "branch": hour_branch}
-
-        result = {
-            "year_pillar": year_pillar,
-            "month_pillar": month_pillar,
-            "day_pillar": day_pillar,
-            "hour_pillar": hour_pillar,
-            "timestampTST": dt.isoformat(),
-            "warning": warning
-        }
-        return result
+        day_pillar = int(jd - JD_ORIGIN + 0.5) % 60
+
+        # Hour Pillar: Zi is 23:00-01:00, then two-hour buckets (ZHI_HOUR_MAPPING)
+        hour_branch_idx = ((dt.hour + 1) // 2) % 12
+        hour_pillar = jiazi((day_pillar % 10 * 2 + hour_branch_idx) % 10, hour_branch_idx)
+
+        return Chart(year_pillar, month_pillar, day_pillar, hour_pillar), dt, warning
     except Exception as e:
-        logging.error(f"Error in get_four_pillars: {str(e)}")
+        log_event(logger, logging.ERROR, "Error in compute_chart", birth_datetime=str(birth_datetime), location=location,
+                  error=type(e).__name__)
         raise
 
+def get_four_pillars(birth_datetime, location):
+    """
+    Calculate the Four Pillars (Year, Month, Day, Hour) based on birth date and location.
+    
+    Args:
+        birth_datetime (str): Birth date and time in ISO format (e.g., "1990-03-12T15:00:00Z").
+        location (str or dict): Location as a string (e.g., "Tokyo, Japan") or dict (e.g., {"city": "Tokyo", "longitude": 139.7}).
+    
+    Returns:
+        dict: Four Pillars with their Heavenly Stems and Earthly Branches. compute_chart() gives
+        the same chart as a Chart of cycle indices.
+    """
+    chart, dt, warning = compute_chart(birth_datetime, location)
+    result = chart.pillars()
+    result["timestampTST"] = dt.isoformat()
+    result["warning"] = warning
+    return result
+
+def luck_direction(year_pillar, gender='unknown'):
+    """+1 (forward) for a man born in a yang year or a woman (or unknown) in a yin year, else -1; any index of the year stem's parity will do."""
+    return 1 if (year_pillar % 2 == 0) == (gender == 'male') else -1
+
+def luck_pillar_indices(chart, gender='unknown', count=8):
+    """The luck pillars (Da Yun) of a Chart as sexagenary indices: the month pillar's neighbours in the cycle."""
+    step = luck_direction(chart.year, gender)
+    return tuple((chart.month + i * step) % 60 for i in range(1, count + 1))
+
 def get_luck_pillars(four_pillars, gender='unknown'):
     """
     Calculate Luck Pillars (Da Yun) based on the Four Pillars.
     
     Args:
-        four_pillars (dict): The Four Pillars result from get_four_pillars.
+        four_pillars (dict or Chart): The Four Pillars result from get_four_pillars, or a Chart.
         gender (str): Gender of the person ('male', 'female', or 'unknown').
     
     Returns:
         list: List of Luck Pillars with their Heavenly Stems and Earthly Branches.
     """
     try:
-        year_stem = four_pillars['year_pillar']['stem']
-        month_branch = four_pillars['month_pillar']['branch']
-        year_stem_idx = GAN.index(year_stem)
-        month_branch_idx = ZHI.index(month_branch)
-
-        # Determine direction of luck pillars (forward or backward)
-        if gender == 'male':
-            direction = 1 if year_stem_idx % 2 == 0 else -1
-        else:  # Female or unknown
-            direction = -1 if year_stem_idx % 2 == 0 else 1
+        if isinstance(four_pillars, Chart):
+            year, month = four_pillars.year, four_pillars.month
+        else:
+            year = GAN_INDEX[four_pillars['year_pillar']['stem']]
+            month = jiazi(GAN_INDEX[four_pillars['month_pillar']['stem']], ZHI_INDEX[four_pillars['month_pillar']['branch']])
+        step = luck_direction(year, gender)
 
+        # 8 luck pillars of 10 years each, stepping through the sixty Jiazi from the month pillar
         luck_pillars = []
-        for i in range(1, 9):  # Calculate 8 luck pillars (10 years each)
-            new_month_branch_idx = (month_branch_idx + i * direction) % 12
-            if new_month_branch_idx < 0:
-                new_month_branch_idx += 12
-            new_month_branch = ZHI[new_month_branch_idx]
-            new_month_stem_base = (year_stem_idx * 2 + new_month_branch_idx) % 10
-            new_month_stem = GAN[new_month_stem_base]
-            luck_pillars.append({
-                "start_age": i * 10,
-                "stem": new_month_stem,
-                "branch": new_month_branch
-            })
-
+        for i in range(1, 9):
+            pillar = (month + i * step) % 60
+            luck_pillars.append({"start_age": i * 10, "stem": GAN[pillar % 10], "branch": ZHI[pillar % 12]})
         return luck_pillars
     except Exception as e:
         logging.error(f"Error in get_luck_pillars: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def _utc_offsets_us(tz, utc_us):
+    """Vectorized UTC offsets (microseconds) of a pytz zone for int64 UTC microsecond timestamps."""
+    import numpy as np
+    transitions = getattr(tz, '_utc_transition_times', None)
+    if not transitions:
+        offset = tz.utcoffset(datetime.datetime(2000, 1, 1)) or datetime.timedelta(0)
+        return np.full(utc_us.shape, offset // datetime.timedelta(microseconds=1), dtype=np.int64)
+    # Same bisect as pytz's DstTzInfo.fromutc, over all records at once
+    transition_us = np.array(transitions, dtype='datetime64[us]').astype(np.int64)
+    offsets_us = np.array([info[0] // datetime.timedelta(microseconds=1) for info in tz._transition_info], dtype=np.int64)
+    idx = np.maximum(np.searchsorted(transition_us, utc_us, side='right') - 1, 0)
+    return offsets_us[idx]
+
+def get_four_pillars_batch(timestamps, timezones=None, longitudes=None, latitudes=None):
+    """
+    Calculate the Four Pillars for many birth records at once with vectorized integer arithmetic.
+
+    Args:
+        timestamps (array-like): UTC birth instants, as numpy datetime64 values or Unix seconds.
+        timezones (array-like, optional): IANA timezone name per record (e.g. "Asia/Shanghai").
+        longitudes (array-like, optional): Longitude per record, used when timezones is not given.
+        latitudes (array-like, optional): Latitude per record, used with longitudes.
+
+    Returns:
+        dict: Columnar int arrays (year_stem, year_branch, month_stem, month_branch, day_stem,
+        day_branch, hour_stem, hour_branch, utc_offset in seconds), each indexing GAN / ZHI.
+        Row i equals get_four_pillars() for the same UTC instant and location.
+    """
+    import numpy as np
+    try:
+        timestamps = np.asarray(timestamps)
+        if np.issubdtype(timestamps.dtype, np.datetime64):
+            utc_us = timestamps.astype('datetime64[us]').astype(np.int64)
+        else:
+            utc_us = np.round(timestamps.astype(np.float64) * 1e6).astype(np.int64)
+        n = utc_us.shape[0]
+
+        # Resolve each distinct location once, then group records by timezone
+        if timezones is not None:
+            tz_names, tz_codes = np.unique(np.asarray(timezones, dtype=str), return_inverse=True)
+            zones = [pytz.timezone(name) for name in tz_names]
+        elif longitudes is not None:
+            lng = np.asarray(longitudes, dtype=np.float64)
+            lat = np.full(n, np.nan) if latitudes is None else np.asarray(latitudes, dtype=np.float64)
+            locations, location_codes = np.unique(np.stack([lng, lat], axis=1), axis=0, return_inverse=True)
+            zones = []
+            for location_lng, location_lat in locations:
+                tz, warning = get_timezone(None, float(location_lng), None if np.isnan(location_lat) else float(location_lat))
+                if warning:
+                    log_event(logger, logging.WARNING, "Timezone undetermined, using UTC",
+                              location=(float(location_lng), None if np.isnan(location_lat) else float(location_lat)))
+                zones.append(tz)
+            tz_codes = location_codes.reshape(-1)
+        else:
+            zones, tz_codes = [pytz.UTC], np.zeros(n, dtype=np.int64)
+
+        offset_us = np.zeros(n, dtype=np.int64)
+        for code, tz in enumerate(zones):
+            mask = tz_codes == code
+            if mask.any():
+                offset_us[mask] = _utc_offsets_us(tz, utc_us[mask])
+
+        # Julian date exactly as to_julian() computes it from the aware datetime
+        jd = (utc_us.astype(np.float64) / 1e6) / 86400.0 + 2440587.5
+
+        # Year and Month Pillars from the solar term table
+        start_year, table = load_term_table()
+        term_idx = np.full(n, -1, dtype=np.int64)
+        if table is not None:
+            terms = np.frombuffer(table, dtype=np.int64)
+            term_idx = np.searchsorted(terms, (jd - UNIX_EPOCH_JD) * 86400, side='right') - 1
+            in_table = (term_idx >= 0) & (term_idx < len(terms) - 1)
+        else:
+            in_table = np.zeros(n, dtype=bool)
+        months_since_lichun = (term_idx - 2) // 2
+        year = start_year + months_since_lichun // 12 if table is not None else np.zeros(n, dtype=np.int64)
+        month_branch = (2 + months_since_lichun) % 12
+        for i in np.flatnonzero(~in_table):
+            year[i], month_branch[i] = solar_month(float(jd[i]))
+        year_stem = (year - 4) % 10
+        year_branch = (year - 4) % 12
+        month_stem = (year_stem * 2 + 2 + (month_branch - 2) % 12) % 10
+
+        # Day Pillar: int() truncates toward zero, as in the scalar path
+        day_number = np.trunc(jd - JD_ORIGIN + 0.5).astype(np.int64)
+        day_stem = day_number % 10
+        day_branch = day_number % 12
+
+        # Hour Pillar from local wall-clock hour: Zi is 23:00-01:00, then two-hour buckets
+        local_hour = ((utc_us + offset_us) // 3_600_000_000) % 24
+        hour_branch = ((local_hour + 1) // 2) % 12
+        hour_stem = (day_stem * 2 + hour_branch) % 10
+
+        return {
+            "year_stem": year_stem, "year_branch": year_branch,
+            "month_stem": month_stem, "month_branch": month_branch,
+            "day_stem": day_stem, "day_branch": day_branch,
+            "hour_stem": hour_stem, "hour_branch": hour_branch,
+            "utc_offset": offset_us // 1_000_000
+        }
+    except Exception as e:
+        # Messages from datetime/pytz can repeat the timestamps, so only the error type is logged
+        log_event(logger, logging.ERROR, "Error in get_four_pillars_batch", records=np.size(timestamps), error=type(e).__name__)
+        raise
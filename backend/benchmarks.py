@@ -0,0 +1,1567 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import logging
+import random
+import datetime
+import platform
+import tracemalloc
+import pytz
+
+import bazi_core
+import extraction
+import retrieval
+import sessions
+import resilience
+import metrics
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Fixed corpora and the stored baseline for the benchmark suite
+BENCHMARK_DATA_DIR = os.path.join(BACKEND_DIR, "..", "data", "benchmarks")
+BENCHMARK_BASELINE_PATH = os.path.join(BENCHMARK_DATA_DIR, "baseline.json")
+# A suite benchmark regresses when ops/sec drops, or peak allocation per op grows, by more than these fractions
+BENCH_SPEED_TOLERANCE = float(os.environ.get("BENCH_SPEED_TOLERANCE", "0.3"))
+BENCH_ALLOC_TOLERANCE = float(os.environ.get("BENCH_ALLOC_TOLERANCE", "0.1"))
+# Allocation differences below this many bytes per op are never flagged
+BENCH_ALLOC_SLACK_BYTES = 256
+# Cold-start import budget per module (cumulative microseconds from `python -X importtime`)
+IMPORT_TIME_BUDGET_US = {
+    "main": int(os.environ.get("IMPORT_BUDGET_MAIN_US", "100000")),
+    "bazi_core": int(os.environ.get("IMPORT_BUDGET_BAZI_CORE_US", "100000"))
+}
+QUERY_CORPUS = [
+    "I was born on 1990-03-12 15:00 in Beijing, China. How is my career?",
+    "Born in Tokyo on March 12, 1990 at 3:30 PM, what about my love life?",
+    "12th August 1985, born in London. Tell me about my health",
+    "What will my future hold?",
+    "Should I change my job this year?",
+    "What is the date today?",
+    "New York, 1978-11-02",
+    "我出生于上海，1992年5月8日下午3点，想问事业",
+    "1990年3月12日 出生在 北京 ，感情运势如何？",
+    "告诉我 健康 运势",
+    "今天天气怎么样",
+    "我的 爱情 何时 到来"
+]
+# (query, id of a passage that must appear in the top RETRIEVAL_TOP_K results)
+RETRIEVAL_RELEVANCE = [
+    ("What is yin and yang?", "term1"),
+    ("什么是阴阳", "term1"),
+    ("Explain the five elements", "doc2"),
+    ("What are the heavenly stems?", "term3"),
+    ("天干是什么", "term3"),
+    ("What does BaZi mean?", "term7"),
+    ("八字是什么意思", "term7"),
+    ("Which element controls fire?", "doc4"),
+    ("How does wood generate fire?", "doc3"),
+    ("Career guidance for my dominant element", "doc14"),
+    ("我的事业适合什么五行", "doc14"),
+    ("relationship compatibility between elements", "doc15"),
+    ("我的感情和婚姻", "doc15"),
+    ("How can I balance qi for better health?", "doc13"),
+    ("健康和五行的关系", "doc11"),
+    ("Which amulet helps a Wood person's career?", "doc16"),
+    ("Traits of a Water element person", "doc10"),
+    ("Metal element personality", "doc9")
+]
+# (location string, gazetteer place it must resolve to; None when it must not resolve)
+GAZETTEER_CASES = [
+    ("Beijing", "Beijing"),
+    ("beijing city", "Beijing"),
+    ("北京市", "Beijing"),
+    ("中国北京", "Beijing"),
+    ("Peking", "Beijing"),
+    ("Bejing", "Beijing"),
+    ("Shenzhen, Guangdong, China", "Shenzhen"),
+    ("广东省深圳市", "Shenzhen"),
+    ("Tokyo on March", "Tokyo"),
+    ("San Fransisco", "San Francisco"),
+    ("São Paulo", "Sao Paulo"),
+    ("Shangh", "Shanghai"),
+    ("NYC", "New York"),
+    ("the UK", "United Kingdom"),
+    ("香港", "Hong Kong"),
+    ("臺北", "Taipei"),
+    ("Shanxi", "Shanxi"),
+    ("Shaanxi", "Shaanxi"),
+    ("Atlantis", None),
+    ("my hometown", None)
+]
+# One multi-turn conversation: missing details, a chit-chat turn, the fortune, then a turn that changes nothing
+SESSION_CONVERSATION = [
+    "What will my future hold?",
+    "I was born on 1990-03-12 15:00",
+    "What is the date today?",
+    "Beijing",
+    "career",
+    "Thank you!",
+    "Thank you!"
+]
+# Conversations replayed through both handler paths by check_async_matches_sync
+ASYNC_CONVERSATIONS = [
+    SESSION_CONVERSATION,
+    ["I was born on 1990-03-12 15:00 in Beijing. How is my career?", "What about love?"],
+    ["我出生于上海，1992年5月8日下午3点，想问事业", "今天天气怎么样"],
+    ["Should I change my job this year?", "1985-08-12 09:30", "London"]
+]
+# Turns whose extraction depends on what the session already holds (the second turn misses every field)
+SESSION_DEPENDENT_CONVERSATION = ["I was born on 1990-03-12 15:00", "嗯", "Beijing", "嗯"]
+PILLAR_KEYS = ["year_pillar", "month_pillar", "day_pillar", "hour_pillar"]
+BATCH_TIMEZONES = ["Asia/Shanghai", "Asia/Tokyo", "America/New_York", "Europe/London", "Australia/Sydney", "UTC"]
+
+
+def check(condition, details=None):
+    """
+    Fail a check with AssertionError(details) unless condition holds. Unlike assert this is not
+    stripped under python -O; details may be a callable for ones only worth building on failure.
+    """
+    if not condition:
+        raise AssertionError(details() if callable(details) else details)
+
+
+def birth_record_corpus(n, seed=0):
+    """Deterministic (UTC unix seconds, timezone name) birth records spread over 1920-2030."""
+    rng = random.Random(seed)
+    start = datetime.datetime(1920, 1, 1, tzinfo=pytz.UTC).timestamp()
+    end = datetime.datetime(2030, 1, 1, tzinfo=pytz.UTC).timestamp()
+    return [(rng.randrange(int(start), int(end)), rng.choice(BATCH_TIMEZONES)) for _ in range(n)]
+
+
+def check_batch_matches_scalar(n=2000, seed=0):
+    """Assert get_four_pillars_batch agrees with get_four_pillars on every record of a sample."""
+    records = birth_record_corpus(n, seed)
+    result = bazi_core.get_four_pillars_batch([ts for ts, _ in records], timezones=[tz for _, tz in records])
+    original_get_timezone = bazi_core.get_timezone
+    try:
+        for i, (ts, tz_name) in enumerate(records):
+            bazi_core.get_timezone = lambda city, longitude, latitude=None: (pytz.timezone(tz_name), None)
+            dt = datetime.datetime.fromtimestamp(ts, tz=pytz.UTC)
+            pillars = bazi_core.get_four_pillars(dt, tz_name)
+            for key in PILLAR_KEYS:
+                prefix = key.split("_")[0]
+                stem = bazi_core.GAN[result[f"{prefix}_stem"][i]]
+                branch = bazi_core.ZHI[result[f"{prefix}_branch"][i]]
+                if (stem, branch) != (pillars[key]["stem"], pillars[key]["branch"]):
+                    raise AssertionError(f"Record {i} ({dt.isoformat()} {tz_name}) {key}: batch {stem} {branch} != scalar {pillars[key]}")
+    finally:
+        bazi_core.get_timezone = original_get_timezone
+    return n
+
+
+def bench_four_pillars_batch(n=200000, seed=0):
+    """Records per second for the scalar loop (on a sample) and the batch API."""
+    import numpy as np
+    records = birth_record_corpus(n, seed)
+    timestamps = np.array([ts for ts, _ in records], dtype=np.int64)
+    timezones = np.array([tz for _, tz in records])
+
+    start = time.perf_counter()
+    bazi_core.get_four_pillars_batch(timestamps, timezones=timezones)
+    batch_rate = n / (time.perf_counter() - start)
+
+    sample = records[:2000]
+    start = time.perf_counter()
+    for ts, tz_name in sample:
+        bazi_core.get_four_pillars(datetime.datetime.fromtimestamp(ts, tz=pytz.UTC), {"city": tz_name})
+    scalar_rate = len(sample) / (time.perf_counter() - start)
+    return {"batch_records_per_sec": batch_rate, "scalar_records_per_sec": scalar_rate}
+
+
+def bench_extraction(rounds=2000):
+    """Queries per second for a cold regex scan and for memoized lookups over QUERY_CORPUS."""
+    queries = [(query, extraction.detect_language(query)) for query in QUERY_CORPUS]
+    scan = extraction._extract_query.__wrapped__
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for query, lang in queries:
+                scan(query, lang)
+        cold_rate = rounds * len(queries) / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for query, lang in queries:
+                extraction.extract_query(query, lang)
+        memoized_rate = rounds * len(queries) / (time.perf_counter() - start)
+    finally:
+        logger.setLevel(level)
+    return {"cold_queries_per_sec": cold_rate, "memoized_queries_per_sec": memoized_rate}
+
+
+def bench_retrieval(rounds=2000):
+    """Recall@k and MRR over RETRIEVAL_RELEVANCE, plus search latency percentiles in microseconds."""
+    index = retrieval.get_index()
+    hits, reciprocal_ranks = 0, 0.0
+    for query, expected_id in RETRIEVAL_RELEVANCE:
+        ids = [passage["id"] for _, passage in index.search(query)]
+        if expected_id in ids:
+            hits += 1
+            reciprocal_ranks += 1 / (ids.index(expected_id) + 1)
+    latencies = []
+    for _ in range(rounds):
+        for query, _ in RETRIEVAL_RELEVANCE:
+            start = time.perf_counter()
+            index.search(query)
+            latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return {
+        "recall_at_k": hits / len(RETRIEVAL_RELEVANCE),
+        "mrr": reciprocal_ranks / len(RETRIEVAL_RELEVANCE),
+        "p50_us": latencies[len(latencies) // 2],
+        "p99_us": latencies[int(len(latencies) * 0.99)]
+    }
+
+
+def check_retrieval_fallback():
+    """
+    Fortunes use the local index over data/RAG when it can be read, and with the knowledge base
+    missing they are answered through managed retrieval instead of failing. Returns the model
+    calls per path.
+    """
+    import main
+    from fakes import install_fakes
+
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    path = retrieval.KNOWLEDGE_BASE_PATH
+    mode, main.RETRIEVAL_MODE = main.RETRIEVAL_MODE, "local"
+    report = {}
+    try:
+        for name, retrieval.KNOWLEDGE_BASE_PATH in (("local", path), ("missing", os.path.join(BACKEND_DIR, "missing_knowledge_base.jsonl"))):
+            retrieval.get_index.cache_clear()
+            runtime, agent_runtime, _ = install_fakes(main)
+            text = main.invoke_bedrock_with_knowledge_base("Tell me about my career", main.KNOWLEDGE_BASE_ID, "en")
+            check(text, name)
+            report[name] = {"invoke_model": len(runtime.calls), "retrieve_and_generate": len(agent_runtime.calls)}
+    finally:
+        retrieval.KNOWLEDGE_BASE_PATH = path
+        retrieval.get_index.cache_clear()
+        main.RETRIEVAL_MODE = mode
+        logger.setLevel(level)
+    check(report["local"]["retrieve_and_generate"] == 0 and report["missing"] == {"invoke_model": 0, "retrieve_and_generate": 1}, report)
+    return report
+
+
+def check_fortune_cache():
+    """
+    Stale fortunes are served once and regenerated by the next request for the key, on the
+    caller's thread, in place of that exact variant even when the pool shifted in between;
+    a failed refresh serves the stale text. Returns the cache stats.
+    """
+    import threading
+    from fortune_cache import FortuneCache
+
+    cache = FortuneCache(variants=2, fresh_seconds=0, stale_seconds=3600)
+    chart, generated = bazi_core.Chart(6, 15, 43, 44), []
+
+    def generate():
+        generated.append(f"fortune {len(generated)}")
+        return generated[-1]
+
+    def failing():
+        raise RuntimeError("model unavailable")
+
+    threads = threading.active_count()
+    for _ in range(2):
+        cache.get_or_generate(chart, "career", "en", generate)
+    key = cache.key(chart, "career", "en")
+    stale = cache.get_or_generate(chart, "career", "en", generate)
+    check(stale in generated[:2] and len(generated) == 2 and threading.active_count() == threads, (stale, generated))
+    fresh = cache.get_or_generate(chart, "career", "en", generate)
+    check(fresh == "fortune 2" and sorted(text for text, _ in cache._pools[key]) == sorted(set(generated[:2]) - {stale} | {fresh}),
+          cache._pools[key])
+
+    # The other variant leaves the pool between the stale hit and the refresh
+    stale = cache.get_or_generate(chart, "career", "en", generate)
+    cache._pools[key][:] = [variant for variant in cache._pools[key] if variant[0] == stale]
+    fresh = cache.get_or_generate(chart, "career", "en", generate)
+    check([text for text, _ in cache._pools[key]] == [fresh], cache._pools[key])
+
+    cache.get_or_generate(chart, "career", "en", generate)
+    stale = cache.get_or_generate(chart, "career", "en", generate)
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        check(cache.get_or_generate(chart, "career", "en", failing) == stale)
+        check("".join(cache.get_or_generate_stream(chart, "career", "en", lambda: iter(["new ", "fortune"]))) in {text for text, _ in cache._pools[key]})
+    finally:
+        logger.setLevel(level)
+    return cache.stats()
+
+
+def check_timezone_cache(points=200, maxsize=50):
+    """
+    Persisted timezone cache entries round-trip through save/load: load returns the number kept
+    (trimmed to the room left in the cache, 0 for another grid) and kept cells hit without
+    calling the resolver. Returns the reloaded cache's stats.
+    """
+    import tempfile
+    from timezone_cache import TimezoneCache
+
+    resolved = []
+
+    def resolver(lat, lng):
+        resolved.append((lat, lng))
+        return "Asia/Shanghai" if lng > 0 else "America/New_York"
+
+    rng = random.Random(0)
+    coords = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(points)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tz_cache.json")
+        cache = TimezoneCache(resolver, grid=0.01, maxsize=points, path=path, autosave_every=points + 1)
+        expected = [cache.lookup(lat, lng)[1] for lat, lng in coords]
+        size = cache.stats()["size"]
+        cache.save()
+
+        reloaded = TimezoneCache(resolver, grid=0.01, maxsize=points, path=path)
+        check(reloaded.load() == size == len(reloaded._entries), (size, len(reloaded._entries)))
+        resolved.clear()
+        check([reloaded.lookup(lat, lng)[1] for lat, lng in coords] == expected and not resolved, resolved)
+
+        trimmed = TimezoneCache(resolver, grid=0.01, maxsize=maxsize, path=path)
+        check(trimmed.load() == maxsize == len(trimmed._entries), len(trimmed._entries))
+        # The most recently used cells are the ones kept
+        resolved.clear()
+        trimmed.lookup(*coords[-1])
+        check(not resolved, resolved)
+
+        partial = TimezoneCache(resolver, grid=0.01, maxsize=maxsize, path=path)
+        partial._loaded = True
+        partial.lookup(*coords[0])
+        partial.lookup(-89.0, -179.0)
+        check(partial.load() == maxsize - 2 == len(partial._entries) - 2, len(partial._entries))
+
+        logger = logging.getLogger()
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            other_grid = TimezoneCache(resolver, grid=0.1, maxsize=points, path=path)
+            check(other_grid.load() == 0 and not other_grid._entries, len(other_grid._entries))
+        finally:
+            logger.setLevel(level)
+    return reloaded.stats()
+
+
+def check_llm_cache():
+    """
+    The LLM response cache on a fake clock: local entries expire after their TTL, calls at or
+    above LLM_CACHE_BYPASS_TEMPERATURE always reach the model, and an entry set through one
+    container's SQLite shared tier is served to another only until the shared copy expires.
+    """
+    import types
+    import tempfile
+    import main
+    import llm_cache
+    from fakes import install_fakes
+
+    clock = types.SimpleNamespace(now=1000.0)
+    real_time, llm_cache.time = llm_cache.time, types.SimpleNamespace(time=lambda: clock.now)
+    report = {}
+    try:
+        cache = llm_cache.LLMResponseCache()
+        cache.set("key", b"body", 10)
+        clock.now += 5
+        check(cache.get("key", 10) == b"body")
+        clock.now += 6
+        check(cache.get("key", 10) is None and cache.stats()["misses"] == 1, cache.stats())
+
+        check(cache.ttl_for("classification", 0.5) == llm_cache.PROMPT_TYPE_TTLS["classification"])
+        check(cache.ttl_for("classification", cache.bypass_temperature) is None and cache.ttl_for("fortune", 0) is None)
+        runtime, _, _ = install_fakes(main)
+        main.get_llm_cache.cache_clear()
+        messages = [{"role": "user", "content": "Is this about fortune-telling?"}]
+        for temperature in (0.0, 0.0, 0.95, 0.95):
+            main.invoke_bedrock_with_retry(messages, temperature=temperature, prompt_type="classification")
+        check(len(runtime.calls) == 3 and main.get_llm_cache().stats()["bypasses"] == 2, main.get_llm_cache().stats())
+        main.get_llm_cache.cache_clear()
+
+        with tempfile.TemporaryDirectory() as directory:
+            tier = llm_cache.SQLiteCacheTier(os.path.join(directory, "llm_cache.sqlite"))
+            writer = llm_cache.LLMResponseCache(shared=tier)
+            writer.set("key", b"shared body", 100)
+            clock.now += 90
+            reader = llm_cache.LLMResponseCache(shared=tier)
+            check(reader.get("key", 100) == b"shared body" and reader.stats()["shared_hits"] == 1, reader.stats())
+            check(reader.get("key", 100) == b"shared body" and reader.stats()["local_hits"] == 1, reader.stats())
+            # The local copy expires with the shared entry, not a full TTL after it was copied
+            clock.now += 11
+            check(reader.get("key", 100) is None, reader.stats())
+            report = reader.stats()
+    finally:
+        llm_cache.time = real_time
+    return report
+
+
+def check_session_writes(turns=SESSION_CONVERSATION):
+    """
+    Replay a conversation through lambda_handler against FakeTable and return the table reads
+    and writes per turn (writes must be 0 or 1; follow-up turns should be served from the
+    in-container session cache), then check that two overlapping turns on one session merge
+    their changed fields instead of overwriting each other.
+    """
+    import json
+    import main
+    from fakes import install_fakes
+
+    _, _, table = install_fakes(main)
+    session_id, reads_per_turn, writes_per_turn = None, [], []
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        for query in turns:
+            reads, writes = table.reads, table.writes
+            response = main.lambda_handler({"body": json.dumps({"query": query}), "sessionId": session_id}, None)
+            if response is not None:
+                session_id = json.loads(response["body"]).get("sessionId", session_id)
+            reads_per_turn.append(table.reads - reads)
+            writes_per_turn.append(table.writes - writes)
+    finally:
+        logger.setLevel(level)
+    check(all(writes <= 1 for writes in writes_per_turn), writes_per_turn)
+
+    store = main.get_session_store()
+    first = sessions.SessionUnitOfWork(store, session_id)
+    second = sessions.SessionUnitOfWork(store, session_id)
+    first.stage(dict(first.session, category="career"))
+    second.stage(dict(second.session, state="asking_optional"))
+    first.flush()
+    second.flush()
+    merged = sessions.decode_session(table.items[session_id]["sessionData"])
+    check(second.conflicts == 1 and merged["category"] == "career" and merged["state"] == "asking_optional", merged)
+    return {
+        "reads_per_turn": reads_per_turn,
+        "writes_per_turn": writes_per_turn,
+        "json_bytes": len(json.dumps(merged)),
+        "encoded_bytes": len(table.items[session_id]["sessionData"])
+    }
+
+
+def check_resilience():
+    """
+    Under sustained throttling (fake Bedrock rejecting every call, 5 s Lambda timeout), each
+    turn must return within its deadline, answered from the regex/template path, and the
+    circuit breaker must stop later turns from calling Bedrock at all.
+    """
+    import json
+    import main
+    from fakes import install_fakes, FakeBedrockRuntime, FakeBedrockAgentRuntime, FakeLambdaContext
+
+    runtime, _, _ = install_fakes(main, FakeBedrockRuntime(throttle=1.0), FakeBedrockAgentRuntime())
+    resilience.circuit_breaker = resilience.CircuitBreaker(threshold=3, reset_seconds=60)
+    session_id, durations, calls_per_turn, replies = None, [], [], []
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        for query in ["What will my future hold?", "Should I change my job this year?", "What is the date today?"]:
+            calls, start = len(runtime.calls), time.perf_counter()
+            response = main.lambda_handler({"body": json.dumps({"query": query}), "sessionId": session_id},
+                                           FakeLambdaContext(timeout=5.0))
+            durations.append(time.perf_counter() - start)
+            calls_per_turn.append(len(runtime.calls) - calls)
+            body = json.loads(response["body"])
+            session_id = body.get("sessionId", session_id)
+            replies.append(body.get("nextQuestion") or body.get("response"))
+    finally:
+        logger.setLevel(level)
+    check(max(durations) < 5.0, durations)
+    check(calls_per_turn[-1] == 0 and resilience.circuit_breaker.state == "open", calls_per_turn)
+    check(not any(reply.startswith("Error") for reply in replies), replies)
+    counters = resilience.stats()
+    check_half_open_sheds()
+    return {"seconds_per_turn": durations, "calls_per_turn": calls_per_turn, "replies": replies,
+            "counters": counters}
+
+
+def check_half_open_sheds():
+    """
+    A half-open breaker's trial call that is shed (by the deadline, cancellation or the
+    gateway's concurrency limit) frees the trial slot without reopening the breaker, so the
+    next call is still tried and closes it.
+    """
+    import threading
+    import contextvars
+    from model_gateway import ConcurrencyLimited
+
+    def half_open_breaker():
+        breaker = resilience.CircuitBreaker(threshold=1, reset_seconds=0)
+        breaker.record_failure()
+        check(breaker.state == "half_open", breaker.state)
+        return breaker
+
+    def concurrency_limited():
+        raise ConcurrencyLimited("Too many in-flight requests")
+
+    def past_deadline(operation, breaker):
+        token = resilience.request_deadline.set(time.monotonic() - 1)
+        try:
+            resilience.call_with_budget(operation, breaker=breaker)
+        finally:
+            resilience.request_deadline.reset(token)
+
+    def cancelled(operation, breaker):
+        event = threading.Event()
+        event.set()
+
+        def call():
+            resilience.call_cancelled.set(event)
+            resilience.call_with_budget(operation, breaker=breaker)
+
+        contextvars.copy_context().run(call)
+
+    sheds = [
+        (resilience.DeadlineExceeded, lambda breaker: past_deadline(lambda: "ok", breaker)),
+        (resilience.CallCancelled, lambda breaker: cancelled(lambda: "ok", breaker)),
+        (ConcurrencyLimited, lambda breaker: resilience.call_with_budget(concurrency_limited, breaker=breaker)),
+    ]
+    for shed, call in sheds:
+        breaker = half_open_breaker()
+        try:
+            call(breaker)
+            check(False, f"expected {shed.__name__}")
+        except shed:
+            pass
+        check(breaker.state == "half_open" and resilience.call_with_budget(lambda: "ok", breaker=breaker) == "ok"
+              and breaker.state == "closed", (shed.__name__, breaker.state))
+
+
+def bench_gateway_hedging(calls=400, threads=16):
+    """
+    Caller-observed latency of short Haiku calls through ModelGateway against a fake whose
+    latency has a slow tail, with hedging off and on (to an explicit inference profile; base
+    model IDs are refused); also reports the extra calls hedging costs.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from fakes import FakeBedrockRuntime, tail_latency
+    from model_gateway import ModelGateway, HAIKU_MODEL_ID, MODEL_HEDGE_PROFILES
+
+    # A base model ID is not a hedge target (the old default): hedging stays off for it
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        check(not ModelGateway(None, None, hedge_profiles={HAIKU_MODEL_ID: HAIKU_MODEL_ID.split(".", 1)[1]}).hedge_profiles)
+    finally:
+        logger.setLevel(level)
+    messages = [{"role": "user", "content": "Respond with only a JSON object: {}"}]
+    report = {}
+    # The fake serves any profile; a deployment names its own in MODEL_HEDGE_PROFILES
+    for mode, profiles in (("unhedged", {}), ("hedged", MODEL_HEDGE_PROFILES or {HAIKU_MODEL_ID: "global.anthropic.claude-3-haiku-20240307-v1:0"})):
+        runtime = FakeBedrockRuntime(latency=tail_latency(seed=1))
+        gateway = ModelGateway(lambda: runtime, None, max_in_flight=threads * 2, hedge_profiles=profiles)
+        for _ in range(40):
+            gateway.invoke(HAIKU_MODEL_ID, messages, max_tokens=150)
+        runtime.calls.clear()
+
+        def timed_call(_):
+            start = time.perf_counter()
+            gateway.invoke(HAIKU_MODEL_ID, messages, max_tokens=150)
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = sorted(pool.map(timed_call, range(calls)))
+        report[mode] = {
+            "p50_ms": 1000 * latencies[len(latencies) // 2],
+            "p95_ms": 1000 * latencies[int(len(latencies) * 0.95)],
+            "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)],
+            "calls_per_request": len(runtime.calls) / calls,
+            "hedge_wins": gateway.hedge_wins
+        }
+    return report
+
+
+def fake_extraction_reply(prompt):
+    """Deterministic per-field answers to the combined extraction prompt, whichever fields it asks for."""
+    from fakes import default_reply
+    if "Respond with only a JSON object" not in prompt:
+        return default_reply(prompt)
+    query = prompt.split('Query: "', 1)[1].split('"\n', 1)[0]
+    answers = {
+        "birth_datetime": None,
+        "location": "Beijing" if "Beijing" in query else None,
+        "category": "career" if "job" in query else None,
+        "is_fortune_telling": not any(word in query for word in ("date today", "Thank", "天气"))
+    }
+    return json.dumps({field: value for field, value in answers.items() if f'"{field}"' in prompt})
+
+
+def check_extraction_calls(query="嗯"):
+    """
+    Model calls per turn for a query every extractor misses, with invoke_bedrock_with_retry
+    stubbed: one combined call in combined mode, one per missing field in sequential mode, and
+    per-field calls after the combined one only when it fails (not when it is shed).
+    """
+    import main
+    from resilience import CircuitOpen
+
+    lang = extraction.detect_language(query)
+    missing = main.missing_turn_fields(main.local_turn_values(query, lang), {})
+    check(len(missing) > 1, missing)
+    calls = []
+
+    def stub(combined_failure=None):
+        def invoke(messages, *args, prompt_type=None, **kwargs):
+            prompt = messages[0]["content"]
+            combined = "Respond with only a JSON object" in prompt
+            calls.append("combined" if combined else prompt_type)
+            if combined and combined_failure is not None:
+                raise combined_failure
+            text = json.dumps(dict.fromkeys(missing)) if combined else "None"
+            return {"body": io.BytesIO(json.dumps({"content": [{"type": "text", "text": text}]}).encode("utf-8"))}
+        return invoke
+
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    invoke, mode = main.invoke_bedrock_with_retry, main.EXTRACTION_FALLBACK_MODE
+    report = {"missing_fields": len(missing)}
+    try:
+        for name, fallback_mode, failure in (("combined", "combined", None), ("sequential", "sequential", None),
+                                             ("combined_failed", "combined", RuntimeError("ThrottlingException")),
+                                             ("combined_shed", "combined", CircuitOpen("Bedrock circuit breaker is open"))):
+            main.EXTRACTION_FALLBACK_MODE = fallback_mode
+            main.invoke_bedrock_with_retry = stub(failure)
+            calls.clear()
+            main.extract_turn(query, lang, {})
+            report[name] = list(calls)
+        calls.clear()
+        main.EXTRACTION_FALLBACK_MODE = "combined"
+        main.extract_turn(query, lang, {"necessary_answers": dict.fromkeys(missing, "known")})
+        report["nothing_missing"] = list(calls)
+    finally:
+        main.invoke_bedrock_with_retry = invoke
+        main.EXTRACTION_FALLBACK_MODE = mode
+        logger.setLevel(level)
+    check(report["combined"] == ["combined"], report)
+    check(len(report["sequential"]) == len(missing) and "combined" not in report["sequential"], report)
+    check(report["combined_failed"][0] == "combined" and len(report["combined_failed"]) == 1 + len(missing), report)
+    check(report["combined_shed"] == ["combined"] and report["nothing_missing"] == [], report)
+    return report
+
+
+def replay_conversations(handler, conversations, runtime_latency, table_latency):
+    """Run each conversation through handler against fresh fakes; returns (normalized transcript, seconds)."""
+    import main
+    from fakes import install_fakes, FakeBedrockRuntime, FakeBedrockAgentRuntime, FakeTable
+
+    transcript, elapsed = [], 0.0
+    for turns in conversations:
+        runtime, agent_runtime, table = install_fakes(main, FakeBedrockRuntime(runtime_latency, reply=fake_extraction_reply),
+                                                      FakeBedrockAgentRuntime(runtime_latency), FakeTable(table_latency))
+        main.get_llm_cache.cache_clear()
+        main.fortune_cache.invalidate()
+        session_id = None
+        for turn, query in enumerate(turns):
+            # Template variants and fortune pool picks are random; both paths must draw the same ones
+            random.seed(turn)
+            start = time.perf_counter()
+            response = handler({"body": json.dumps({"query": query}), "sessionId": session_id}, None)
+            elapsed += time.perf_counter() - start
+            if response is None:
+                transcript.append(None)
+                continue
+            body = json.loads(response["body"])
+            session_id = body.get("sessionId", session_id)
+            transcript.append((response["statusCode"], json.dumps(body, sort_keys=True).replace(session_id, "<session>")))
+        for item in table.items.values():
+            transcript.append(json.dumps(sessions.decode_session(item["sessionData"]), sort_keys=True).replace(session_id, "<session>"))
+        # Speculative work must not cost model calls (or send prompts) the sync path does not
+        transcript.append(sorted(call["modelId"] + call["prompt"] for call in runtime.calls + agent_runtime.calls))
+    return transcript, elapsed
+
+
+def check_async_matches_sync(runtime_latency=0.05, table_latency=0.02):
+    """
+    Replay ASYNC_CONVERSATIONS through main.lambda_handler and async_handler.lambda_handler,
+    in both extraction fallback modes, with stubbed Bedrock and DynamoDB; responses, stored
+    sessions and the model calls made per conversation must be identical, and a cancelled fallback must
+    not reach Bedrock. Returns the wall time of each path per mode.
+    """
+    import threading
+    import contextvars
+    import main
+    import async_handler
+    from fakes import install_fakes, FakeBedrockRuntime
+
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    mode = main.EXTRACTION_FALLBACK_MODE
+    # The container-wide rate limiter would otherwise pace the replay itself
+    limiter, resilience.rate_limiter = resilience.rate_limiter, resilience.TokenBucket(rate=0)
+    report = {}
+    try:
+        # A fallback cancelled before its call goes out is shed without calling Bedrock
+        runtime, _, _ = install_fakes(main, FakeBedrockRuntime())
+        cancelled = threading.Event()
+        cancelled.set()
+        context = contextvars.copy_context()
+        context.run(resilience.call_cancelled.set, cancelled)
+        check(context.run(main.extract_missing_fields, "嗯", "zh", ["category", "is_fortune_telling"]) ==
+              {"category": None, "is_fortune_telling": None} and not runtime.calls, runtime.calls)
+
+        # A turn failing after the session load still writes the new session, as lambda_handler does
+        def failing_turn_result(values):
+            raise RuntimeError("extraction failed")
+
+        turn_result, main.turn_result = main.turn_result, failing_turn_result
+        try:
+            for handler in (main.lambda_handler, async_handler.lambda_handler):
+                _, _, table = install_fakes(main)
+                try:
+                    handler({"body": json.dumps({"query": "Hello"})}, None)
+                    check(False, "expected the turn to fail")
+                except RuntimeError:
+                    pass
+                check(table.writes == 1, (handler.__module__, table.writes))
+        finally:
+            main.turn_result = turn_result
+
+        for main.EXTRACTION_FALLBACK_MODE in ("combined", "sequential"):
+            conversations = ASYNC_CONVERSATIONS + [SESSION_DEPENDENT_CONVERSATION]
+            sync_transcript, sync_seconds = replay_conversations(main.lambda_handler, conversations, runtime_latency, table_latency)
+            async_transcript, async_seconds = replay_conversations(async_handler.lambda_handler, conversations, runtime_latency, table_latency)
+            check(sync_transcript == async_transcript, lambda: next(
+                pair for pair in zip(sync_transcript, async_transcript) if pair[0] != pair[1]))
+            report[main.EXTRACTION_FALLBACK_MODE] = {"sync_seconds": sync_seconds, "async_seconds": async_seconds,
+                                                     "turns": sum(len(turns) for turns in conversations)}
+    finally:
+        main.EXTRACTION_FALLBACK_MODE = mode
+        resilience.rate_limiter = limiter
+        logger.setLevel(level)
+    return report
+
+
+def check_fortune_stream(query="I was born on 1990-03-12 15:00 in Beijing. How is my career?"):
+    """
+    A streamed fortune whose model call is shed before the first token, or fails part-way,
+    ends with the busy template and leaves the session in delivering_fortune (main and
+    async_handler stream handlers alike); asking again then delivers it. Returns the final
+    state after each turn per handler.
+    """
+    import json
+    import main
+    import async_handler
+    from fakes import FakeBedrockRuntime, install_fakes
+
+    class FailingRuntime(FakeBedrockRuntime):
+        failure = None
+
+        def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+            response = super().invoke_model_with_response_stream(body, modelId, **kwargs)
+            if self.failure is None or "Respond with only a JSON object" in self.calls[-1]["prompt"]:
+                return response
+            failure = self.failure
+
+            def events():
+                if failure == "shed":
+                    raise resilience.DeadlineExceeded("no time left for the fortune")
+                events = iter(response["body"])
+                yield next(events)
+                raise RuntimeError("stream reset")
+
+            return {"body": events()}
+
+    fortune_cache = main.fortune_cache
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    report = {}
+    try:
+        for name, handler in (("sync", main.lambda_stream_handler), ("async", async_handler.lambda_stream_handler)):
+            runtime, _, table = install_fakes(main, FailingRuntime())
+            session_id, states = None, []
+            for failure in ("shed", "error", None):
+                main.fortune_cache = main.FortuneCache()
+                runtime.failure = failure
+                lines = [json.loads(line) for line in handler({"body": json.dumps({"query": query}), "sessionId": session_id}, None)]
+                session_id = lines[0]["sessionId"]
+                text = "".join(line.get("delta", "") for line in lines)
+                stored = sessions.decode_session(table.items[session_id]["sessionData"])["state"]
+                expected = "delivering_fortune" if failure else "delivered"
+                check(lines[-1].get("state") == stored == expected, (name, failure, lines[-1], stored))
+                check(text.endswith(main.BUSY_RESPONSES["en"]) == bool(failure), (name, failure, text))
+                states.append(stored)
+            report[name] = states
+    finally:
+        main.fortune_cache = fortune_cache
+        logger.setLevel(level)
+    return report
+
+
+def check_missing_info_templates(rounds=20000):
+    """Every (language, missing fields) combination has distinct variants naming each field; returns microseconds per response."""
+    import response_templates
+
+    for (lang, fields), variants in response_templates.MISSING_INFO_VARIANTS.items():
+        check(len(set(variants)) == len(response_templates.MISSING_INFO_TEMPLATES[lang]), (lang, fields))
+        for variant in variants:
+            check(all(response_templates.FIELD_PHRASES[lang][field] in variant for field in fields), variant)
+    combinations = list(response_templates.MISSING_INFO_VARIANTS)
+    start = time.perf_counter()
+    for i in range(rounds):
+        lang, fields = combinations[i % len(combinations)]
+        response_templates.missing_info_response(list(fields), lang)
+    return len(combinations), (time.perf_counter() - start) / rounds * 1e6
+
+
+def check_classifier(rounds=20, min_confident_accuracy=0.9):
+    """
+    Held-out accuracy of the local intent/category classifier (trained without the held-out
+    queries), the share it answers at CLASSIFIER_CONFIDENCE_THRESHOLD, how many regex intent
+    misses in QUERY_CORPUS it settles, and uncached microseconds per query with the shipped artifact.
+    """
+    import intent_classifier
+
+    rows = intent_classifier.load_labeled_queries()
+    train, held_out = intent_classifier.split_queries(rows)
+    report = intent_classifier.evaluate(intent_classifier.train_models(train), held_out)
+    for name in ("intent", "category"):
+        confident_accuracy = report[name]["confident_accuracy"]
+        check(confident_accuracy is None or confident_accuracy >= min_confident_accuracy, (name, report[name]))
+
+    misses = [query for query in QUERY_CORPUS if extraction.extract_query(query, extraction.detect_language(query)).intent is None]
+    report["corpus_intent_misses"] = len(misses)
+    report["corpus_intent_settled"] = sum(intent_classifier.classify(query).intent_confidence >= intent_classifier.CLASSIFIER_CONFIDENCE_THRESHOLD
+                                          for query in misses)
+
+    queries = [row["text"] for row in rows]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            intent_classifier.classify.__wrapped__(query)
+    report["us_per_query"] = (time.perf_counter() - start) / (rounds * len(queries)) * 1e6
+
+    # A missing or corrupt artifact escalates every query instead of failing the request
+    import tempfile
+    path = intent_classifier.CLASSIFIER_PATH
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            corrupt = os.path.join(tmp, "corrupt.json.gz")
+            with open(corrupt, "wb") as f:
+                f.write(b"not gzip")
+            for intent_classifier.CLASSIFIER_PATH in (os.path.join(tmp, "missing.json.gz"), corrupt):
+                intent_classifier.load_classifier.cache_clear()
+                intent_classifier.classify.cache_clear()
+                prediction = intent_classifier.classify(QUERY_CORPUS[0])
+                check(prediction.intent_confidence == prediction.category_confidence == 0.0, prediction)
+    finally:
+        intent_classifier.CLASSIFIER_PATH = path
+        intent_classifier.load_classifier.cache_clear()
+        intent_classifier.classify.cache_clear()
+        logger.setLevel(level)
+    return report
+
+
+def check_gazetteer(rounds=2000):
+    """
+    GAZETTEER_CASES resolve as expected, every timezone is a real zone, charts for a city name
+    use that city's timezone, and a turn still succeeds without the places table; returns microseconds per uncached lookup and the index build time.
+    """
+    import gazetteer
+
+    start = time.perf_counter()
+    index = gazetteer.Gazetteer(gazetteer.load_places())
+    build_ms = (time.perf_counter() - start) * 1000
+    for place in index.places:
+        check(place.timezone in pytz.all_timezones_set, place)
+    for location, expected in GAZETTEER_CASES:
+        place = index.lookup(location)
+        check((place.name if place else None) == expected, (location, place))
+
+    chart = bazi_core.get_four_pillars(datetime.datetime(1990, 3, 12, 15, 0), "Beijing")
+    check(chart["timestampTST"].endswith("+08:00"), chart)
+    check(extraction.match_location("I was born on 1990-03-12 15:00 in Beijing, China. How is my career?") == "Beijing")
+
+    # Without the table, lookups return None and the older heuristics answer a whole turn
+    import main
+    import perpetual_calendar
+    from fakes import install_fakes
+
+    calendar_days = perpetual_calendar.compute_days(2000, 2001)
+    path, gazetteer.GAZETTEER_PATH = gazetteer.GAZETTEER_PATH, os.path.join(BACKEND_DIR, "missing_places.tsv")
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        for cache in (gazetteer.get_gazetteer, gazetteer.resolve_place, extraction._extract_query):
+            cache.cache_clear()
+        check(gazetteer.resolve_place("Beijing") is None and gazetteer.find_place("Beijing") is None)
+        check("Beijing" in extraction.match_location("I was born on 1990-03-12 15:00 in Beijing, China. How is my career?"))
+        check(bazi_core.get_four_pillars(datetime.datetime(1990, 3, 12, 15, 0), "Beijing")["timestampTST"].endswith("+00:00"))
+        check(perpetual_calendar.compute_days(2000, 2001) == calendar_days)
+        install_fakes(main)
+        response = main.lambda_handler({"body": json.dumps({"query": "I was born on 1990-03-12 15:00 in Beijing, China. How is my career?"})}, None)
+        check(response["statusCode"] == 200, response)
+    finally:
+        gazetteer.GAZETTEER_PATH = path
+        for cache in (gazetteer.get_gazetteer, gazetteer.resolve_place, extraction._extract_query):
+            cache.cache_clear()
+        logger.setLevel(level)
+
+    report = {"places": len(index.places), "names": len(index.names), "build_ms": build_ms}
+    for name, locations in (("exact", ["Beijing", "北京市", "Tokyo", "NYC"]),
+                            ("fuzzy", ["Bejing", "San Fransisco", "Guangzou", "Kuala Lumpor"]),
+                            ("text", QUERY_CORPUS)):
+        lookup = index.find_in_text if name == "text" else index.lookup
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for location in locations:
+                lookup(location)
+        report[f"{name}_us"] = (time.perf_counter() - start) / (rounds * len(locations)) * 1e6
+    return report
+
+
+def check_metrics(rounds=10, span_calls=200000):
+    """
+    Replay ASYNC_CONVERSATIONS through both handlers into a MemorySink: one request document per
+    turn with its parse and extraction stages, and a Bedrock document with token counts per model
+    call (streamed calls included). Returns per-request overhead against METRICS_SINK=off and
+    the cost of span() outside a measured request.
+    """
+    import main
+    import async_handler
+    from fakes import install_fakes, FakeBedrockRuntime
+
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    limiter, resilience.rate_limiter = resilience.rate_limiter, resilience.TokenBucket(rate=0)
+    sink = metrics.sink
+    turns = sum(len(conversation) for conversation in ASYNC_CONVERSATIONS)
+    report = {}
+    try:
+        metrics.sink = metrics.MemorySink()
+        for name, handler in (("sync", main.lambda_handler), ("async", async_handler.lambda_handler)):
+            metrics.sink.clear()
+            replay_conversations(handler, ASYNC_CONVERSATIONS, 0, 0)
+            requests = [document for document in metrics.sink.documents if "request" in document]
+            model_calls = [document for document in metrics.sink.documents if document.get("Stage") == "bedrock"]
+            check(len(requests) == turns, (name, len(requests)))
+            for document in requests:
+                check(document["_aws"]["CloudWatchMetrics"][0]["Dimensions"][0] == ["Route"], document)
+                check("parse" in document and "extract" in document, document)
+            check(model_calls and all(document["InputTokens"] > 0 and document["OutputTokens"] > 0 for document in model_calls))
+            report[f"{name}_model_calls"] = len(model_calls)
+            report[f"{name}_stages"] = sorted({key for document in requests for key in document
+                                               if key in {metric["Name"] for metric in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]}})
+
+        metrics.sink.clear()
+        install_fakes(main, FakeBedrockRuntime())
+        main.get_llm_cache.cache_clear()
+        token = metrics.start_metrics("/stream")
+        text = "".join(main.invoke_bedrock_stream([{"role": "user", "content": "Tell me about my career"}]))
+        metrics.emit_metrics(token)
+        streamed = [document for document in metrics.sink.documents if document.get("Operation") == "stream"]
+        check(text and len(streamed) == 1 and streamed[0]["OutputTokens"] > 0, metrics.sink.documents)
+
+        seconds = {}
+        for kind in ("off", "memory"):
+            metrics.sink = metrics.build_sink(kind)
+            seconds[kind] = min(replay_conversations(main.lambda_handler, ASYNC_CONVERSATIONS, 0, 0)[1] for _ in range(rounds))
+        report["overhead_us_per_request"] = (seconds["memory"] - seconds["off"]) / turns * 1e6
+        report["off_us_per_request"] = seconds["off"] / turns * 1e6
+
+        metrics.sink = None
+        start = time.perf_counter()
+        for _ in range(span_calls):
+            with metrics.span("bedrock", ModelId="model"):
+                pass
+        report["disabled_span_ns"] = (time.perf_counter() - start) / span_calls * 1e9
+    finally:
+        metrics.sink = sink
+        resilience.rate_limiter = limiter
+        logger.setLevel(level)
+    return report
+
+
+def check_logging(rounds=20, calls=100000, sampled_rate=0.05):
+    """
+    Replay ASYNC_CONVERSATIONS through main.lambda_handler with the root handler writing to memory,
+    once per logging mode: microseconds and bytes logged per request, and no birth date from the
+    conversations (or from a rejected LLM answer) in the output. Also the cost of a verbose record at a disabled level, formatted
+    eagerly (an f-string with json.dumps, as the handler used to) and through log_event.
+    """
+    import main
+    import structured_logging
+
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    sample_rate = structured_logging.LOG_VERBOSE_SAMPLE_RATE
+    limiter, resilience.rate_limiter = resilience.rate_limiter, resilience.TokenBucket(rate=0)
+    stream = io.StringIO()
+    root.handlers = [logging.StreamHandler(stream)]
+    turns = sum(len(conversation) for conversation in ASYNC_CONVERSATIONS)
+    modes = {
+        "off": ("text", "CRITICAL", 1.0),
+        "text": ("text", "INFO", 1.0),
+        "json": ("json", "INFO", 1.0),
+        f"json, {sampled_rate:.0%} verbose": ("json", "INFO", sampled_rate)
+    }
+    report = {}
+    try:
+        # Modes are interleaved round by round so drift in the machine's speed affects them alike
+        seconds = dict.fromkeys(modes, float("inf"))
+        for _ in range(rounds):
+            for name, (log_format, log_level, rate) in modes.items():
+                structured_logging.configure_logging(log_format, log_level, "")
+                structured_logging.LOG_VERBOSE_SAMPLE_RATE = rate
+                stream.seek(0)
+                stream.truncate()
+                seconds[name] = min(seconds[name], replay_conversations(main.lambda_handler, ASYNC_CONVERSATIONS, 0, 0)[1])
+                output = stream.getvalue()
+                check("1990-03-12" not in output and "1985-08-12" not in output, name)
+                report[name] = {"us_per_request": seconds[name] / turns * 1e6, "bytes_per_request": len(output.encode("utf-8")) / turns}
+
+        # Error paths that used to put the rejected birth date in an f-string
+        stream.seek(0)
+        stream.truncate()
+        main.validate_fallback_fields(["birth_datetime"], {"birth_datetime": "1990-02-30 15:00"})
+        check("Invalid datetime format" in stream.getvalue() and "1990-02-30" not in stream.getvalue(), stream.getvalue())
+        stream.seek(0)
+        stream.truncate()
+        check(extraction.match_datetime("I was born on March 32, 1990") is None)
+        main.calculate_pillars({"body": json.dumps({"birth_datetime": "1990-02-30 15:00", "birth_location": "Beijing"})})
+        output = stream.getvalue()
+        check("Failed to parse date" in output and "Error in calculate_pillars" in output
+              and "March 32" not in output and "1990-02-30" not in output, output)
+
+        root.setLevel(logging.WARNING)
+        event = {"body": json.dumps({"query": QUERY_CORPUS[0]}), "sessionId": "session"}
+        start = time.perf_counter()
+        for _ in range(calls):
+            logging.info(f"Full event: {json.dumps(event)}")
+        report["eager_disabled_ns"] = (time.perf_counter() - start) / calls * 1e9
+        start = time.perf_counter()
+        for _ in range(calls):
+            structured_logging.log_event(main.handler_logger, logging.INFO, "Request received", verbose=True, event=event)
+        report["lazy_disabled_ns"] = (time.perf_counter() - start) / calls * 1e9
+    finally:
+        root.handlers = handlers
+        structured_logging.configure_logging()
+        root.setLevel(level)
+        structured_logging.LOG_VERBOSE_SAMPLE_RATE = sample_rate
+        resilience.rate_limiter = limiter
+    return report
+
+
+def check_load(conversations=40, concurrency=8):
+    """
+    A small load_test run through both handlers (no throttling or client rate limit, so it is
+    deterministic enough to assert on): every synthesized conversation reaches its fortune
+    exactly once, no turn raises, and the report covers each transition seen.
+    """
+    import main
+    import load_test
+    from fakes import tail_latency
+
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.CRITICAL)
+    reports = {}
+    try:
+        for name in ("sync", "async"):
+            report = load_test.run_load(load_test.synthesize_conversations(conversations), name, concurrency,
+                                        model_latency=tail_latency(0.01, 0.005, 0.1, 0.02), table_latency=0.002,
+                                        throttle=0.0, rate_limit=0)
+            check(not report["errors"], report["errors"])
+            check(report["delivered_fortunes"] == conversations, (name, report["delivered_fortunes"]))
+            check(sum(row["n"] for row in report["transitions"].values()) == report["turns"], report["transitions"])
+            reports[name] = report
+    finally:
+        root.setLevel(level)
+    return reports
+
+
+def check_calculate_pillars(n=5000, seed=0):
+    """
+    /calculate-pillars over birth_records.jsonl: each batch row names the same pillars as the
+    single-record route, duplicates share a row, bad records are reported without failing the
+    batch, and luck pillars walk the sixty Jiazi. Then n records (drawn with repeats) in one
+    request against n single-record requests.
+    """
+    import main
+
+    def call(body):
+        response = main.calculate_pillars({"body": json.dumps(body)})
+        check(response["statusCode"] == 200, response)
+        return json.loads(response["body"])
+
+    corpus = [{"birth_datetime": record["birth_datetime"], "birth_location": record["location"], "gender": record["gender"]}
+              for record in load_benchmark_corpus("birth_records.jsonl")]
+    bad = [{"birth_datetime": "1990-02-30 10:00", "birth_location": "Beijing"}, {"birth_location": "Beijing"}, "1990-01-01"]
+    result = call({"records": corpus + corpus[:10] + bad})
+    check(result["count"] == len(corpus) + 10 + len(bad), result["count"])
+    check(result["row"][len(corpus):len(corpus) + 10] == result["row"][:10], "duplicates were charted again")
+    check([error["index"] for error in result["errors"]] == list(range(len(corpus) + 10, result["count"])), result["errors"])
+    columns, stems, branches = result["columns"], result["stems"], result["branches"]
+
+    def name(pillar):
+        return f"{stems[pillar % 10]} {branches[pillar % 12]}"
+
+    for index, record in enumerate(corpus):
+        single = call(record)
+        row = result["row"][index]
+        for key in PILLAR_KEYS:
+            check(single[key] == name(columns[key.split("_")[0]][row]), (record, key))
+        luck = columns["luck"][row]
+        check(single["luck_pillars"] == [name(pillar) for pillar in luck], record)
+        # Consecutive luck pillars are neighbours in the sixty Jiazi, all one way
+        check({(b - a) % 60 for a, b in zip(luck, luck[1:])} in ({1}, {59}), (record, luck))
+
+    rng = random.Random(seed)
+    records = [rng.choice(corpus) for _ in range(n)]
+    start = time.perf_counter()
+    batch = main.calculate_pillars({"body": json.dumps({"records": records})})
+    batch_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    single_bytes = sum(len(main.calculate_pillars({"body": json.dumps(record)})["body"]) for record in records)
+    single_seconds = time.perf_counter() - start
+    return {"records": len(corpus), "unique": json.loads(batch["body"])["unique"], "n": n,
+            "batch_seconds": batch_seconds, "batch_bytes": len(batch["body"]),
+            "single_seconds": single_seconds, "single_bytes": single_bytes}
+
+
+def check_charts(n=100000, seed=0):
+    """
+    bazi_core.Chart against the nested pillar dicts: the same charts from compute_chart() and
+    get_four_pillars() over birth_records.jsonl, then bytes held per chart for n charts, and
+    the cost of a fortune cache key and of the luck pillars from each form.
+    """
+    births = [(record["birth_datetime"], record["location"]) for record in load_benchmark_corpus("birth_records.jsonl")]
+    charts = []
+    for birth, location in births:
+        chart, local_datetime, _ = bazi_core.compute_chart(birth, location)
+        four_pillars = bazi_core.get_four_pillars(birth, location)
+        check(bazi_core.Chart.from_pillars(four_pillars) == chart, (birth, location))
+        check(dict(chart.pillars(), timestampTST=local_datetime.isoformat()) == {k: v for k, v in four_pillars.items() if k != "warning"})
+        check(bazi_core.get_luck_pillars(chart) == bazi_core.get_luck_pillars(four_pillars), (birth, location))
+        charts.append(chart)
+
+    rng = random.Random(seed)
+    sample = [tuple(rng.choice(charts)) for _ in range(n)]
+
+    def held_bytes_per_chart(build):
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            held = build()
+            return (tracemalloc.get_traced_memory()[0] - before) / len(held)
+        finally:
+            tracemalloc.stop()
+
+    dicts = [chart.pillars() for chart in charts]
+    report = {
+        "charts": len(charts),
+        "chart_bytes": held_bytes_per_chart(lambda: [bazi_core.Chart(*pillars) for pillars in sample]),
+        "dict_bytes": held_bytes_per_chart(lambda: [bazi_core.Chart(*pillars).pillars() for pillars in sample]),
+        # The fortune cache key as generate_fortune built it from the dicts, and as it is now
+        "dict_key": measure(dicts, lambda four_pillars: hash(tuple(
+            (bazi_core.GAN.index(four_pillars[key]["stem"]), bazi_core.ZHI.index(four_pillars[key]["branch"]))
+            for key in PILLAR_KEYS))),
+        "chart_key": measure(charts, hash),
+        "dict_luck": measure(dicts, lambda four_pillars: bazi_core.get_luck_pillars(four_pillars, "male")),
+        "chart_luck": measure(charts, lambda chart: bazi_core.luck_pillar_indices(chart, "male"))
+    }
+    return report
+
+
+def check_perpetual_calendar(samples=2000, seed=0, rounds=20):
+    """
+    The perpetual calendar: sampled days match compute_chart at noon, /calendar filters match a
+    day-by-day pass over the same range, and bad requests get 400s. Then a query for days
+    combining with, and not clashing with, a chart's day and year branches over the whole
+    calendar, against charting each day of one year.
+    """
+    import main
+    import perpetual_calendar
+
+    calendar = perpetual_calendar.load_calendar()
+    checked = perpetual_calendar.check_calendar(samples, seed, calendar)
+
+    def call(body):
+        response = main.lambda_handler({"path": "/calendar", "body": json.dumps(body)}, None)
+        return response["statusCode"], json.loads(response["body"])
+
+    rng = random.Random(seed)
+    start, end = datetime.date(2023, 1, 1), datetime.date(2026, 12, 31)
+    for _ in range(rounds):
+        chart = bazi_core.Chart(*(rng.randrange(60) for _ in range(4)))
+        against = rng.sample(perpetual_calendar.PILLAR_NAMES, rng.randint(1, 2))
+        relations, exclude = rng.choice([(["combine"], []), (["clash"], []), ([], ["clash"]), (["combine"], ["clash"])])
+        status, result = call({"start": start.isoformat(), "end": end.isoformat(), "pillars": chart._asdict(),
+                               "relations": relations, "exclude": exclude, "against": against})
+        check(status == 200, result)
+        branches = {getattr(chart, name) % 12 for name in against}
+        expected = []
+        for ordinal in range(start.toordinal(), end.toordinal() + 1):
+            day = calendar.pillars(datetime.date.fromordinal(ordinal))[2] % 12
+            if relations and not any(perpetual_calendar.RELATIONS[relation](branch) == day for relation in relations for branch in branches):
+                continue
+            if any(perpetual_calendar.RELATIONS[relation](branch) == day for relation in exclude for branch in branches):
+                continue
+            expected.append(datetime.date.fromordinal(ordinal).isoformat())
+        check(result["dates"] == expected, (chart, relations, exclude, against))
+        check([calendar.pillars(datetime.date.fromisoformat(date))[2] for date in result["dates"]] == result["columns"]["day"])
+    for body in [{"start": "2025-01-01"}, {"start": "1899-12-31", "end": "1900-01-31"}, {"start": "2025-02-01", "end": "2025-01-01"},
+                 {"start": "2025-01-01", "end": "2025-01-31", "relations": ["clash"]},
+                 {"start": "2025-01-01", "end": "2025-01-31", "pillars": {"year": 1}, "relations": ["clash"]},
+                 {"start": "2025-01-01", "end": "2025-01-31", "pillars": chart._asdict(), "relations": ["harm"]},
+                 {"start": "2025-01-01", "end": "2025-01-31", "limit": -1}, ["2025-01-01"]]:
+        status, result = call(body)
+        check(status == 400, (body, status, result))
+
+    full = {"start": calendar.first_date.isoformat(), "end": calendar.last_date.isoformat(), "pillars": chart._asdict(),
+            "relations": ["combine"], "exclude": ["clash"], "against": ["day", "year"], "limit": 0}
+    year = [datetime.datetime(2025, 1, 1, 12) + datetime.timedelta(days=i) for i in range(365)]
+    return {
+        "checked_days": checked,
+        "rounds": rounds,
+        "days": calendar.days,
+        "matches": call(full)[1]["count"],
+        "full_scan": measure([full], lambda body: perpetual_calendar.query_days(body, calendar)),
+        "chart_year": measure([year], lambda days: [bazi_core.compute_chart(day, perpetual_calendar.CALENDAR_LOCATION) for day in days])
+    }
+
+
+def load_benchmark_corpus(name):
+    with open(os.path.join(BENCHMARK_DATA_DIR, name), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def suite_cases(latency=0.0):
+    """
+    (name, items, operation, ops per item) for every suite benchmark over the fixed corpora.
+    Caches stay warm as in a long-lived container, except extract_query and classify, which are timed uncached;
+    handler_turn replays whole conversations against fresh fakes with the given latency (seconds).
+    """
+    import main
+    import intent_classifier
+
+    queries = load_benchmark_corpus("queries.jsonl")
+    records = load_benchmark_corpus("birth_records.jsonl")
+    births = [(datetime.datetime.strptime(record["birth_datetime"], "%Y-%m-%d %H:%M"), record["location"]) for record in records]
+    charts = [(bazi_core.get_four_pillars(birth, location), record["gender"]) for (birth, location), record in zip(births, records)]
+    julian_days = [bazi_core.to_julian(pytz.UTC.localize(birth)) for birth, _ in births]
+    places = []
+    for _, location in births:
+        if isinstance(location, dict):
+            places.append((location["city"], location["longitude"], location["latitude"]))
+        else:
+            place = bazi_core.resolve_place(location)
+            places.append((location, place.longitude if place else 0, None))
+    return [
+        ("get_four_pillars", births, lambda birth: bazi_core.get_four_pillars(*birth), 1),
+        ("get_luck_pillars", charts, lambda chart: bazi_core.get_luck_pillars(*chart), 1),
+        ("calc_solar_term", julian_days, bazi_core.calc_solar_term, 1),
+        ("get_timezone", places, lambda place: bazi_core.get_timezone(*place), 1),
+        ("extract_query", queries, lambda query: extraction._extract_query.__wrapped__(query["text"], query["lang"]), 1),
+        ("classify", queries, lambda query: intent_classifier.classify.__wrapped__(query["text"]), 1),
+        ("handler_turn", ASYNC_CONVERSATIONS,
+         lambda turns: replay_conversations(main.lambda_handler, [turns], latency, latency), len)
+    ]
+
+
+def measure(items, operation, ops_per_item=1, min_seconds=0.1, repeats=15):
+    """
+    Best-of-repeats ops/sec over items after a warm-up pass, then, under tracemalloc, the mean
+    peak bytes allocated while an op runs and the bytes still held after all of them.
+    """
+    weights = [ops_per_item(item) if callable(ops_per_item) else ops_per_item for item in items]
+    ops = sum(weights)
+    for item in items:
+        operation(item)
+    best = float("inf")
+    for _ in range(repeats):
+        passes = 0
+        start = time.perf_counter()
+        while True:
+            for item in items:
+                operation(item)
+            passes += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                break
+        best = min(best, elapsed / passes)
+
+    tracemalloc.start()
+    try:
+        peak_bytes = 0
+        before = tracemalloc.get_traced_memory()[0]
+        for item in items:
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            operation(item)
+            peak_bytes += tracemalloc.get_traced_memory()[1] - current
+        retained_bytes = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_sec": ops / best, "peak_bytes_per_op": peak_bytes / ops, "retained_bytes_per_op": retained_bytes / ops}
+
+
+def run_suite(latency=0.0, only=None):
+    """Measure every suite benchmark (or those named in only) with logging, metrics and the rate limiter out of the way."""
+    import main  # configures logging on import, so before the level is lowered
+
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    limiter, resilience.rate_limiter = resilience.rate_limiter, resilience.TokenBucket(rate=0)
+    sink, metrics.sink = metrics.sink, None
+    results = {}
+    try:
+        for name, items, operation, ops_per_item in suite_cases(latency):
+            if only and name not in only:
+                continue
+            results[name] = measure(items, operation, ops_per_item)
+    finally:
+        logger.setLevel(level)
+        resilience.rate_limiter = limiter
+        metrics.sink = sink
+    return results
+
+
+def load_baseline(path=BENCHMARK_BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_baseline(results, latency_ms=0.0, path=BENCHMARK_BASELINE_PATH):
+    baseline = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "latency_ms": latency_ms,
+        "benchmarks": {name: {key: round(value, 1) for key, value in row.items()} for name, row in results.items()}
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results, baseline, speed_tolerance=BENCH_SPEED_TOLERANCE, alloc_tolerance=BENCH_ALLOC_TOLERANCE):
+    """{name: [reasons]} for benchmarks slower, or allocating more per op, than the baseline allows."""
+    regressions = {}
+    for name, row in results.items():
+        base = (baseline or {}).get("benchmarks", {}).get(name)
+        if base is None:
+            continue
+        reasons = []
+        if row["ops_per_sec"] < base["ops_per_sec"] * (1 - speed_tolerance):
+            reasons.append(f"ops/sec {row['ops_per_sec']:,.0f} < {base['ops_per_sec']:,.0f} - {speed_tolerance:.0%}")
+        allowed = base["peak_bytes_per_op"] * (1 + alloc_tolerance) + BENCH_ALLOC_SLACK_BYTES
+        if row["peak_bytes_per_op"] > allowed:
+            reasons.append(f"peak bytes/op {row['peak_bytes_per_op']:,.0f} > {base['peak_bytes_per_op']:,.0f} + {alloc_tolerance:.0%}")
+        if reasons:
+            regressions[name] = reasons
+    return regressions
+
+
+def import_time_report(module, runs=5):
+    """
+    Median cumulative import time of a module in a fresh interpreter, plus its slowest imports.
+
+    Returns:
+        dict: {"module", "cumulative_us", "top": [(self_us, cumulative_us, name), ...]}
+    """
+    samples, top = [], []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+        rows = []
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "self [us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+        samples.append(next(cumulative for _, cumulative, name in rows if name.strip() == module))
+        top = sorted(rows, reverse=True)[:10]
+    return {"module": module, "cumulative_us": statistics.median(samples), "top": top}
+
+
+def check_import_budget(budgets=IMPORT_TIME_BUDGET_US, runs=5):
+    """Report import times and return the modules that exceed their cold-start budget."""
+    over_budget = []
+    for module, budget_us in budgets.items():
+        report = import_time_report(module, runs)
+        status = "OK" if report["cumulative_us"] <= budget_us else "OVER BUDGET"
+        print(f"import {module}: {report['cumulative_us'] / 1000:.1f} ms (budget {budget_us / 1000:.0f} ms) {status}")
+        for self_us, cumulative_us, name in report["top"]:
+            print(f"    {self_us:>8} | {cumulative_us:>8} | {name}")
+        if report["cumulative_us"] > budget_us:
+            over_budget.append(module)
+    return over_budget
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Oracle Master backend benchmarks")
+    parser.add_argument("benchmark", choices=["batch", "imports", "extraction", "retrieval", "sessions", "resilience", "gateway", "async", "templates", "classifier", "extraction_calls", "llm_cache", "gazetteer", "metrics", "logging", "load", "pillars", "charts", "calendar", "fortunes", "fortune_stream", "timezones", "suite"])
+    parser.add_argument("-n", type=int, default=200000, help="number of records for the batch benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Bedrock/DynamoDB latency in ms for the suite's handler benchmark")
+    parser.add_argument("--only", default="", help="comma-separated suite benchmarks to run")
+    parser.add_argument("--update-baseline", action="store_true", help="store this suite run as the baseline")
+    args = parser.parse_args()
+    # EMF lines on stdout would interleave with the reports; check_metrics installs its own sink
+    metrics.sink = None
+
+    if args.benchmark == "batch":
+        print(f"Batch matches scalar on {check_batch_matches_scalar()} records")
+        rates = bench_four_pillars_batch(args.n)
+        print(f"get_four_pillars (scalar): {rates['scalar_records_per_sec']:,.0f} records/sec")
+        print(f"get_four_pillars_batch:    {rates['batch_records_per_sec']:,.0f} records/sec")
+    elif args.benchmark == "extraction":
+        rates = bench_extraction()
+        print(f"extract_query (cold scan): {rates['cold_queries_per_sec']:,.0f} queries/sec")
+        print(f"extract_query (memoized):  {rates['memoized_queries_per_sec']:,.0f} queries/sec")
+    elif args.benchmark == "retrieval":
+        report = bench_retrieval()
+        print(f"recall@{retrieval.RETRIEVAL_TOP_K}: {report['recall_at_k']:.2f}  MRR: {report['mrr']:.2f}")
+        print(f"search latency: p50 {report['p50_us']:.1f} us, p99 {report['p99_us']:.1f} us")
+        check_retrieval_fallback()
+        print("Fortunes use the local index over data/RAG, and managed retrieval without it")
+    elif args.benchmark == "sessions":
+        report = check_session_writes()
+        writes = report["writes_per_turn"]
+        print(f"Session reads per turn:  {report['reads_per_turn']}")
+        print(f"Session writes per turn: {writes} ({sum(writes)} writes over {len(writes)} turns)")
+        print(f"sessionData: {report['encoded_bytes']} bytes encoded vs {report['json_bytes']} bytes as json.dumps")
+        print("Overlapping turns merged their changed fields")
+    elif args.benchmark == "resilience":
+        report = check_resilience()
+        print(f"Seconds per turn under full throttling: {[round(seconds, 2) for seconds in report['seconds_per_turn']]}")
+        print(f"Bedrock calls per turn: {report['calls_per_turn']}")
+        for reply in report["replies"]:
+            print(f"  {reply}")
+        print(f"Counters: {report['counters']}")
+    elif args.benchmark == "gateway":
+        for mode, row in bench_gateway_hedging().items():
+            print(f"{mode:>9}: p50 {row['p50_ms']:.0f} ms, p95 {row['p95_ms']:.0f} ms, p99 {row['p99_ms']:.0f} ms, "
+                  f"{row['calls_per_request']:.3f} model calls per request, {row['hedge_wins']} hedge wins")
+    elif args.benchmark == "async":
+        for mode, row in check_async_matches_sync().items():
+            print(f"{mode:>10} fallback: responses and sessions identical over {row['turns']} turns; "
+                  f"sync {row['sync_seconds']:.2f} s, async {row['async_seconds']:.2f} s")
+    elif args.benchmark == "extraction_calls":
+        report = check_extraction_calls()
+        print(f"Model calls for a turn missing {report['missing_fields']} fields: combined {len(report['combined'])}, "
+              f"sequential {len(report['sequential'])}, combined call failed {len(report['combined_failed'])}, "
+              f"combined call shed {len(report['combined_shed'])}, nothing missing {len(report['nothing_missing'])}")
+    elif args.benchmark == "llm_cache":
+        report = check_llm_cache()
+        print(f"LLM cache: TTL expiry, high-temperature bypass and shared-tier expiry hold; {report}")
+    elif args.benchmark == "templates":
+        combinations, us_per_response = check_missing_info_templates()
+        print(f"{combinations} missing-field x language combinations covered; {us_per_response:.2f} us per response")
+    elif args.benchmark == "classifier":
+        report = check_classifier()
+        for name in ("intent", "category"):
+            row = report[name]
+            print(f"{name:>8}: held-out accuracy {row['accuracy']:.2f}, {row['coverage']:.0%} answered locally "
+                  f"with accuracy {row['confident_accuracy'] or 0:.2f}")
+        print(f"Regex intent misses in the query corpus settled locally: {report['corpus_intent_settled']}/{report['corpus_intent_misses']}")
+        print(f"classify: {report['us_per_query']:.1f} us per query (uncached)")
+    elif args.benchmark == "gazetteer":
+        report = check_gazetteer()
+        print(f"{len(GAZETTEER_CASES)} location cases resolved, turns still answered without the table; {report['places']} places under {report['names']} names, "
+              f"index built in {report['build_ms']:.1f} ms")
+        print(f"lookup: exact {report['exact_us']:.1f} us, fuzzy {report['fuzzy_us']:.1f} us, "
+              f"place in free text {report['text_us']:.1f} us")
+    elif args.benchmark == "metrics":
+        report = check_metrics()
+        for name in ("sync", "async"):
+            print(f"{name:>5}: one EMF request document per turn with stages {report[f'{name}_stages']}; "
+                  f"{report[f'{name}_model_calls']} model-call documents with token counts")
+        print(f"Overhead: {report['overhead_us_per_request']:.1f} us per request "
+              f"(handler {report['off_us_per_request']:.0f} us with metrics off)")
+        print(f"span() outside a measured request: {report['disabled_span_ns']:.0f} ns")
+    elif args.benchmark == "logging":
+        report = check_logging()
+        baseline = report["off"]["us_per_request"]
+        for name, row in report.items():
+            if name in ("off",) or not isinstance(row, dict):
+                continue
+            print(f"{name:>16}: {row['us_per_request'] - baseline:6.0f} us and {row['bytes_per_request']:6.0f} bytes logged per request")
+        print(f"handler with logging off: {baseline:.0f} us per request; no birth dates in any output")
+        print(f"verbose record at a disabled level: eager f-string {report['eager_disabled_ns']:.0f} ns, "
+              f"log_event {report['lazy_disabled_ns']:.0f} ns")
+    elif args.benchmark == "load":
+        for name, report in check_load().items():
+            print(f"{name:>5}: {report['delivered_fortunes']} fortunes over {report['turns']} turns, "
+                  f"{report['model_calls_per_fortune']} model calls per fortune, {report['turns_per_second']} turns/s; "
+                  f"p95 {max(row['p95_ms'] for row in report['transitions'].values()):.0f} ms worst transition")
+    elif args.benchmark == "pillars":
+        report = check_calculate_pillars(args.n if args.n != 200000 else 5000)
+        print(f"{report['records']} corpus records: batch rows match single-record charts; duplicates shared, bad records reported")
+        print(f"{report['n']} records ({report['unique']} distinct) in one request: {report['batch_seconds'] * 1000:.0f} ms, "
+              f"{report['batch_bytes'] / report['n']:.0f} bytes/record")
+        print(f"{report['n']} single-record requests: {report['single_seconds'] * 1000:.0f} ms, "
+              f"{report['single_bytes'] / report['n']:.0f} bytes/record (before API Gateway round trips)")
+    elif args.benchmark == "charts":
+        report = check_charts()
+        print(f"{report['charts']} corpus charts identical as Chart and as pillar dicts (pillars, local time, luck pillars)")
+        print(f"held per chart: Chart {report['chart_bytes']:.0f} bytes, pillar dicts {report['dict_bytes']:.0f} bytes")
+        for name, label in (("key", "fortune cache key"), ("luck", "luck pillars")):
+            print(f"{label}: from dicts {1e9 / report[f'dict_{name}']['ops_per_sec']:.0f} ns, "
+                  f"from Chart {1e9 / report[f'chart_{name}']['ops_per_sec']:.0f} ns")
+    elif args.benchmark == "calendar":
+        report = check_perpetual_calendar()
+        print(f"{report['checked_days']} sampled days match compute_chart at noon; {report['rounds']} filtered queries match a day-by-day pass")
+        print(f"combine and not clash over {report['days']} days ({report['matches']} matches): "
+              f"{1000 / report['full_scan']['ops_per_sec']:.2f} ms; charting the 365 days of one year: "
+              f"{1000 / report['chart_year']['ops_per_sec']:.0f} ms")
+    elif args.benchmark == "fortunes":
+        report = check_fortune_cache()
+        print(f"Stale fortunes refreshed in place by the next request, stale text kept on failure; {report}")
+    elif args.benchmark == "fortune_stream":
+        report = check_fortune_stream()
+        print(f"Shed or broken fortune streams end with the busy template and stay deliverable; states per turn: {report}")
+    elif args.benchmark == "timezones":
+        report = check_timezone_cache()
+        print(f"Timezone cache save/load round trip keeps the reported entries and serves them without resolving; {report}")
+    elif args.benchmark == "suite":
+        only = {name.strip() for name in args.only.split(",") if name.strip()}
+        results = run_suite(args.latency / 1000, only)
+        baseline = load_baseline()
+        if baseline and baseline.get("latency_ms", 0.0) != args.latency:
+            print(f"Note: baseline recorded with {baseline.get('latency_ms', 0.0)} ms fake latency; handler_turn not compared")
+            baseline["benchmarks"].pop("handler_turn", None)
+        regressions = find_regressions(results, baseline)
+        # Timings on shared machines are noisy: a slowdown only counts if two more runs confirm it
+        for _ in range(2):
+            if not regressions or args.update_baseline:
+                break
+            for name, row in run_suite(args.latency / 1000, set(regressions)).items():
+                results[name]["ops_per_sec"] = max(results[name]["ops_per_sec"], row["ops_per_sec"])
+            regressions = find_regressions(results, baseline)
+        if baseline and (baseline["python"], baseline["machine"]) != (platform.python_version(), platform.machine()):
+            print(f"Note: baseline recorded on Python {baseline['python']} ({baseline['machine']}); timings may not compare")
+        print(f"{'benchmark':<18} {'ops/sec':>12} {'baseline':>12} {'change':>8} {'peak B/op':>10} {'kept B/op':>10}")
+        for name, row in results.items():
+            base = (baseline or {}).get("benchmarks", {}).get(name)
+            change = f"{row['ops_per_sec'] / base['ops_per_sec'] - 1:+.0%}" if base else "new"
+            print(f"{name:<18} {row['ops_per_sec']:>12,.0f} {base['ops_per_sec'] if base else 0:>12,.0f} {change:>8} "
+                  f"{row['peak_bytes_per_op']:>10,.0f} {row['retained_bytes_per_op']:>10,.1f}"
+                  + ("  REGRESSION: " + "; ".join(regressions[name]) if name in regressions else ""))
+        if args.update_baseline:
+            write_baseline(results, args.latency)
+            print(f"Baseline written to {os.path.normpath(BENCHMARK_BASELINE_PATH)}")
+        elif regressions:
+            sys.exit(1)
+    elif args.benchmark == "imports":
+        if check_import_budget():
+            sys.exit(1)
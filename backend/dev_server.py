@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import argparse
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import main
+
+# 本地开发服务器：提供前端页面，并以分块传输转发到 lambda_handler / lambda_stream_handler
+FRONTEND_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "index.html")
+
+
+class OracleRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path not in ("/", "/index.html"):
+            self.send_error(404)
+            return
+        with open(FRONTEND_PATH, "rb") as f:
+            page = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Methods", "POST, OPTIONS")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        raw_body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        try:
+            body = json.loads(raw_body or "{}")
+        except ValueError:
+            # lambda_handler answers the malformed body with its 400
+            body = {}
+        if not isinstance(body, dict):
+            self.send_json({"statusCode": 400, "headers": {"Access-Control-Allow-Origin": "*"}, "body": json.dumps(
+                {"response": "Error: Invalid input - the request body must be a JSON object", "state": "delivered"})})
+            return
+        event = {"path": self.path, "body": raw_body, "sessionId": body.get("sessionId")}
+        if body.get("stream") and self.path not in ("/calculate-pillars", "/calendar"):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for line in main.lambda_stream_handler(event, None):
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        self.send_json(main.lambda_handler(event, None) or {"statusCode": 204, "body": ""})
+
+    def send_json(self, response):
+        """Send a lambda_handler-style response (statusCode, headers, body) as JSON."""
+        payload = response["body"].encode("utf-8")
+        self.send_response(response["statusCode"])
+        for name, value in response.get("headers", {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the frontend and the Lambda handler locally")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--fake", action="store_true", help="use offline fake Bedrock and DynamoDB clients")
+    parser.add_argument("--latency", type=float, default=0.6, help="fake model time to first token (seconds)")
+    parser.add_argument("--token-delay", type=float, default=0.05, help="fake model delay between tokens (seconds)")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fakes import install_fakes, FakeBedrockRuntime, FakeBedrockAgentRuntime
+        install_fakes(main, FakeBedrockRuntime(args.latency, args.token_delay),
+                      FakeBedrockAgentRuntime(args.latency, args.token_delay))
+    logging.info(f"Serving on http://localhost:{args.port}")
+    try:
+        ThreadingHTTPServer(("", args.port), OracleRequestHandler).serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,204 @@
+import re
+import logging
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+from gazetteer import find_place, is_cjk
+from structured_logging import log_event
+
+logger = logging.getLogger("oracle.extraction")
+
+# 所有正则在导入时编译一次
+MONTHS = r'(?:January|February|March|April|May|June|July|August|September|October|November|December)'
+DATE_TIME_PATTERN = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})(?:\s+(\d{1,2}):(\d{2}))?\b')
+DATE_PATTERN_ZH = re.compile(r'\b(\d{4})年(\d{1,2})月(\d{1,2})日?\b')
+DATE_PATTERN_ZH_ALT = re.compile(r'\b(\d{4})年(\d{1,2})月(\d{1,2})号\b')
+DATE_PATTERN_EN = re.compile(r'\b' + MONTHS + r'\s+\d{1,2},\s+\d{4}\b')
+DATE_PATTERN_EN_ALT = re.compile(r'\b' + MONTHS + r'\s+\d{1,2}(?:st|nd|rd|th)?\s*,\s+\d{4}\b')
+DATE_PATTERN_EN_ALT2 = re.compile(r'\b\d{1,2}(?:st|nd|rd|th)?\s+' + MONTHS + r'\s+\d{4}\b')
+TIME_PATTERN = re.compile(r'(?:at\s+(\d{1,2})(?::(\d{2}))?\s*(?:AM|PM|am|pm)|(?:上午|下午)(\d{1,2})(?::(\d{2}))?点?)')
+ORDINAL_SUFFIX = re.compile(r'(?<=\d)(?:st|nd|rd|th)')
+WHITESPACE = re.compile(r'\s+')
+
+LOCATION_PATTERN = re.compile(r'(?:born\s+in|出生于|出生在)\s*([A-Za-z\s,]+(?:Province|City)?)\b', re.IGNORECASE)
+LOCATION_PATTERN_ZH = re.compile(r'(?:出生于|出生在)\s*([\u4e00-\u9fff\s,]+(?:省|市)?)\b')
+CITY_PATTERN = re.compile(r'\b(?:[A-Za-z]+(?:\s+[A-Za-z]+)?)\b')
+LOCATION_STOPWORDS = {'born', 'in', 'at', 'on', 'the'}
+
+CATEGORY_PATTERNS = {
+    'en': [
+        ('love', re.compile(r'\b(love|relationship|marriage|partner|boyfriend|girlfriend|spouse|romance|dating)\b', re.IGNORECASE)),
+        ('career', re.compile(r'\b(career|job|work|employment|business|promotion|prospects|future\s+job|destiny\s+.*?\s+career|professional)\b', re.IGNORECASE)),
+        ('health', re.compile(r'\b(health|wellbeing|well-being|illness|disease|fitness|wellness)\b', re.IGNORECASE))
+    ],
+    'zh': [
+        ('love', re.compile(r'\b(爱情|感情|恋爱|婚姻|伴侣|男朋友|女朋友|配偶)\b')),
+        ('career', re.compile(r'\b(事业|工作|就业|生意|晋升|前途|职业)\b')),
+        ('health', re.compile(r'\b(健康|身体|疾病|养生)\b'))
+    ]
+}
+
+FORTUNE_PATTERNS = {
+    'en': [
+        re.compile(r'\b(birth|born|date of birth|birthday|fortune|future|destiny|career|love|health|luck|prediction|fate)\b'),
+        re.compile(r'\b(when|what will|should i|tell me about my)\b')
+    ],
+    'zh': [
+        re.compile(r'\b(出生|生辰|生日|命运|未来|事业|爱情|健康|运势|预测|算命)\b'),
+        re.compile(r'\b(何时|何日|我该|告诉我)\b')
+    ]
+}
+
+QueryExtraction = namedtuple('QueryExtraction', ['lang', 'birth_datetime', 'location', 'category', 'intent'])
+
+
+def detect_language(text):
+    if any('\u4e00' <= char <= '\u9fff' for char in text):
+        return 'zh'
+    return 'en'
+
+
+def _parse_time(text):
+    """Return "HH:MM" from the first time expression in text, or None."""
+    time_match = TIME_PATTERN.search(text)
+    if not time_match:
+        return None
+    if time_match.group(1):
+        hour = int(time_match.group(1))
+        minute = int(time_match.group(2) or 0)
+        if 'PM' in time_match.group(0) or 'pm' in time_match.group(0):
+            hour = (hour % 12) + 12 if hour != 12 else 12
+        elif 'AM' in time_match.group(0) or 'am' in time_match.group(0):
+            hour = hour % 12
+    else:
+        hour = int(time_match.group(3))
+        minute = int(time_match.group(4) or 0)
+        if '下午' in time_match.group(0):
+            hour = (hour % 12) + 12 if hour != 12 else 12
+    return f"{hour:02d}:{minute:02d}"
+
+
+def match_datetime(text):
+    match = DATE_TIME_PATTERN.search(text)
+    if match:
+        date_str = f"{match.group(1)}-{int(match.group(2)):02d}-{int(match.group(3)):02d}"
+        if match.group(4) and match.group(5):
+            birth_datetime = f"{date_str} {int(match.group(4)):02d}:{int(match.group(5)):02d}"
+            log_event(logger, logging.INFO, "Extracted datetime", verbose=True, pattern="pattern 1", birth_datetime=birth_datetime)
+            return birth_datetime
+        birth_datetime = f"{date_str} 00:00"
+        log_event(logger, logging.INFO, "Extracted datetime", verbose=True, pattern="pattern 1, no time", birth_datetime=birth_datetime)
+        return birth_datetime
+
+    match = DATE_PATTERN_ZH.search(text) or DATE_PATTERN_ZH_ALT.search(text)
+    if match:
+        date_str = f"{match.group(1)}-{int(match.group(2)):02d}-{int(match.group(3)):02d}"
+        birth_datetime = f"{date_str} {_parse_time(text) or '00:00'}"
+        log_event(logger, logging.INFO, "Extracted datetime", verbose=True, pattern="zh pattern", birth_datetime=birth_datetime)
+        return birth_datetime
+
+    match = DATE_PATTERN_EN.search(text) or DATE_PATTERN_EN_ALT.search(text)
+    date_format = "%B %d, %Y"
+    if not match:
+        match = DATE_PATTERN_EN_ALT2.search(text)
+        date_format = "%d %B %Y"
+    if match:
+        date_str = WHITESPACE.sub(' ', match.group(0).strip())
+        date_str = ORDINAL_SUFFIX.sub('', date_str).replace(' ,', ',')
+        try:
+            formatted_date = datetime.strptime(date_str, date_format).strftime("%Y-%m-%d")
+        except ValueError as e:
+            # The ValueError's message repeats the date, so only its type is logged
+            log_event(logger, logging.ERROR, "Failed to parse date", birth_datetime=date_str, error=type(e).__name__)
+            return None
+        birth_datetime = f"{formatted_date} {_parse_time(text) or '00:00'}"
+        log_event(logger, logging.INFO, "Extracted datetime", verbose=True, pattern="en pattern", birth_datetime=birth_datetime)
+        return birth_datetime
+    return None
+
+
+def gazetteer_location(text):
+    """The place the gazetteer finds in text: as written when Chinese, else its canonical name."""
+    found = find_place(text)
+    if found is None:
+        return None
+    place, matched = found
+    return matched if is_cjk(matched) else place.name
+
+
+def match_location(text):
+    match = LOCATION_PATTERN.search(text)
+    if match:
+        location = gazetteer_location(match.group(1)) or match.group(1).strip()
+        log_event(logger, logging.INFO, "Extracted location", verbose=True, pattern="pattern 1", location=location)
+        return location
+
+    match = LOCATION_PATTERN_ZH.search(text)
+    if match:
+        location = gazetteer_location(match.group(1)) or match.group(1).strip()
+        log_event(logger, logging.INFO, "Extracted location", verbose=True, pattern="zh pattern", location=location)
+        return location
+
+    location = gazetteer_location(text)
+    if location:
+        log_event(logger, logging.INFO, "Extracted location", verbose=True, pattern="gazetteer", location=location)
+        return location
+
+    if ',' in text:
+        for part in text.split(','):
+            part = part.strip()
+            if part and any(c.isalpha() for c in part):
+                log_event(logger, logging.INFO, "Extracted location", verbose=True, pattern="comma split", location=part)
+                return part
+
+    for word in text.split():
+        if CITY_PATTERN.match(word) and word not in LOCATION_STOPWORDS:
+            log_event(logger, logging.INFO, "Extracted location", verbose=True, pattern="city pattern", location=word)
+            return word
+    return None
+
+
+def match_category(text, lang):
+    text_lower = text.lower() if lang == 'en' else text
+    for category, pattern in CATEGORY_PATTERNS['en' if lang == 'en' else 'zh']:
+        if pattern.search(text_lower):
+            log_event(logger, logging.INFO, "Extracted category", verbose=True, category=category)
+            return category
+    return None
+
+
+def match_intent(text, lang):
+    """'fortune' when a fortune-telling keyword is present, else None (undecided)."""
+    text_lower = text.lower() if lang == 'en' else text
+    for pattern in FORTUNE_PATTERNS['en' if lang == 'en' else 'zh']:
+        if pattern.search(text_lower):
+            log_event(logger, logging.INFO, "Query identified as fortune-telling", verbose=True)
+            return 'fortune'
+    return None
+
+
+def extract_query(text, lang=None):
+    """
+    Run every regex extractor over a query exactly once.
+
+    Args:
+        text (str): The user's query.
+        lang (str, optional): 'en' or 'zh'; detected from the text when omitted.
+
+    Returns:
+        QueryExtraction: lang, birth_datetime, location, category and intent, with None for
+        anything the patterns could not determine. Results are memoized by (text, lang), so the
+        per-field wrappers in main.py never rescan the same query.
+    """
+    return _extract_query(text, lang or detect_language(text))
+
+
+@lru_cache(maxsize=256)
+def _extract_query(text, lang):
+    return QueryExtraction(
+        lang=lang,
+        birth_datetime=match_datetime(text),
+        location=match_location(text),
+        category=match_category(text, lang),
+        intent=match_intent(text, lang)
+    )
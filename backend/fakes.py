@@ -0,0 +1,213 @@
+import io
+import json
+import time
+import random
+import threading
+
+# 本地离线替身：模拟 Bedrock 与 DynamoDB，便于在无 AWS 环境下运行与测试
+
+DEFAULT_REPLY = ("The heavens turn slowly, and your path unfolds with them. Patience brings clarity; "
+                 "what is rooted now will flower in its season.")
+
+
+def default_reply(prompt):
+    """Canned model output: an empty JSON object for structured extraction prompts, oracle prose otherwise."""
+    if "Respond with only a JSON object" in prompt:
+        return "{}"
+    return DEFAULT_REPLY
+
+
+def throttling_error():
+    from botocore.exceptions import ClientError
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+
+
+def tail_latency(base=0.05, jitter=0.01, slow=1.0, slow_fraction=0.03, seed=0):
+    """Latency function for fakes: mostly base +/- jitter seconds, with a slow_fraction of calls taking `slow` seconds."""
+    rng = random.Random(seed)
+
+    def latency(model_id):
+        if rng.random() < slow_fraction:
+            return slow
+        return max(0.0, base + rng.uniform(-jitter, jitter))
+
+    return latency
+
+
+class FakeLambdaContext:
+    """Lambda context whose remaining time counts down from `timeout` seconds."""
+
+    def __init__(self, timeout=30.0, aws_request_id=None):
+        self.deadline = time.monotonic() + timeout
+        self.aws_request_id = aws_request_id
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class FakeBedrockRuntime:
+    """
+    Stand-in for the bedrock-runtime client.
+
+    invoke_model waits `latency` seconds; invoke_model_with_response_stream waits `latency`
+    before the first token and `token_delay` between tokens. `latency` may also be a function
+    of the model ID returning seconds. reply(prompt) chooses the text.
+    A `throttle` fraction of calls (0..1) fail with ThrottlingException instead.
+    """
+
+    def __init__(self, latency=0.0, token_delay=0.0, reply=default_reply, throttle=0.0, seed=0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.reply = reply
+        self.throttle = throttle
+        self.calls = []
+        self._random = random.Random(seed)
+
+    def _latency(self, modelId):
+        return self.latency(modelId) if callable(self.latency) else self.latency
+
+    def _reply_text(self, body, modelId):
+        request = json.loads(body)
+        prompt = request["messages"][-1]["content"]
+        self.calls.append({"modelId": modelId, "prompt": prompt})
+        if self.throttle and self._random.random() < self.throttle:
+            raise throttling_error()
+        return self.reply(prompt)
+
+    def invoke_model(self, body, modelId, **kwargs):
+        text = self._reply_text(body, modelId)
+        time.sleep(self._latency(modelId))
+        usage = {"input_tokens": len(body) // 4, "output_tokens": len(text) // 4}
+        payload = {"content": [{"type": "text", "text": text}], "usage": usage}
+        # Bedrock reports token counts in response headers as well as the body
+        headers = {"x-amzn-bedrock-input-token-count": str(usage["input_tokens"]),
+                   "x-amzn-bedrock-output-token-count": str(usage["output_tokens"])}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")),
+                "ResponseMetadata": {"HTTPStatusCode": 200, "HTTPHeaders": headers}}
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        text = self._reply_text(body, modelId)
+
+        latency = self._latency(modelId)
+
+        def events():
+            time.sleep(latency)
+            for i, token in enumerate(text.split(" ")):
+                if i:
+                    time.sleep(self.token_delay)
+                delta = {"type": "content_block_delta", "index": 0,
+                         "delta": {"type": "text_delta", "text": token if i == 0 else " " + token}}
+                yield {"chunk": {"bytes": json.dumps(delta).encode("utf-8")}}
+            invocation_metrics = {"inputTokenCount": len(body) // 4, "outputTokenCount": len(text) // 4}
+            stop = {"type": "message_stop", "amazon-bedrock-invocationMetrics": invocation_metrics}
+            yield {"chunk": {"bytes": json.dumps(stop).encode("utf-8")}}
+
+        return {"body": events()}
+
+
+class FakeBedrockAgentRuntime:
+    """Stand-in for the bedrock-agent-runtime client (retrieve_and_generate and its stream variant)."""
+
+    def __init__(self, latency=0.0, token_delay=0.0, reply=default_reply, throttle=0.0, seed=0):
+        self.runtime = FakeBedrockRuntime(latency, token_delay, reply, throttle, seed)
+
+    @property
+    def calls(self):
+        return self.runtime.calls
+
+    def _body(self, input):
+        return json.dumps({"messages": [{"role": "user", "content": input["text"]}]})
+
+    def retrieve_and_generate(self, input, retrieveAndGenerateConfiguration, **kwargs):
+        response = self.runtime.invoke_model(self._body(input), "knowledge-base")
+        return {"output": {"text": json.loads(response["body"].read())["content"][0]["text"]}}
+
+    def retrieve_and_generate_stream(self, input, retrieveAndGenerateConfiguration, **kwargs):
+        response = self.runtime.invoke_model_with_response_stream(self._body(input), "knowledge-base")
+
+        def events():
+            for event in response["body"]:
+                chunk = json.loads(event["chunk"]["bytes"])
+                if chunk.get("type") == "content_block_delta":
+                    yield {"output": {"text": chunk["delta"]["text"]}}
+
+        return {"stream": events()}
+
+
+class ConditionalCheckFailedException(Exception):
+    """Mirrors the botocore ClientError raised when a ConditionExpression fails."""
+
+    def __init__(self):
+        super().__init__("The conditional request failed")
+        self.response = {"Error": {"Code": "ConditionalCheckFailedException", "Message": str(self)}}
+
+
+class FakeTable:
+    """
+    In-memory stand-in for a DynamoDB Table resource (get_item / put_item only).
+
+    put_item honours the condition expressions the session store uses:
+    attribute_not_exists(<attr>) and <attr> = :value, with #name placeholders.
+    `latency` may also be a function of the operation name ("GetItem", "PutItem") returning
+    seconds. Conditional writes are atomic, so one table can serve concurrent requests.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.items = {}
+        self.reads = 0
+        self.writes = 0
+        self.conditional_failures = 0
+        self._lock = threading.Lock()
+
+    def _latency(self, operation):
+        return self.latency(operation) if callable(self.latency) else self.latency
+
+    def get_item(self, Key, **kwargs):
+        time.sleep(self._latency("GetItem"))
+        with self._lock:
+            self.reads += 1
+            item = self.items.get(Key["sessionId"])
+            return {"Item": dict(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        time.sleep(self._latency("PutItem"))
+        with self._lock:
+            if ConditionExpression and not self._condition_holds(
+                    self.items.get(Item["sessionId"]), ConditionExpression,
+                    ExpressionAttributeNames or {}, ExpressionAttributeValues or {}):
+                self.conditional_failures += 1
+                raise ConditionalCheckFailedException()
+            self.writes += 1
+            self.items[Item["sessionId"]] = dict(Item)
+        return {}
+
+    @staticmethod
+    def _condition_holds(existing, expression, names, values):
+        expression = expression.strip()
+        if expression.startswith("attribute_not_exists(") and expression.endswith(")"):
+            attr = expression[len("attribute_not_exists("):-1].strip()
+            return existing is None or names.get(attr, attr) not in existing
+        attr, _, placeholder = (part.strip() for part in expression.partition("="))
+        if not placeholder:
+            raise ValueError(f"Unsupported condition expression: {expression}")
+        attr = names.get(attr, attr)
+        return existing is not None and attr in existing and existing[attr] == values[placeholder]
+
+
+def install_fakes(main_module, runtime=None, agent_runtime=None, table=None):
+    """Point main's client accessors (and a fresh model gateway and session store) at fakes; returns (runtime, agent_runtime, table)."""
+    from model_gateway import ModelGateway
+    from sessions import build_session_store
+    runtime = runtime or FakeBedrockRuntime()
+    agent_runtime = agent_runtime or FakeBedrockAgentRuntime()
+    table = table or FakeTable()
+    gateway = ModelGateway(lambda: runtime, lambda: agent_runtime)
+    session_store = build_session_store(lambda: table, backend="dynamodb")
+    main_module.get_bedrock_runtime = lambda: runtime
+    main_module.get_bedrock = lambda: agent_runtime
+    main_module.get_table = lambda: table
+    main_module.get_model_gateway = lambda: gateway
+    main_module.get_session_store = lambda: session_store
+    return runtime, agent_runtime, table
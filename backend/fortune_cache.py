@@ -0,0 +1,145 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+
+# 命盘运势缓存配置（可通过环境变量覆盖）
+FORTUNE_CACHE_ENABLED = os.environ.get("FORTUNE_CACHE_ENABLED", "true").lower() == "true"
+FORTUNE_CACHE_SIZE = int(os.environ.get("FORTUNE_CACHE_SIZE", "2048"))
+FORTUNE_CACHE_VARIANTS = int(os.environ.get("FORTUNE_CACHE_VARIANTS", "3"))
+FORTUNE_CACHE_FRESH_SECONDS = int(os.environ.get("FORTUNE_CACHE_FRESH_SECONDS", str(24 * 3600)))
+FORTUNE_CACHE_STALE_SECONDS = int(os.environ.get("FORTUNE_CACHE_STALE_SECONDS", str(7 * 24 * 3600)))
+# Bump whenever the knowledge base is re-ingested so old fortunes stop matching
+KNOWLEDGE_BASE_VERSION = os.environ.get("KNOWLEDGE_BASE_VERSION", "1")
+
+
+class FortuneCache:
+    """
+    Pool of up to `variants` generated fortunes per (chart, category, language, KB version) key.
+
+    A key serves from its pool once the pool is full, picking a variant at random. A variant
+    older than `fresh_seconds` is still served once but marked due, and the next request for
+    the key regenerates it in its own call (so within that request's deadline, breaker and
+    metrics), keeping the stale text if that fails; one older than `stale_seconds` is dropped.
+    """
+
+    def __init__(self, maxsize=FORTUNE_CACHE_SIZE, variants=FORTUNE_CACHE_VARIANTS,
+                 fresh_seconds=FORTUNE_CACHE_FRESH_SECONDS, stale_seconds=FORTUNE_CACHE_STALE_SECONDS,
+                 kb_version=KNOWLEDGE_BASE_VERSION):
+        self.maxsize = maxsize
+        self.variants = variants
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self.kb_version = kb_version
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._pools = OrderedDict()
+        # key -> the stale (text, created_at) variant the next request regenerates, matched by identity
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def key(self, chart, category, lang):
+        """chart is a bazi_core.Chart: four sexagenary cycle indices, e.g. (6, 15, 43, 44)."""
+        return (tuple(chart), category, lang, self.kb_version)
+
+    def get_or_generate(self, chart, category, lang, generate):
+        """Return a fortune for the key, calling generate() only to fill, expire or refresh the pool."""
+        key = self.key(chart, category, lang)
+        text, due = self._lookup(key)
+        if text is not None:
+            return text
+        try:
+            text = generate()
+        except Exception as e:
+            if due is None:
+                raise
+            logging.warning(f"Fortune refresh failed, serving the stale variant: {str(e)}")
+            return due[0]
+        self._add(key, text, due)
+        return text
+
+    def get_or_generate_stream(self, chart, category, lang, generate_stream):
+        """Streaming get_or_generate: a pooled fortune is yielded whole, a new one chunk by chunk."""
+        key = self.key(chart, category, lang)
+        text, due = self._lookup(key)
+        if text is not None:
+            yield text
+            return
+        parts = []
+        try:
+            for chunk in generate_stream():
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            if due is None or parts:
+                raise
+            logging.warning(f"Fortune refresh failed, serving the stale variant: {str(e)}")
+            yield due[0]
+            return
+        self._add(key, "".join(parts), due)
+
+    def _lookup(self, key):
+        """
+        (pooled text, None) on a hit; (None, None) on a miss; (None, due variant) when this
+        request should regenerate a variant a previous request served stale.
+        """
+        now = time.time()
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is not None:
+                self._pools.move_to_end(key)
+                pool[:] = [variant for variant in pool if now - variant[1] < self.stale_seconds]
+                due = self._due.pop(key, None)
+                if due is not None and any(variant is due for variant in pool):
+                    return None, due
+            if not pool or len(pool) < self.variants:
+                self.misses += 1
+                return None, None
+            variant = random.choice(pool)
+            if now - variant[1] < self.fresh_seconds:
+                self.hits += 1
+                return variant[0], None
+            self.stale_hits += 1
+            self._due[key] = variant
+            return variant[0], None
+
+    def _add(self, key, text, replace=None):
+        """Pool a new variant, in place of `replace` when it is still pooled, else of the oldest once full."""
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            self._pools.move_to_end(key)
+            slot = next((i for i, variant in enumerate(pool) if variant is replace), None) if replace is not None else None
+            if slot is not None:
+                pool[slot] = (text, time.time())
+                self.refreshes += 1
+            elif len(pool) < self.variants:
+                pool.append((text, time.time()))
+            else:
+                pool[min(range(len(pool)), key=lambda i: pool[i][1])] = (text, time.time())
+            while len(self._pools) > self.maxsize:
+                evicted, _ = self._pools.popitem(last=False)
+                self._due.pop(evicted, None)
+
+    def invalidate(self, kb_version=None):
+        """Drop every cached fortune; with kb_version, also start keying on the new knowledge base version."""
+        with self._lock:
+            self._pools.clear()
+            self._due.clear()
+            if kb_version is not None:
+                self.kb_version = kb_version
+        logging.info(f"Fortune cache invalidated (knowledge base version {self.kb_version})")
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "keys": len(self._pools),
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0
+        }
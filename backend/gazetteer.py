@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import time
+import logging
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+
+# 离线地名库：中英文城市/省份/国家名 → 经纬度与时区，字符前缀树支持文本扫描与模糊匹配，无需联网地理编码
+# Shipped inside the package next to solar_terms.bin; when it is missing every lookup returns None,
+# so locations fall back to the comma/word heuristics and timezones to the tz_cache path
+GAZETTEER_PATH = os.environ.get(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer_places.tsv")
+)
+# Latin names of at least this many characters resolve from one typo (a missing, extra, wrong or swapped letter)
+FUZZY_MIN_LENGTH = 5
+# An unambiguous prefix this long resolves on its own ("Shangh" -> Shanghai)
+PREFIX_MIN_LENGTH = 4
+# Latin aliases shorter than this (LA, HK, UK) only resolve as whole strings, never inside free text
+SCAN_MIN_LATIN_LENGTH = 3
+# Chinese aliases must be at least this long to be matched inside free text (沪 alone is too ambiguous)
+SCAN_MIN_CJK_LENGTH = 2
+SCAN_STOPWORDS = {"phoenix"}
+# Most specific wins when several places match: a city over a province over a country
+KIND_RANK = {"city": 0, "region": 1, "country": 2}
+
+Place = namedtuple("Place", ["name", "kind", "country", "latitude", "longitude", "timezone", "aliases"])
+
+PART_SEPARATORS = re.compile(r"[,，、;；/]")
+LEADING_WORDS = re.compile(r"^(?:the|city of)\s+")
+TRAILING_WORDS = re.compile(r"\s+(?:city|province|municipality|prefecture|county)$")
+ZH_SUFFIXES = ("特别行政区", "自治区", "省", "市", "县", "區", "区")
+PUNCTUATION = re.compile(r"[^\w\s'\u4e00-\u9fff]")
+WHITESPACE = re.compile(r"\s+")
+END = None
+
+
+def normalize(text):
+    """Lowercase, accents and full-width forms folded, punctuation (except apostrophes) and extra spaces removed."""
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return WHITESPACE.sub(" ", PUNCTUATION.sub(" ", text.lower())).strip()
+
+
+def is_cjk(text):
+    return any("\u4e00" <= char <= "\u9fff" for char in text)
+
+
+class Gazetteer:
+    """
+    Places indexed by every normalized name and alias in a character trie (nested dicts, the
+    place index stored under the None key), plus a one-deletion index over Latin names for typos.
+
+    lookup() resolves a location string: exact name, then comma-separated parts, then any known
+    name inside it, then an unambiguous prefix, then a single-typo match. find_in_text() finds
+    the most specific place named anywhere in a free-text query.
+    """
+
+    def __init__(self, places):
+        self.places = places
+        self.names = {}
+        self.trie = {}
+        self.deletions = {}
+        for index, place in enumerate(places):
+            for name in place_names(place):
+                current = self.names.get(name)
+                if current is not None and KIND_RANK[places[current].kind] <= KIND_RANK[place.kind]:
+                    continue
+                self.names[name] = index
+                node = self.trie
+                for char in name:
+                    node = node.setdefault(char, {})
+                node[END] = index
+        for name, index in self.names.items():
+            if len(name) >= FUZZY_MIN_LENGTH and not is_cjk(name):
+                for deletion in deletions(name):
+                    self.deletions.setdefault(deletion, set()).add(index)
+
+    def best(self, indexes):
+        return self.places[min(indexes, key=lambda i: KIND_RANK[self.places[i].kind])] if indexes else None
+
+    def exact(self, name):
+        """The place for a normalized name, also trying it without suffixes like "City", "省" or "市"."""
+        index = self.names.get(name)
+        if index is None:
+            stripped = TRAILING_WORDS.sub("", LEADING_WORDS.sub("", name))
+            for suffix in ZH_SUFFIXES:
+                if stripped.endswith(suffix) and len(stripped) > len(suffix) + 1:
+                    stripped = stripped[:-len(suffix)]
+                    break
+            index = self.names.get(stripped)
+        return index
+
+    def lookup(self, location):
+        name = normalize(location)
+        if not name:
+            return None
+        index = self.exact(name)
+        if index is not None:
+            return self.places[index]
+        parts = [part.strip() for part in PART_SEPARATORS.split(name) if part.strip()]
+        found = [index for index in map(self.exact, parts) if index is not None]
+        if found:
+            return self.best(found)
+        found = [index for index, _, _ in self.scan(name)]
+        if found:
+            return self.best(found)
+        for part in parts:
+            if not is_cjk(part):
+                found.extend(self.complete(part))
+        if found:
+            return self.best(found)
+        for part in parts:
+            if not is_cjk(part):
+                found.extend(self.fuzzy(part))
+        return self.best(found)
+
+    def complete(self, prefix):
+        """The place whose names are the only ones starting with prefix, as a one-item list (else empty)."""
+        if len(prefix) < PREFIX_MIN_LENGTH:
+            return []
+        node = self.trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        found, stack = set(), [node]
+        while stack and len(found) < 2:
+            node = stack.pop()
+            for char, child in node.items():
+                if char is END:
+                    found.add(child)
+                else:
+                    stack.append(child)
+        return list(found) if len(found) == 1 else []
+
+    def scan(self, text):
+        """Every (place index, start, end) for a known name in normalized text; Latin names must sit on word boundaries."""
+        matches = []
+        length = len(text)
+        for start in range(length):
+            char = text[start]
+            node = self.trie.get(char)
+            if node is None:
+                continue
+            latin = not ("\u4e00" <= char <= "\u9fff")
+            if latin and start > 0 and text[start - 1].isalnum():
+                continue
+            match = None
+            end = start
+            while node is not None:
+                end += 1
+                index = node.get(END)
+                if index is not None and (not latin or end == length or not text[end].isalnum()):
+                    match = (index, end)
+                node = node.get(text[end]) if end < length else None
+            if match is None:
+                continue
+            index, end = match
+            name = text[start:end]
+            if name in SCAN_STOPWORDS or len(name) < (SCAN_MIN_LATIN_LENGTH if latin else SCAN_MIN_CJK_LENGTH):
+                continue
+            matches.append((index, start, end))
+        return matches
+
+    def find_in_text(self, text):
+        """(place, matched text) for the most specific place named in free text, else None."""
+        name = normalize(text)
+        matches = self.scan(name)
+        if not matches:
+            return None
+        index, start, end = min(matches, key=lambda match: (KIND_RANK[self.places[match[0]].kind], -(match[2] - match[1])))
+        return self.places[index], name[start:end]
+
+    def fuzzy(self, word):
+        """
+        Places with a name one typo away (symmetric deletion: two strings within one insertion,
+        deletion, substitution or adjacent swap share a one-character deletion).
+        """
+        if len(word) < FUZZY_MIN_LENGTH - 1:
+            return []
+        found = set(self.deletions.get(word, ()))
+        for deletion in deletions(word):
+            index = self.names.get(deletion)
+            if index is not None:
+                found.add(index)
+            found.update(self.deletions.get(deletion, ()))
+        return list(found)
+
+
+def deletions(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def place_names(place):
+    yield normalize(place.name)
+    for alias in place.aliases:
+        yield normalize(alias)
+
+
+def load_places(path=None):
+    path = path or GAZETTEER_PATH
+    places = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            name, kind, country, latitude, longitude, timezone, aliases = line.rstrip("\n").split("\t")
+            places.append(Place(name, kind, country, float(latitude), float(longitude), timezone,
+                                tuple(alias for alias in aliases.split("|") if alias)))
+    logging.info(f"Loaded {len(places)} gazetteer places from {path}")
+    return places
+
+
+@lru_cache(maxsize=None)
+def get_gazetteer(path=None):
+    """The index over the packaged places (built once), or None when the table cannot be read."""
+    path = path or GAZETTEER_PATH
+    try:
+        return Gazetteer(load_places(path))
+    except (OSError, ValueError) as e:
+        logging.warning(f"Gazetteer unavailable ({str(e)}). Falling back to location heuristics.")
+        return None
+
+
+@lru_cache(maxsize=1024)
+def resolve_place(location):
+    """The Place for a location string (name, alias, "City, Country", Chinese address or a near-miss spelling), or None."""
+    gazetteer = get_gazetteer()
+    if not location or gazetteer is None:
+        return None
+    return gazetteer.lookup(location)
+
+
+def find_place(text):
+    """(Place, matched text) for the most specific place named anywhere in a query, or None."""
+    gazetteer = get_gazetteer()
+    return gazetteer.find_in_text(text) if gazetteer is not None else None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    start = time.perf_counter()
+    gazetteer = get_gazetteer()
+    print(f"Built index over {len(gazetteer.names)} names in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for location in sys.argv[1:]:
+        start = time.perf_counter()
+        place = resolve_place.__wrapped__(location)
+        print(f"{location!r} -> {place} ({(time.perf_counter() - start) * 1e6:.1f} us)")
@@ -0,0 +1,195 @@
+import os
+import re
+import sys
+import gzip
+import json
+import math
+import time
+import random
+import logging
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+# 本地意图/类别分类器：字符 n-gram + 线性模型（逻辑回归），正则未命中时先于 LLM 使用
+CLASSIFIER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_classifier.json.gz")
+LABELED_QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "classifier", "labeled_queries.jsonl")
+# Predictions below this confidence escalate to the LLM
+CLASSIFIER_CONFIDENCE_THRESHOLD = float(os.environ.get("CLASSIFIER_CONFIDENCE_THRESHOLD", "0.8"))
+NGRAM_SIZES = (2, 3)
+# SGD settings, tuned on the held-out split
+EPOCHS = 20
+LEARNING_RATE = 1.0
+L2_PENALTY = 1e-4
+# Every 5th labeled query is held out for evaluation
+EVAL_EVERY = 5
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+CJK_PATTERN = re.compile(r"[\u4e00-\u9fff]")
+WHITESPACE = re.compile(r"\s+")
+
+Prediction = namedtuple("Prediction", ["intent", "intent_confidence", "category", "category_confidence"])
+
+
+def features(text):
+    """The set of character 2- and 3-grams over the padded, lowercased text, plus English words and Chinese characters."""
+    text = " " + WHITESPACE.sub(" ", text.lower()).strip() + " "
+    grams = {text[i:i + n] for n in NGRAM_SIZES for i in range(len(text) - n + 1)}
+    grams.update("w:" + word for word in WORD_PATTERN.findall(text))
+    grams.update(CJK_PATTERN.findall(text))
+    return grams
+
+
+class LinearModel:
+    """
+    Multinomial logistic regression over binary n-gram features, trained offline with SGD.
+    Feature sums are scaled by 1/sqrt(len(features)) so long and short queries score alike.
+    """
+
+    def __init__(self, classes, bias, weights):
+        self.classes = classes
+        self.bias = bias
+        self.weights = weights
+
+    @classmethod
+    def train(cls, texts, labels, epochs=EPOCHS, learning_rate=LEARNING_RATE, l2=L2_PENALTY, seed=0):
+        classes = sorted(set(labels))
+        bias = [0.0] * len(classes)
+        weights = {}
+        examples = [(features(text), classes.index(label)) for text, label in zip(texts, labels)]
+        shuffle = random.Random(seed).shuffle
+        for epoch in range(epochs):
+            shuffle(examples)
+            rate = learning_rate / (1 + 0.1 * epoch)
+            for grams, target in examples:
+                scale = 1 / math.sqrt(len(grams))
+                probabilities = cls.softmax([b + scale * sum(weights[g][i] for g in grams if g in weights)
+                                             for i, b in enumerate(bias)])
+                for i, probability in enumerate(probabilities):
+                    gradient = probability - (i == target)
+                    bias[i] -= rate * gradient
+                    for gram in grams:
+                        w = weights.setdefault(gram, [0.0] * len(classes))
+                        w[i] -= rate * (gradient * scale + l2 * w[i])
+        return cls(classes, [round(b, 3) for b in bias],
+                   {gram: tuple(round(w, 3) for w in ws) for gram, ws in weights.items() if any(abs(w) >= 0.001 for w in ws)})
+
+    @staticmethod
+    def softmax(scores):
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, grams):
+        """Return (label, confidence) for a collection of features."""
+        rows = [weights for weights in map(self.weights.get, grams) if weights is not None]
+        if rows:
+            scale = 1 / math.sqrt(len(grams))
+            scores = [b + sum(column) * scale for b, column in zip(self.bias, zip(*rows))]
+        else:
+            scores = self.bias
+        probabilities = self.softmax(scores)
+        best = max(range(len(scores)), key=probabilities.__getitem__)
+        return self.classes[best], probabilities[best]
+
+    def to_dict(self):
+        return {"classes": self.classes, "bias": self.bias, "weights": self.weights}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["classes"], data["bias"], {feature: tuple(w) for feature, w in data["weights"].items()})
+
+
+def load_labeled_queries(path=LABELED_QUERIES_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def split_queries(rows):
+    """(train, eval) with every EVAL_EVERY-th query of each intent/category label held out."""
+    train, held_out, seen = [], [], Counter()
+    for row in rows:
+        label = (row["intent"], row["category"])
+        (held_out if seen[label] % EVAL_EVERY == EVAL_EVERY - 1 else train).append(row)
+        seen[label] += 1
+    return train, held_out
+
+
+def train_models(rows):
+    texts = [row["text"] for row in rows]
+    return {
+        "intent": LinearModel.train(texts, [row["intent"] for row in rows]),
+        # Category is only asked of fortune-telling queries; "none" covers general readings
+        "category": LinearModel.train([row["text"] for row in rows if row["intent"] == "fortune"],
+                                          [row["category"] for row in rows if row["intent"] == "fortune"])
+    }
+
+
+def write_classifier(models, path=CLASSIFIER_PATH):
+    payload = json.dumps({name: model.to_dict() for name, model in models.items()},
+                         ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    with gzip.open(path, "wb", compresslevel=9) as f:
+        f.write(payload)
+    logging.info(f"Wrote classifier ({os.path.getsize(path)} bytes) to {path}")
+
+
+@lru_cache(maxsize=None)
+def load_classifier(path=None):
+    """The shipped intent/category models (loaded once), or None when the artifact cannot be read."""
+    path = path or CLASSIFIER_PATH
+    try:
+        with gzip.open(path, "rb") as f:
+            data = json.loads(f.read())
+        return {name: LinearModel.from_dict(model) for name, model in data.items()}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Intent classifier unavailable ({str(e)}). Escalating every query to the LLM.")
+        return None
+
+
+@lru_cache(maxsize=256)
+def classify(text):
+    """
+    Intent ('fortune' or 'other') and category ('love', 'career', 'health' or 'none'), each with its
+    confidence. Without the model artifact every query is 'fortune'/'none' at confidence 0, i.e. escalated.
+    """
+    models = load_classifier()
+    if models is None:
+        return Prediction("fortune", 0.0, "none", 0.0)
+    grams = features(text)
+    intent, intent_confidence = models["intent"].predict(grams)
+    category, category_confidence = models["category"].predict(grams)
+    return Prediction(intent, intent_confidence, category, category_confidence)
+
+
+def evaluate(models, rows, threshold=CLASSIFIER_CONFIDENCE_THRESHOLD):
+    """Accuracy over all rows and over the rows answered locally (confidence >= threshold), plus coverage."""
+    report = {}
+    for name, key, subset in (("intent", "intent", rows), ("category", "category", [row for row in rows if row["intent"] == "fortune"])):
+        predictions = [models[name].predict(features(row["text"])) for row in subset]
+        confident = [(label, row[key]) for (label, confidence), row in zip(predictions, subset) if confidence >= threshold]
+        report[name] = {
+            "accuracy": sum(label == row[key] for (label, _), row in zip(predictions, subset)) / len(subset),
+            "coverage": len(confident) / len(subset),
+            "confident_accuracy": sum(label == truth for label, truth in confident) / len(confident) if confident else None
+        }
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    rows = load_labeled_queries()
+    train, held_out = split_queries(rows)
+    report = evaluate(train_models(train), held_out)
+    for name, row in report.items():
+        print(f"{name:>8}: held-out accuracy {row['accuracy']:.2f}, answered locally {row['coverage']:.0%} "
+              f"at confidence >= {CLASSIFIER_CONFIDENCE_THRESHOLD} with accuracy {row['confident_accuracy'] or 0:.2f}")
+    if "--eval-only" not in sys.argv:
+        # The shipped artifact is trained on every labeled query
+        write_classifier(train_models(rows))
+        load_classifier.cache_clear()
+        classify.cache_clear()
+        queries = [row["text"] for row in held_out]
+        start = time.perf_counter()
+        for query in queries * 50:
+            classify.__wrapped__(query)
+        print(f"Inference: {(time.perf_counter() - start) / (len(queries) * 50) * 1e6:.1f} us per query")
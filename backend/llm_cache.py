@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# LLM 响应缓存配置（可通过环境变量覆盖）
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "none")  # none | sqlite | dynamodb
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "/tmp/llm_cache.sqlite")
+LLM_CACHE_TABLE = os.environ.get("LLM_CACHE_TABLE", "ZhouyiLLMCache")
+# Calls at or above this temperature are creative and never cached
+LLM_CACHE_BYPASS_TEMPERATURE = float(os.environ.get("LLM_CACHE_BYPASS_TEMPERATURE", "0.9"))
+
+# Seconds to keep a response per prompt type; types not listed here are not cached
+PROMPT_TYPE_TTLS = {
+    "missing_info": 6 * 3600,
+    "classification": 24 * 3600,
+    "extraction": 24 * 3600
+}
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_messages(messages):
+    """Collapse whitespace in message text so indentation changes do not split cache entries."""
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = WHITESPACE.sub(" ", content).strip()
+        normalized.append({"role": message.get("role"), "content": content})
+    return normalized
+
+
+def cache_key(model_id, messages, params):
+    """SHA-256 over (modelId, normalized messages, sampling params)."""
+    payload = json.dumps({"modelId": model_id, "messages": normalize_messages(messages), "params": params},
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheTier:
+    """Shared cache tier backed by a local SQLite file (stand-in for a shared store in tests and local runs)."""
+
+    def __init__(self, path=LLM_CACHE_PATH):
+        import sqlite3
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(value, expires_at) for a live entry, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[0], row[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)", (key, value, time.time() + ttl))
+            self._conn.commit()
+
+
+class DynamoDBCacheTier:
+    """Shared cache tier backed by a DynamoDB table keyed on `cacheKey` with a `ttl` attribute."""
+
+    def __init__(self, table_name=LLM_CACHE_TABLE, region_name="us-east-2"):
+        import boto3
+        self._table = boto3.resource("dynamodb", region_name=region_name).Table(table_name)
+
+    def get(self, key):
+        """(value, expires_at) for a live entry, or None (DynamoDB deletes expired items only eventually)."""
+        item = self._table.get_item(Key={"cacheKey": key}).get("Item")
+        if item is None or int(item["ttl"]) < time.time():
+            return None
+        return item["value"].value, int(item["ttl"])
+
+    def set(self, key, value, ttl):
+        self._table.put_item(Item={"cacheKey": key, "value": value, "ttl": int(time.time() + ttl)})
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache of raw model response bodies.
+
+    Lookups check the in-process LRU first, then the optional shared tier (anything with
+    set(key, value, ttl) and get(key) returning (value, expires_at) or None); shared hits are
+    copied into the local tier until the shared entry expires, never past it.
+    """
+
+    def __init__(self, maxsize=LLM_CACHE_SIZE, shared=None, ttls=PROMPT_TYPE_TTLS,
+                 bypass_temperature=LLM_CACHE_BYPASS_TEMPERATURE):
+        self.maxsize = maxsize
+        self.shared = shared
+        self.ttls = ttls
+        self.bypass_temperature = bypass_temperature
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl_for(self, prompt_type, temperature):
+        """TTL in seconds for a call, or None if the call must bypass the cache."""
+        ttl = self.ttls.get(prompt_type)
+        if not ttl or temperature >= self.bypass_temperature:
+            return None
+        return ttl
+
+    def get(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.local_hits += 1
+                    return entry[0]
+                del self._entries[key]
+        if self.shared is not None:
+            try:
+                entry = self.shared.get(key)
+            except Exception as e:
+                logging.warning(f"LLM cache shared tier get failed: {str(e)}")
+                entry = None
+            if entry is not None:
+                value, expires_at = entry
+                with self._lock:
+                    self.shared_hits += 1
+                self._set_local(key, bytes(value), min(expires_at, now + ttl))
+                return bytes(value)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl):
+        self._set_local(key, value, time.time() + ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                logging.warning(f"LLM cache shared tier set failed: {str(e)}")
+
+    def _set_local(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    def stats(self):
+        lookups = self.local_hits + self.shared_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "size": len(self._entries),
+            "hit_rate": (self.local_hits + self.shared_hits) / lookups if lookups else 0.0
+        }
+
+
+def build_shared_tier(backend=LLM_CACHE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteCacheTier(LLM_CACHE_PATH)
+    if backend == "dynamodb":
+        return DynamoDBCacheTier(LLM_CACHE_TABLE)
+    return None
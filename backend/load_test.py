@@ -0,0 +1,317 @@
+import os
+import re
+import math
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import extraction
+import gazetteer
+import metrics
+import resilience
+from fakes import (FakeBedrockRuntime, FakeBedrockAgentRuntime, FakeTable, FakeLambdaContext,
+                   default_reply, install_fakes, tail_latency)
+
+# 离线压测：合成中英文多轮对话，并发回放到 lambda_handler，后端为可配置延迟分布与限流率的替身
+LOAD_CONVERSATIONS = int(os.environ.get("LOAD_CONVERSATIONS", "200"))
+LOAD_CONCURRENCY = int(os.environ.get("LOAD_CONCURRENCY", "16"))
+# Fraction of conversations written in Chinese
+LOAD_ZH_FRACTION = float(os.environ.get("LOAD_ZH_FRACTION", "0.4"))
+# A client resends a turn answered 503 (fortune generation shed) at most this many times
+LOAD_CLIENT_RETRIES = int(os.environ.get("LOAD_CLIENT_RETRIES", "1"))
+PERCENTILES = (50, 95, 99)
+
+OPENERS = {
+    "en": ["What will my future hold?", "Can you tell my fortune?", "I'd like a reading please",
+           "What does destiny have in store for me?"],
+    "zh": ["帮我算算命运", "请问我的运势如何", "我想算命", "告诉我未来会怎样"]
+}
+OFF_TOPIC = {
+    "en": ["What is the date today?", "What's the capital of France?", "Can you recommend a good book?"],
+    "zh": ["今天天气怎么样", "今天几号", "推荐一本好书"]
+}
+CLOSINGS = {"en": ["Thank you!", "Thanks, that's helpful"], "zh": ["谢谢", "多谢大师"]}
+# How the synthesized users name a category; the fake model maps these back, as the real one would
+CATEGORY_WORDS = {
+    "en": {"love": ["love life", "relationship", "marriage"], "career": ["career", "job", "promotion"],
+           "health": ["health", "wellbeing"]},
+    "zh": {"love": ["爱情", "婚姻"], "career": ["事业", "工作"], "health": ["健康", "身体"]}
+}
+# The fake model's own reading of Chinese dates: extraction's patterns need a word boundary before the year,
+# which "我1985年..." lacks, and a real model is not bound by them
+ZH_DATETIME = re.compile(r'(\d{4})年(\d{1,2})月(\d{1,2})[日号]?(?:(上午|下午)(\d{1,2})点)?')
+EN_MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+             "October", "November", "December"]
+
+
+def city_names():
+    """(English name, Chinese alias or None) for every gazetteer city."""
+    cities = []
+    for place in gazetteer.load_places():
+        if place.kind == "city":
+            aliases = [alias for alias in place.aliases if gazetteer.is_cjk(alias)]
+            cities.append((place.name, aliases[0] if aliases else None))
+    return cities
+
+
+def birth_phrase(rng, lang):
+    """A random birth date and time, written in one of the forms users (and extraction's patterns) use."""
+    year, month, day = rng.randint(1950, 2005), rng.randint(1, 12), rng.randint(1, 28)
+    hour, minute = rng.randint(0, 23), rng.choice((0, 15, 30, 45))
+    if lang == "zh":
+        # 上午/下午 with 1-11 only: "上午12点" reads differently to different people
+        hour = rng.choice([h for h in range(24) if h % 12])
+        return f"{year}年{month}月{day}日{'上午' if hour < 12 else '下午'}{hour % 12}点"
+    style = rng.randrange(3)
+    if style == 0:
+        return f"{year}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}"
+    if style == 1:
+        return f"{EN_MONTHS[month - 1]} {day}, {year} at {hour % 12 or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+    return f"{day} {EN_MONTHS[month - 1]} {year}"
+
+
+def synthesize_conversation(rng, lang, cities):
+    """
+    One user's turns. Shapes, by weight: everything in the first message; an opener followed by
+    one missing field per turn (in random order); or a partial first message with the rest
+    bundled later. Some users wander off-topic mid-way, and most say thanks after the fortune.
+    """
+    english, chinese = rng.choice(cities)
+    location = chinese if lang == "zh" and chinese else english
+    category = rng.choice(list(CATEGORY_WORDS[lang]))
+    category_word = rng.choice(CATEGORY_WORDS[lang][category])
+    birth = birth_phrase(rng, lang)
+    if lang == "zh":
+        full = f"我{birth}出生在{location}，想问{category_word}"
+        answers = [f"我出生于{birth}", f"出生在{location}", category_word]
+    else:
+        full = f"I was born on {birth} in {location}. How is my {category_word}?"
+        answers = [f"I was born on {birth}", f"I was born in {location}", f"Tell me about my {category_word}"]
+
+    shape = rng.random()
+    if shape < 0.3:
+        turns = [full]
+    elif shape < 0.75:
+        rng.shuffle(answers)
+        turns = [rng.choice(OPENERS[lang])] + answers
+    else:
+        first, *rest = answers
+        turns = [first, (" " if lang == "en" else "，").join(rest)]
+    if rng.random() < 0.25:
+        turns.insert(rng.randint(1, len(turns)), rng.choice(OFF_TOPIC[lang]))
+    if rng.random() < 0.7:
+        turns.append(rng.choice(CLOSINGS[lang]))
+    return {"lang": lang, "turns": turns}
+
+
+def synthesize_conversations(n, seed=0, zh_fraction=LOAD_ZH_FRACTION):
+    rng = random.Random(seed)
+    cities = city_names()
+    return [synthesize_conversation(rng, "zh" if rng.random() < zh_fraction else "en", cities) for _ in range(n)]
+
+
+def model_datetime(query):
+    match = ZH_DATETIME.search(query)
+    if match is None:
+        return extraction.match_datetime(query)
+    year, month, day, period, hour = match.groups()
+    hour = int(hour or 0) + (12 if period == "下午" else 0)
+    return f"{year}-{int(month):02d}-{int(day):02d} {hour:02d}:00"
+
+
+def model_reply(prompt):
+    """
+    A model that understands the synthesized users: extraction prompts get the fields actually
+    present in the query (and off-topic questions are recognised); everything else gets prose.
+    """
+    if "Respond with only a JSON object" not in prompt:
+        return default_reply(prompt)
+    query = prompt.split('Query: "', 1)[1].split('"\n', 1)[0]
+    lang = extraction.detect_language(query)
+    category = next((name for name, words in CATEGORY_WORDS[lang].items() if any(word in query for word in words)), None)
+    answers = {
+        "birth_datetime": model_datetime(query),
+        "location": extraction.gazetteer_location(query),
+        "category": category,
+        "is_fortune_telling": not any(query == text for texts in (OFF_TOPIC, CLOSINGS) for text in texts[lang])
+    }
+    return json.dumps({field: value for field, value in answers.items() if f'"{field}"' in prompt})
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class LoadRecorder:
+    """Per-turn outcomes collected from every worker thread."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.status_codes = Counter()
+        self.client_retries = 0
+        self.delivered = 0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def record(self, transition, seconds, status_code):
+        with self._lock:
+            self.latencies[transition].append(seconds)
+            self.status_codes[status_code] += 1
+            if status_code == 200 and transition[1] == "delivered" and transition[0] != "delivered":
+                self.delivered += 1
+
+    def record_error(self, error):
+        with self._lock:
+            self.errors.append(f"{type(error).__name__}: {error}")
+
+    def record_client_retry(self):
+        with self._lock:
+            self.client_retries += 1
+
+
+def run_conversation(handler, conversation, recorder, timeout, client_retries):
+    """Send one conversation's turns in order, as its user would, carrying the session ID along."""
+    session_id, state = None, "new"
+    for query in conversation["turns"]:
+        for attempt in range(client_retries + 1):
+            context = FakeLambdaContext(timeout, aws_request_id=str(uuid.uuid4()))
+            start = time.perf_counter()
+            try:
+                response = handler({"body": json.dumps({"query": query}), "sessionId": session_id}, context)
+            except Exception as e:
+                recorder.record((state, "error"), time.perf_counter() - start, "exception")
+                recorder.record_error(e)
+                return
+            seconds = time.perf_counter() - start
+            if response is None:
+                recorder.record((state, "none"), seconds, None)
+                break
+            body = json.loads(response["body"])
+            next_state = body.get("state", "unknown")
+            recorder.record((state, next_state), seconds, response["statusCode"])
+            session_id = body.get("sessionId", session_id)
+            state = next_state
+            if response["statusCode"] != 503:
+                break
+            if attempt < client_retries:
+                recorder.record_client_retry()
+
+
+def run_load(conversations, handler_name="sync", concurrency=LOAD_CONCURRENCY, model_latency=None, table_latency=None,
+             throttle=0.02, rate_limit=None, timeout=30.0, client_retries=LOAD_CLIENT_RETRIES, seed=0):
+    """
+    Replay conversations through the chosen handler with `concurrency` users at a time, all sharing
+    one container's state (caches, rate limiter, circuit breaker, thread pools) as a warm Lambda
+    would not: this models a burst served by one process. Returns the report dict.
+    """
+    import main
+    import async_handler
+
+    handler = main.lambda_handler if handler_name == "sync" else async_handler.lambda_handler
+    model_latency = model_latency or tail_latency(base=0.05, jitter=0.02, slow=0.8, slow_fraction=0.02, seed=seed)
+    table_latency = table_latency or tail_latency(base=0.008, jitter=0.004, slow=0.1, slow_fraction=0.01, seed=seed + 1)
+    runtime, agent_runtime, table = install_fakes(
+        main, FakeBedrockRuntime(model_latency, reply=model_reply, throttle=throttle, seed=seed),
+        FakeBedrockAgentRuntime(model_latency, reply=model_reply, throttle=throttle, seed=seed + 2), FakeTable(table_latency))
+    main.get_llm_cache.cache_clear()
+    main.fortune_cache.invalidate()
+    limiter, breaker = resilience.rate_limiter, resilience.circuit_breaker
+    if rate_limit is not None:
+        resilience.rate_limiter = resilience.TokenBucket(rate=rate_limit)
+    resilience.circuit_breaker = resilience.CircuitBreaker()
+    counters_before = resilience.stats()
+
+    recorder = LoadRecorder()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(run_conversation, handler, conversation, recorder, timeout, client_retries)
+                           for conversation in conversations]:
+                future.result()
+    finally:
+        resilience.rate_limiter, resilience.circuit_breaker = limiter, breaker
+    elapsed = time.perf_counter() - start
+
+    counters = resilience.stats()
+    turns = sum(len(latencies) for latencies in recorder.latencies.values())
+    model_calls = Counter(call["modelId"] for call in runtime.calls + agent_runtime.calls)
+    return {
+        "handler": handler_name,
+        "conversations": len(conversations),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "turns": turns,
+        "turns_per_second": round(turns / elapsed, 2),
+        "conversations_per_second": round(len(conversations) / elapsed, 2),
+        "delivered_fortunes": recorder.delivered,
+        "model_calls": sum(model_calls.values()),
+        "model_calls_by_model": dict(model_calls),
+        "model_calls_per_fortune": round(sum(model_calls.values()) / recorder.delivered, 2) if recorder.delivered else None,
+        "status_codes": {str(code): n for code, n in recorder.status_codes.items()},
+        "client_retries": recorder.client_retries,
+        "errors": recorder.errors[:10],
+        "resilience": {key: value - counters_before.get(key, 0) for key, value in counters.items() if isinstance(value, int)},
+        "table": {"reads": table.reads, "writes": table.writes, "conditional_failures": table.conditional_failures},
+        "transitions": {
+            f"{before} -> {after}": dict({"n": len(latencies)},
+                                         **{f"p{p}_ms": round(1000 * percentile(latencies, p), 1) for p in PERCENTILES})
+            for (before, after), latencies in sorted(recorder.latencies.items())
+        }
+    }
+
+
+def print_report(report):
+    print(f"{report['handler']} handler: {report['conversations']} conversations ({report['turns']} turns) "
+          f"at concurrency {report['concurrency']} in {report['seconds']} s")
+    print(f"  throughput: {report['turns_per_second']} turns/s, {report['conversations_per_second']} conversations/s")
+    print(f"  delivered fortunes: {report['delivered_fortunes']}, model calls: {report['model_calls']} "
+          f"({report['model_calls_per_fortune']} per fortune) {report['model_calls_by_model']}")
+    print(f"  status codes: {report['status_codes']}, client retries: {report['client_retries']}")
+    print(f"  resilience: {report['resilience']}")
+    print(f"  table: {report['table']}")
+    print(f"  {'transition':<48}{'n':>6}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES))
+    for transition, row in report["transitions"].items():
+        print(f"  {transition:<48}{row['n']:>6}" + "".join(f"{row[f'p{p}_ms']:>10}" for p in PERCENTILES))
+    for error in report["errors"]:
+        print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay synthesized multi-turn conversations concurrently against fake backends")
+    parser.add_argument("--conversations", type=int, default=LOAD_CONVERSATIONS)
+    parser.add_argument("--concurrency", type=int, default=LOAD_CONCURRENCY)
+    parser.add_argument("--handler", choices=["sync", "async"], default="sync")
+    parser.add_argument("--model-latency", type=float, default=0.05, help="typical Bedrock latency in seconds")
+    parser.add_argument("--model-slow", type=float, default=0.8, help="latency of the slow tail in seconds")
+    parser.add_argument("--model-slow-fraction", type=float, default=0.02)
+    parser.add_argument("--table-latency", type=float, default=0.008, help="typical DynamoDB latency in seconds")
+    parser.add_argument("--throttle", type=float, default=0.02, help="fraction of model calls failing with ThrottlingException")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="client-side Bedrock calls/second for the run (0 disables; default: BEDROCK_RATE_LIMIT)")
+    parser.add_argument("--zh-fraction", type=float, default=LOAD_ZH_FRACTION)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    # Importing main configures logging; the per-turn records (and every throttled attempt) would drown the report
+    import main
+    logging.getLogger().setLevel(logging.CRITICAL)
+    metrics.sink = None
+
+    report = run_load(
+        synthesize_conversations(args.conversations, args.seed, args.zh_fraction), args.handler, args.concurrency,
+        model_latency=tail_latency(args.model_latency, args.model_latency * 0.4, args.model_slow, args.model_slow_fraction, args.seed),
+        table_latency=tail_latency(args.table_latency, args.table_latency * 0.5, 0.1, 0.01, args.seed + 1),
+        throttle=args.throttle, rate_limit=args.rate_limit, seed=args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
@@ -1,120 +1,97 @@
+import io
+import os
 import json
 import time
-import uuid
-import random
 import logging
-import re
 from datetime import datetime
-import boto3
-import botocore.exceptions
+from functools import lru_cache
+import metrics
+from structured_logging import configure_logging, log_event, start_log_context, end_log_context
+from extraction import detect_language, extract_query
+from llm_cache import LLMResponseCache, build_shared_tier, cache_key
+from fortune_cache import FortuneCache, FORTUNE_CACHE_ENABLED
+from retrieval import get_index, retrieve
+from intent_classifier import classify, CLASSIFIER_CONFIDENCE_THRESHOLD
+from model_gateway import ModelGateway, create_client, model_arn, SONNET_MODEL_ID, HAIKU_MODEL_ID
+from response_templates import missing_info_response
+from resilience import ModelCallShed, call_with_budget, start_request, end_request
+from sessions import SessionUnitOfWork, build_session_store, current_unit_of_work
 
-# 初始化 AWS 客户端
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-table = dynamodb.Table('ZhouyiSessions')
-bedrock = boto3.client('bedrock-agent-runtime', region_name='us-east-2')
-bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-2')
+# AWS 客户端按需初始化：每个路由只创建它用到的客户端
+AWS_REGION = 'us-east-2'
+SESSION_TABLE_NAME = 'ZhouyiSessions'
+
+@lru_cache(maxsize=None)
+def get_table():
+    import boto3
+    return boto3.resource('dynamodb', region_name=AWS_REGION).Table(SESSION_TABLE_NAME)
+
+@lru_cache(maxsize=None)
+def get_session_store():
+    return build_session_store(lambda: get_table())
+
+@lru_cache(maxsize=None)
+def get_bedrock():
+    return create_client('bedrock-agent-runtime', AWS_REGION)
+
+@lru_cache(maxsize=None)
+def get_bedrock_runtime():
+    return create_client('bedrock-runtime', AWS_REGION)
+
+@lru_cache(maxsize=None)
+def get_model_gateway():
+    return ModelGateway(lambda: get_bedrock_runtime(), lambda: get_bedrock())
+
+@lru_cache(maxsize=None)
+def get_llm_cache():
+    return LLMResponseCache(shared=build_shared_tier())
 
 # Knowledge Base ID
 KNOWLEDGE_BASE_ID = "EJOOLEA0PL"
 
+# 检索方式："local" 使用本地 BM25 索引 + invoke_model，"managed" 使用 Bedrock 知识库 retrieve_and_generate
+# (local falls back to managed when the packaged knowledge base cannot be loaded)
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "local")
+
+# 按命盘缓存的运势（同一命盘、类别、语言共享若干个候选回答）
+fortune_cache = FortuneCache()
+
 # 必要问题列表
 NECESSARY_QUESTIONS = ["birth_datetime", "location", "category"]
+CATEGORIES = ("love", "career", "health")
+
+# 正则未命中时的 LLM 补全方式："combined" 一次调用补全所有缺失字段，"sequential" 每个字段单独调用
+EXTRACTION_FALLBACK_MODE = os.environ.get("EXTRACTION_FALLBACK_MODE", "combined")
+FALLBACK_FIELD_DESCRIPTIONS = {
+    "birth_datetime": 'birth date and time as "YYYY-MM-DD HH:MM" (use 00:00 if no time is given), or null',
+    "location": "birth city or region, or null",
+    "category": 'one of "love", "career", "health", or null',
+    "is_fortune_telling": "true if the query asks for fortune-telling (future, destiny, career, love, health), false if it is unrelated (e.g. the current date or general knowledge)"
+}
+
+# 正则未命中意图/类别时："local" 先用本地分类器，置信度不足再交给 LLM；"llm" 直接交给 LLM
+INTENT_CLASSIFIER_MODE = os.environ.get("INTENT_CLASSIFIER_MODE", "local")
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
+# 缺失信息提示："template" 使用本地双语模板，"llm" 交给 Sonnet 改写
+MISSING_INFO_MODE = os.environ.get("MISSING_INFO_MODE", "template")
 
-def detect_language(text):
-    if any('\u4e00' <= char <= '\u9fff' for char in text):
-        return 'zh'
-    return 'en'
+# 模型调用被限流或熔断时的回复
+BUSY_RESPONSES = {
+    "en": "The oracle is consulting the heavens and cannot answer just now. Please ask again in a moment.",
+    "zh": "贫道正在观天象，暂时无法作答，请稍后再问。"
+}
 
+# 设置日志（格式、级别与抽样见 structured_logging.py）
+configure_logging()
+handler_logger = logging.getLogger("oracle.handler")
+extraction_logger = logging.getLogger("oracle.extraction")
+llm_logger = logging.getLogger("oracle.llm")
+
+@metrics.timed("extract_datetime")
 def extract_datetime(text):
-    date_time_pattern = r'\b(\d{4})-(\d{1,2})-(\d{1,2})(?:\s+(\d{1,2}):(\d{2}))?\b'
-    date_pattern_zh = r'\b(\d{4})年(\d{1,2})月(\d{1,2})日?\b'
-    date_pattern_zh_alt = r'\b(\d{4})年(\d{1,2})月(\d{1,2})号\b'
-    date_pattern_en = r'\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},\s+\d{4}\b'
-    date_pattern_en_alt = r'\b(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2}(?:st|nd|rd|th)?\s*,\s+\d{4}\b'
-    date_pattern_en_alt2 = r'\b\d{1,2}(?:st|nd|rd|th)?\s+(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{4}\b'
-    time_pattern = r'(?:at\s+(\d{1,2})(?::(\d{2}))?\s*(?:AM|PM|am|pm)|(?:上午|下午)(\d{1,2})(?::(\d{2}))?点?)'
-
-    match = re.search(date_time_pattern, text)
-    if match:
-        date_str = f"{match.group(1)}-{int(match.group(2)):02d}-{int(match.group(3)):02d}"
-        if match.group(4) and match.group(5):
-            time_str = f"{int(match.group(4)):02d}:{int(match.group(5)):02d}"
-            logging.info(f"Extracted datetime (pattern 1): {date_str} {time_str}")
-            return f"{date_str} {time_str}"
-        logging.info(f"Extracted datetime (pattern 1, no time): {date_str} 00:00")
-        return f"{date_str} 00:00"
-
-    match = re.search(date_pattern_zh, text)
-    if not match:
-        match = re.search(date_pattern_zh_alt, text)
-    if match:
-        date_str = f"{match.group(1)}-{int(match.group(2)):02d}-{int(match.group(3)):02d}"
-        time_match = re.search(time_pattern, text)
-        if time_match:
-            if time_match.group(1):
-                hour = int(time_match.group(1))
-                minute = int(time_match.group(2) or 0)
-                if 'PM' in time_match.group(0) or 'pm' in time_match.group(0):
-                    hour = (hour % 12) + 12 if hour != 12 else 12
-                elif 'AM' in time_match.group(0) or 'am' in time_match.group(0):
-                    hour = hour % 12
-                time_str = f"{hour:02d}:{minute:02d}"
-                logging.info(f"Extracted datetime (zh pattern): {date_str} {time_str}")
-                return f"{date_str} {time_str}"
-            elif time_match.group(3):
-                hour = int(time_match.group(3))
-                minute = int(time_match.group(4) or 0)
-                if '下午' in time_match.group(0):
-                    hour = (hour % 12) + 12 if hour != 12 else 12
-                time_str = f"{hour:02d}:{minute:02d}"
-                logging.info(f"Extracted datetime (zh pattern): {date_str} {time_str}")
-                return f"{date_str} {time_str}"
-        logging.info(f"Extracted datetime (zh pattern, no time): {date_str} 00:00")
-        return f"{date_str} 00:00"
-
-    match = re.search(date_pattern_en, text)
-    if not match:
-        match = re.search(date_pattern_en_alt, text)
-    if not match:
-        match = re.search(date_pattern_en_alt2, text)
-    if match:
-        try:
-            date_str = match.group(0).strip()
-            date_str = re.sub(r'\s+', ' ', date_str)
-            if 'st' in date_str or 'nd' in date_str or 'rd' in date_str or 'th' in date_str:
-                date_str = re.sub(r'(st|nd|rd|th)', '', date_str).strip()
-            if match.re == date_pattern_en_alt:
-                date_obj = datetime.strptime(date_str, "%B %d, %Y")
-            else:
-                date_obj = datetime.strptime(date_str, "%d %B %Y")
-            formatted_date = date_obj.strftime("%Y-%m-%d")
-            time_match = re.search(time_pattern, text)
-            if time_match:
-                if time_match.group(1):
-                    hour = int(time_match.group(1))
-                    minute = int(time_match.group(2) or 0)
-                    if 'PM' in time_match.group(0) or 'pm' in time_match.group(0):
-                        hour = (hour % 12) + 12 if hour != 12 else 12
-                    elif 'AM' in time_match.group(0) or 'am' in time_match.group(0):
-                        hour = hour % 12
-                    time_str = f"{hour:02d}:{minute:02d}"
-                    logging.info(f"Extracted datetime (en pattern): {formatted_date} {time_str}")
-                    return f"{formatted_date} {time_str}"
-                elif time_match.group(3):
-                    hour = int(time_match.group(3))
-                    minute = int(time_match.group(4) or 0)
-                    if '下午' in time_match.group(0):
-                        hour = (hour % 12) + 12 if hour != 12 else 12
-                    time_str = f"{hour:02d}:{minute:02d}"
-                    logging.info(f"Extracted datetime (en pattern): {formatted_date} {time_str}")
-                    return f"{formatted_date} {time_str}"
-            logging.info(f"Extracted datetime (en pattern, no time): {formatted_date} 00:00")
-            return f"{formatted_date} 00:00"
-        except ValueError as e:
-            logging.error(f"Failed to parse date: {date_str}, error: {str(e)}")
+    birth_datetime = extract_query(text).birth_datetime
+    if birth_datetime:
+        return birth_datetime
 
     prompt = f"""
     Extract the date and time from the following text and format it as YYYY-MM-DD HH:MM.
@@ -124,116 +101,58 @@ def extract_datetime(text):
     """
     messages = [{"role": "user", "content": prompt}]
     try:
-        response = bedrock_runtime.invoke_model(
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "messages": messages,
-                "max_tokens": 50,
-                "temperature": 0.5,
-                "top_p": 0.9
-            }),
-            modelId="us.anthropic.claude-3-haiku-20240307-v1:0",
-            accept="application/json",
-            contentType="application/json"
-        )
+        response = invoke_bedrock_with_retry(messages, model_id=HAIKU_MODEL_ID, max_tokens=50, temperature=0.5,
+                                             prompt_type="extraction")
         response_body = json.loads(response.get("body").read())
         extracted_datetime = response_body.get("content", [{}])[0].get("text", "")
         if extracted_datetime.lower() == "none":
-            logging.info("LLM extracted datetime: None")
+            log_event(extraction_logger, logging.INFO, "LLM extracted datetime", birth_datetime=None)
             return None
         try:
             datetime.strptime(extracted_datetime, "%Y-%m-%d %H:%M")
-            logging.info(f"LLM extracted datetime: {extracted_datetime}")
+            log_event(extraction_logger, logging.INFO, "LLM extracted datetime", birth_datetime=extracted_datetime)
             return extracted_datetime
         except ValueError:
-            logging.error(f"Invalid datetime format returned by LLM: {extracted_datetime}")
+            log_event(extraction_logger, logging.ERROR, "Invalid datetime format returned by LLM", birth_datetime=extracted_datetime)
             return None
     except Exception as e:
         logging.error(f"Error extracting datetime with Claude 3 Haiku: {str(e)}")
         return None
 
+@metrics.timed("extract_location")
 def extract_location(text):
-    location_pattern = r'(?:born\s+in|出生于|出生在)\s*([A-Za-z\s,]+(?:Province|City)?)\b'
-    location_pattern_zh = r'(?:出生于|出生在)\s*([\u4e00-\u9fff\s,]+(?:省|市)?)\b'
-    
-    match = re.search(location_pattern, text, re.IGNORECASE)
-    if match:
-        location = match.group(1).strip()
-        logging.info(f"Extracted location (pattern 1): {location}")
-        return location
-    
-    match = re.search(location_pattern_zh, text)
-    if match:
-        location = match.group(1).strip()
-        logging.info(f"Extracted location (zh pattern): {location}")
+    location = extract_query(text).location
+    if location:
         return location
-    
-    if ',' in text:
-        parts = text.split(',')
-        for part in parts:
-            part = part.strip()
-            if part and any(c.isalpha() for c in part):
-                logging.info(f"Extracted location (comma split): {part}")
-                return part
-    
-    city_pattern = r'\b(?:[A-Za-z]+(?:\s+[A-Za-z]+)?)\b'
-    words = text.split()
-    for word in words:
-        if re.match(city_pattern, word) and word not in ['born', 'in', 'at', 'on', 'the']:
-            logging.info(f"Extracted location (city pattern): {word}")
-            return word
-    
+
     prompt = f"""
     Extract the location (city or region) from the following text. If no specific location is mentioned, return None.
     Text: "{text}"
     """
     messages = [{"role": "user", "content": prompt}]
     try:
-        response = invoke_bedrock_with_retry(messages)
+        response = invoke_bedrock_with_retry(messages, prompt_type="extraction")
         response_body = json.loads(response.get("body").read())
         location = response_body.get("content", [{}])[0].get("text", "")
         if location and location.lower() != "none":
-            logging.info(f"LLM extracted location: {location}")
+            log_event(extraction_logger, logging.INFO, "LLM extracted location", location=location)
             return location
         else:
-            logging.info("LLM extracted location: None")
+            log_event(extraction_logger, logging.INFO, "LLM extracted location", location=None)
             return None
     except Exception as e:
         logging.error(f"Error extracting location with Bedrock: {str(e)}")
         return None
 
+@metrics.timed("extract_category")
 def extract_category(text, lang):
-    love_pattern_en = r'\b(love|relationship|marriage|partner|boyfriend|girlfriend|spouse|romance|dating)\b'
-    career_pattern_en = r'\b(career|job|work|employment|business|promotion|prospects|future\s+job|destiny\s+.*?\s+career|professional)\b'
-    health_pattern_en = r'\b(health|wellbeing|well-being|illness|disease|fitness|wellness)\b'
-    
-    love_pattern_zh = r'\b(爱情|感情|恋爱|婚姻|伴侣|男朋友|女朋友|配偶)\b'
-    career_pattern_zh = r'\b(事业|工作|就业|生意|晋升|前途|职业)\b'
-    health_pattern_zh = r'\b(健康|身体|疾病|养生)\b'
-    
-    text_lower = text.lower() if lang == 'en' else text
-    
-    if lang == 'en':
-        if re.search(love_pattern_en, text_lower, re.IGNORECASE):
-            logging.info("Extracted category: love")
-            return 'love'
-        if re.search(career_pattern_en, text_lower, re.IGNORECASE):
-            logging.info("Extracted category: career")
-            return 'career'
-        if re.search(health_pattern_en, text_lower, re.IGNORECASE):
-            logging.info("Extracted category: health")
-            return 'health'
-    else:
-        if re.search(love_pattern_zh, text):
-            logging.info("Extracted category: love")
-            return 'love'
-        if re.search(career_pattern_zh, text):
-            logging.info("Extracted category: career")
-            return 'career'
-        if re.search(health_pattern_zh, text):
-            logging.info("Extracted category: health")
-            return 'health'
-    
+    category = extract_query(text, lang).category
+    if category:
+        return category
+    category = classifier_category(text)
+    if category is not None:
+        return category or None
+
     prompt = f"""
     Determine the category of the user's query from the following options: love, career, health.
     If the query does not match any category, return None.
@@ -242,37 +161,45 @@ def extract_category(text, lang):
     """
     messages = [{"role": "user", "content": prompt}]
     try:
-        response = invoke_bedrock_with_retry(messages)
+        response = invoke_bedrock_with_retry(messages, prompt_type="classification")
         response_body = json.loads(response.get("body").read())
         category = response_body.get("content", [{}])[0].get("text", "")
         if category and category.lower() != "none":
-            logging.info(f"LLM extracted category: {category}")
+            log_event(extraction_logger, logging.INFO, "LLM extracted category", category=category)
             return category
         else:
-            logging.info("LLM extracted category: None")
+            log_event(extraction_logger, logging.INFO, "LLM extracted category", category=None)
             return None
     except Exception as e:
         logging.error(f"Error extracting category with Bedrock: {str(e)}")
         return None
 
+def classifier_intent(query):
+    """True/False when the local classifier is confident the query is (not) fortune-telling; None escalates to the LLM."""
+    if INTENT_CLASSIFIER_MODE != "local":
+        return None
+    prediction = classify(query)
+    if prediction.intent_confidence < CLASSIFIER_CONFIDENCE_THRESHOLD:
+        return None
+    return prediction.intent == "fortune"
+
+def classifier_category(query):
+    """A category, False when the local classifier is confident there is none, or None to escalate to the LLM."""
+    if INTENT_CLASSIFIER_MODE != "local":
+        return None
+    prediction = classify(query)
+    if prediction.category_confidence < CLASSIFIER_CONFIDENCE_THRESHOLD:
+        return None
+    return prediction.category if prediction.category in CATEGORIES else False
+
+@metrics.timed("extract_intent")
 def is_non_fortune_telling_query(query, lang):
-    fortune_keywords_en = [
-        r'\b(birth|born|date of birth|birthday|fortune|future|destiny|career|love|health|luck|prediction|fate)\b',
-        r'\b(when|what will|should i|tell me about my)\b'
-    ]
-    fortune_keywords_zh = [
-        r'\b(出生|生辰|生日|命运|未来|事业|爱情|健康|运势|预测|算命)\b',
-        r'\b(何时|何日|我该|告诉我)\b'
-    ]
-    
-    patterns = fortune_keywords_en if lang == 'en' else fortune_keywords_zh
-    text_lower = query.lower() if lang == 'en' else query
-    
-    for pattern in patterns:
-        if re.search(pattern, text_lower):
-            logging.info("Query identified as fortune-telling")
-            return False
-    
+    if extract_query(query, lang).intent == 'fortune':
+        return False
+    is_fortune_telling = classifier_intent(query)
+    if is_fortune_telling is not None:
+        return not is_fortune_telling
+
     prompt = f"""
     Determine if the following query is requesting fortune-telling.
     If the query is about fortune-telling (e.g., asking about future, destiny, career, love, health), return "False".
@@ -282,73 +209,297 @@ def is_non_fortune_telling_query(query, lang):
     """
     messages = [{"role": "user", "content": prompt}]
     try:
-        response = invoke_bedrock_with_retry(messages)
+        response = invoke_bedrock_with_retry(messages, prompt_type="classification")
         response_body = json.loads(response.get("body").read())
         result = response_body.get("content", [{}])[0].get("text", "True")
-        logging.info(f"LLM identified query as non-fortune-telling: {result.lower() == 'true'}")
+        log_event(extraction_logger, logging.INFO, "LLM classified intent", non_fortune_telling=result.lower() == 'true')
         return result.lower() == "true"
     except Exception as e:
         logging.error(f"Error determining query type with Bedrock: {str(e)}")
         return True
 
-def invoke_bedrock_with_knowledge_base(query, knowledge_base_id, lang, category=None, birth_datetime=None, location=None):
+def validate_fallback_fields(fields, data):
+    """Keep only well-formed values for the requested fields; anything else becomes None."""
+    validated = {}
+    for field in fields:
+        value = data.get(field)
+        if field == "birth_datetime" and isinstance(value, str):
+            try:
+                datetime.strptime(value, "%Y-%m-%d %H:%M")
+            except ValueError:
+                log_event(extraction_logger, logging.ERROR, "Invalid datetime format returned by LLM", birth_datetime=value)
+                value = None
+        elif field == "location" and isinstance(value, str):
+            value = value.strip() if value.strip() and value.strip().lower() != "none" else None
+        elif field == "category" and isinstance(value, str):
+            value = value.strip().lower() if value.strip().lower() in CATEGORIES else None
+        elif field == "is_fortune_telling" and isinstance(value, bool):
+            pass
+        else:
+            value = None
+        validated[field] = value
+    return validated
+
+@metrics.timed("extract_fallback")
+def extract_missing_fields(query, lang, fields):
+    """
+    Fill all regex misses for a turn with a single structured LLM call, falling back to one
+    call per field when it fails (but not when it was shed for lack of model capacity).
+
+    Args:
+        query (str): The user's query.
+        lang (str): 'en' or 'zh'.
+        fields (list): Keys of FALLBACK_FIELD_DESCRIPTIONS to extract.
+
+    Returns:
+        dict: Validated value (or None) for every requested field.
+    """
+    if not fields:
+        return {}
+    schema = "\n".join(f'    "{field}": {FALLBACK_FIELD_DESCRIPTIONS[field]}' for field in fields)
+    prompt = f"""
+    Extract the following fields from the user's query for a fortune-telling chatbot.
+    Respond with only a JSON object with exactly these keys:
+{schema}
+    Query: "{query}"
+    Language: {"English" if lang == 'en' else "Chinese"}
+    """
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        response = invoke_bedrock_with_retry(messages, model_id=HAIKU_MODEL_ID, max_tokens=150, temperature=0,
+                                             prompt_type="extraction")
+        response_body = json.loads(response.get("body").read())
+        text = response_body.get("content", [{}])[0].get("text", "")
+        data = json.loads(text[text.index("{"):text.rindex("}") + 1])
+        if not isinstance(data, dict):
+            raise ValueError(f"Expected a JSON object, got: {text}")
+        extracted = validate_fallback_fields(fields, data)
+        log_event(extraction_logger, logging.INFO, "LLM extracted missing fields", fields=extracted)
+        return extracted
+    except ModelCallShed as e:
+        # No model capacity for this turn; per-field calls would be shed as well
+        logging.error(f"Error extracting missing fields with Bedrock: {str(e)}")
+        return {field: None for field in fields}
+    except Exception as e:
+        logging.error(f"Error extracting missing fields with Bedrock: {str(e)}. Falling back to per-field calls.")
+        return extract_fields_separately(query, lang, fields)
+
+def extract_fields_separately(query, lang, fields):
+    """The per-field extractors (one model call each) for fields; used when the combined call fails."""
+    extractors = {
+        "birth_datetime": lambda: extract_datetime(query),
+        "location": lambda: extract_location(query),
+        "category": lambda: extract_category(query, lang),
+        "is_fortune_telling": lambda: not is_non_fortune_telling_query(query, lang)
+    }
+    return {field: extractors[field]() for field in fields}
+
+@metrics.timed("extract")
+def extract_turn(query, lang, session):
+    """
+    Extract birth datetime, location, category and intent for one turn.
+
+    Regex results come first, then confident local classifier predictions for intent and
+    category; only fields both missed (and the session does not already hold) go to the LLM, in one combined call or per field depending on EXTRACTION_FALLBACK_MODE.
+
+    Returns:
+        tuple: (birth_datetime, location, category, is_non_fortune_telling)
+    """
+    if EXTRACTION_FALLBACK_MODE != "combined":
+        return (extract_datetime(query), extract_location(query), extract_category(query, lang),
+                is_non_fortune_telling_query(query, lang))
+
+    values = local_turn_values(query, lang)
+    for field, value in extract_missing_fields(query, lang, missing_turn_fields(values, session)).items():
+        values[field] = value
+    return turn_result(values)
+
+@metrics.timed("extract_local")
+def local_turn_values(query, lang):
+    """
+    The extract_turn fields as far as the regexes and the local classifier get: None where both
+    miss, and category False when the classifier is confident the query names none.
+    """
+    extracted = extract_query(query, lang)
+    return {
+        "birth_datetime": extracted.birth_datetime,
+        "location": extracted.location,
+        "category": extracted.category or classifier_category(query),
+        "is_fortune_telling": True if extracted.intent == 'fortune' else classifier_intent(query)
+    }
+
+def missing_turn_fields(values, session):
+    """Fields neither the regexes nor the classifier settled that the session does not already hold."""
+    known = session.get('necessary_answers', {})
+    return [field for field, value in values.items() if value is None and field not in known]
+
+def turn_result(values):
+    return values["birth_datetime"], values["location"], values["category"] or None, values["is_fortune_telling"] is not True
+
+def generate_with_local_retrieval(search_query, lang, stream=False):
+    """Answer from the local BM25 index plus a plain invoke_model call (no managed retrieval hop)."""
+    with metrics.span("retrieve"):
+        passages = retrieve(search_query)
+    context = "\n".join(f"- {passage['content']}" for passage in passages)
+    prompt = f"""
+    Use the following knowledge base passages to answer.
+    {context}
+
+    {search_query}
+    Language: {"English" if lang == 'en' else "Chinese"}
+    """
+    messages = [{"role": "user", "content": prompt}]
+    if stream:
+        return invoke_bedrock_stream(messages, max_tokens=1000)
+    response = invoke_bedrock_with_retry(messages, max_tokens=1000)
+    response_body = json.loads(response.get("body").read())
+    return response_body.get("content", [{}])[0].get("text", "")
+
+def invoke_bedrock_with_knowledge_base(query, knowledge_base_id, lang, category=None, birth_datetime=None, location=None,
+                                       stream=False):
     try:
         search_query = query
         if birth_datetime and location and category:
             search_query = f"This is a hypothetical scenario for fortune-telling. Provide a fortune-telling response for a fictional person born on {birth_datetime} in {location}, focusing on {category}."
-        logging.info(f"Invoking Bedrock with search query: {search_query}")
-        response = bedrock.retrieve_and_generate(
-            input={
+        log_event(llm_logger, logging.INFO, "Invoking Bedrock with knowledge base", verbose=True, search_query=search_query)
+        if RETRIEVAL_MODE == "local" and get_index() is not None:
+            return generate_with_local_retrieval(search_query, lang, stream)
+        request = {
+            "input": {
                 "text": search_query
             },
-            retrieveAndGenerateConfiguration={
+            "retrieveAndGenerateConfiguration": {
                 "type": "KNOWLEDGE_BASE",
                 "knowledgeBaseConfiguration": {
                     "knowledgeBaseId": knowledge_base_id,
-                    "modelArn": "arn:aws:bedrock:us-east-2::inference-profile/us.anthropic.claude-3-5-sonnet-20240620-v1:0"
+                    "modelArn": model_arn(SONNET_MODEL_ID, AWS_REGION)
                 }
             }
-        )
+        }
+        with metrics.span("bedrock", ModelId=SONNET_MODEL_ID, PromptType="knowledge_base",
+                          Operation="retrieve_and_generate", Retries=0):
+            response = call_with_retry(lambda: get_model_gateway().retrieve_and_generate(request, stream=stream))
+        if stream:
+            return (event['output']['text'] for event in response['stream'] if 'output' in event)
         return response['output']['text']
     except Exception as e:
         logging.error(f"Error invoking Bedrock with Knowledge Base: {str(e)}")
         raise
 
-def invoke_bedrock_with_retry(messages, max_retries=10, base_delay=2, max_delay=120):
-    for attempt in range(max_retries + 1):
-        try:
-            response = bedrock_runtime.invoke_model(
-                body=json.dumps({
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "messages": messages,
-                    "max_tokens": 300,
-                    "temperature": 0.7,
-                    "top_p": 0.9
-                }),
-                modelId="us.anthropic.claude-3-5-sonnet-20240620-v1:0",
-                accept="application/json",
-                contentType="application/json"
+def chart_fortune_query(chart, category, lang):
+    pillars = ", ".join(f"{key.split('_')[0].capitalize()} {name}" for key, name in chart.names().items())
+    return (f"This is a hypothetical scenario for fortune-telling. Provide a fortune-telling response for a fictional person "
+            f"whose Four Pillars (BaZi) are {pillars}, focusing on {category}. "
+            f"Respond in {'English' if lang == 'en' else 'Chinese'}.")
+
+def generate_fortune(birth_datetime, birth_location, category, lang, chart=None, stream=False):
+    """
+    Fortune text for a birth chart, served from fortune_cache when the chart is known.
+
+    Cached fortunes are generated from the Four Pillars alone (no birth date or place in the
+    prompt), so every user with the same chart, category and language can share them. Pass
+    the bazi_core.Chart when the caller has already computed it; otherwise it is computed here.
+    With stream=True, returns a generator of text chunks instead of a string.
+    """
+    if FORTUNE_CACHE_ENABLED:
+        if chart is None:
+            try:
+                import bazi_core
+                with metrics.span("bazi"):
+                    chart, _, _ = bazi_core.compute_chart(datetime.strptime(birth_datetime, "%Y-%m-%d %H:%M"), birth_location)
+            except Exception as e:
+                logging.error(f"Error computing chart for fortune cache: {str(e)}")
+        if chart is not None:
+            chart_query = chart_fortune_query(chart, category, lang)
+            if stream:
+                return fortune_cache.get_or_generate_stream(
+                    chart, category, lang,
+                    lambda: invoke_bedrock_with_knowledge_base(chart_query, KNOWLEDGE_BASE_ID, lang, stream=True)
+                )
+            return fortune_cache.get_or_generate(
+                chart, category, lang,
+                lambda: invoke_bedrock_with_knowledge_base(chart_query, KNOWLEDGE_BASE_ID, lang)
             )
-            return response
-        except botocore.exceptions.ClientError as e:
-            error_code = e.response['Error']['Code']
-            logging.error(f"Bedrock invocation failed on attempt {attempt + 1}/{max_retries + 1}: {error_code}")
-            if error_code == 'ThrottlingException' and attempt < max_retries:
-                delay = min(base_delay * (2 ** attempt) + random.uniform(0, 1), max_delay)
-                logging.warning(f"ThrottlingException on attempt {attempt + 1}/{max_retries + 1}. Retrying in {delay:.2f} seconds...")
-                time.sleep(delay)
-            else:
-                raise e
-        except Exception as e:
-            logging.error(f"Unexpected error during Bedrock invocation: {str(e)}")
-            if attempt < max_retries:
-                delay = min(base_delay * (2 ** attempt) + random.uniform(0, 1), max_delay)
-                logging.warning(f"Unexpected error on attempt {attempt + 1}/{max_retries + 1}. Retrying in {delay:.2f} seconds...")
-                time.sleep(delay)
-            else:
-                raise Exception(f"Max retries ({max_retries}) reached for Bedrock invocation: {str(e)}")
+    fortune_query = f"Provide a fortune-telling response for a person born on {birth_datetime} in {birth_location}, focusing on {category}."
+    return invoke_bedrock_with_knowledge_base(fortune_query, KNOWLEDGE_BASE_ID, lang, category, birth_datetime, birth_location,
+                                              stream=stream)
+
+def call_with_retry(operation, max_retries=10, base_delay=2, max_delay=120):
+    """Call operation() through the shared deadline, rate limit and circuit breaker (see resilience.py)."""
+    return call_with_budget(operation, max_retries, base_delay, max_delay)
+
+def fallback_response(text, lang, prompt_type=None):
+    """Answer without the model: missing-info prompts are already user-facing, anything else gets a busy notice."""
+    if prompt_type == "missing_info":
+        return " ".join(text.split())
+    return BUSY_RESPONSES[lang]
+
+def llm_cache_lookup(model_id, messages, max_tokens, temperature, prompt_type):
+    """Return (key, ttl, cached_body); key and ttl are None when the call bypasses the cache."""
+    # 相同提示词直接返回缓存的响应（仅限 PROMPT_TYPE_TTLS 中的提示类型）
+    if prompt_type is None:
+        return None, None, None
+    ttl = get_llm_cache().ttl_for(prompt_type, temperature)
+    if ttl is None:
+        get_llm_cache().record_bypass()
+        return None, None, None
+    key = cache_key(model_id, messages, {"max_tokens": max_tokens, "temperature": temperature, "top_p": 0.9})
+    cached_body = get_llm_cache().get(key, ttl)
+    if cached_body is not None:
+        log_event(llm_logger, logging.INFO, "LLM cache hit", prompt_type=prompt_type)
+    return key, ttl, cached_body
+
+def invoke_bedrock_with_retry(messages, max_retries=10, base_delay=2, max_delay=120,
+                              model_id=SONNET_MODEL_ID, max_tokens=300, temperature=0.7, prompt_type=None):
+    key, ttl, cached_body = llm_cache_lookup(model_id, messages, max_tokens, temperature, prompt_type)
+    if cached_body is not None:
+        return {"body": io.BytesIO(cached_body)}
+    with metrics.span("bedrock", ModelId=model_id, PromptType=prompt_type or "default", Operation="invoke",
+                      Retries=0) as span:
+        response = call_with_retry(lambda: get_model_gateway().invoke(model_id, messages, max_tokens, temperature),
+                                   max_retries, base_delay, max_delay)
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        span.set(InputTokens=int(headers.get("x-amzn-bedrock-input-token-count", 0)),
+                 OutputTokens=int(headers.get("x-amzn-bedrock-output-token-count", 0)))
+    if ttl:
+        body = response["body"].read()
+        get_llm_cache().set(key, body, ttl)
+        response = dict(response, body=io.BytesIO(body))
+    return response
 
-def conversational_response(query, session, lang, next_question=None):
+def invoke_bedrock_stream(messages, max_retries=10, base_delay=2, max_delay=120,
+                          model_id=SONNET_MODEL_ID, max_tokens=300, temperature=0.7, prompt_type=None):
+    """
+    Yield response text chunks from invoke_model_with_response_stream.
+
+    Only opening the stream is retried. Cached responses are yielded in one chunk, and a
+    completed stream is stored in the LLM cache in the same shape invoke_model returns.
+    """
+    key, ttl, cached_body = llm_cache_lookup(model_id, messages, max_tokens, temperature, prompt_type)
+    if cached_body is not None:
+        yield json.loads(cached_body).get("content", [{}])[0].get("text", "")
+        return
+    # The span times opening the stream; token counts arrive with the final chunk
+    with metrics.span("bedrock", ModelId=model_id, PromptType=prompt_type or "default", Operation="stream",
+                      Retries=0) as span:
+        response = call_with_retry(lambda: get_model_gateway().invoke_stream(model_id, messages, max_tokens, temperature),
+                                   max_retries, base_delay, max_delay)
+    parts = []
+    for event in response["body"]:
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk.get("type") == "content_block_delta":
+            text = chunk["delta"].get("text", "")
+            parts.append(text)
+            yield text
+        elif "amazon-bedrock-invocationMetrics" in chunk:
+            usage = chunk["amazon-bedrock-invocationMetrics"]
+            span.set(InputTokens=usage.get("inputTokenCount", 0), OutputTokens=usage.get("outputTokenCount", 0))
+    if ttl:
+        get_llm_cache().set(key, json.dumps({"content": [{"type": "text", "text": "".join(parts)}]}).encode("utf-8"), ttl)
+
+def conversational_response(query, session, lang, next_question=None, prompt_type=None, stream=False):
+    if stream:
+        return conversational_response_stream(query, session, lang, next_question, prompt_type)
     if not query and not next_question:
         return "Please provide a query or specify the next question."
 
@@ -360,75 +511,85 @@ def conversational_response(query, session, lang, next_question=None):
     """
     messages = [{"role": "user", "content": prompt}]
     try:
-        response = invoke_bedrock_with_retry(messages)
+        response = invoke_bedrock_with_retry(messages, prompt_type=prompt_type)
         response_body = json.loads(response.get("body").read())
         bot_response = response_body.get("content", [{}])[0].get("text", "")
-        logging.info(f"Conversational response: {bot_response}")
+        log_event(llm_logger, logging.INFO, "Conversational response", verbose=True, response=bot_response)
         return bot_response
+    except ModelCallShed as e:
+        logging.warning(f"Model call shed ({str(e)}); answering without the model")
+        return fallback_response(query or next_question, lang, prompt_type)
     except Exception as e:
         logging.error(f"Error in conversational_response: {str(e)}")
         return f"Error generating response: {str(e)}"
 
+def conversational_response_stream(query, session, lang, next_question=None, prompt_type=None):
+    """Streaming conversational_response: yields text chunks as the model produces them."""
+    if not query and not next_question:
+        yield "Please provide a query or specify the next question."
+        return
+
+    prompt = f"""
+    This is a hypothetical scenario for a fortune-telling chatbot. Respond as if you are an oracle providing guidance based on the user's input.
+    If specific details are missing, ask the user to provide them. Otherwise, provide a fortune-telling response.
+    Query: "{query or next_question}"
+    Language: {"English" if lang == 'en' else "Chinese"}
+    """
+    messages = [{"role": "user", "content": prompt}]
+    try:
+        yield from invoke_bedrock_stream(messages, prompt_type=prompt_type)
+    except ModelCallShed as e:
+        logging.warning(f"Model call shed ({str(e)}); answering without the model")
+        yield fallback_response(query or next_question, lang, prompt_type)
+    except Exception as e:
+        logging.error(f"Error in conversational_response_stream: {str(e)}")
+        yield f"Error generating response: {str(e)}"
+
 def get_session(session_id, event):
-    if not session_id:
-        session_id = str(uuid.uuid4())
-        session = {
-            'sessionId': session_id,
-            'state': 'collecting_necessary',
-            'current_question_index': 0,
-            'necessary_answers': {},
-            'category': None,
-            'optional_answers': {}
-        }
-        table.put_item(
-            Item={
-                'sessionId': session_id,
-                'sessionData': json.dumps(session),
-                'ttl': int(time.time()) + 3600
-            }
-        )
-    else:
-        response = table.get_item(Key={'sessionId': session_id})
-        if 'Item' in response:
-            session = json.loads(response['Item']['sessionData'])
-        else:
-            session_id = str(uuid.uuid4())
-            session = {
-                'sessionId': session_id,
-                'state': 'collecting_necessary',
-                'current_question_index': 0,
-                'necessary_answers': {},
-                'category': None,
-                'optional_answers': {}
-            }
-            table.put_item(
-                Item={
-                    'sessionId': session_id,
-                    'sessionData': json.dumps(session),
-                    'ttl': int(time.time()) + 3600
-                }
-            )
-    return session, session_id
+    """Load (or create) the session for this request; it is written back once, by flush_session()."""
+    unit_of_work = SessionUnitOfWork(get_session_store(), session_id)
+    current_unit_of_work.set(unit_of_work)
+    return unit_of_work.session, unit_of_work.session_id
 
 def update_session(session):
-    table.put_item(
-        Item={
-            'sessionId': session['sessionId'],
-            'sessionData': json.dumps(session),
-            'ttl': int(time.time()) + 3600
-        }
-    )
+    unit_of_work = current_unit_of_work.get()
+    if unit_of_work is not None and unit_of_work.session_id == session['sessionId']:
+        unit_of_work.stage(session)
+        return
+    unit_of_work = SessionUnitOfWork(get_session_store(), session['sessionId'])
+    unit_of_work.session_id = session['sessionId']
+    unit_of_work.stage(session)
+    unit_of_work.flush()
+
+def flush_session():
+    """Persist the request's staged session, at most one conditional write."""
+    unit_of_work = current_unit_of_work.get()
+    if unit_of_work is None:
+        return
+    current_unit_of_work.set(None)
+    unit_of_work.flush()
 
-def calculate_bazi_pillars(birth_date, birth_time, birth_location):
-    # 这里需要调用 bazi_core.py 中的函数
-    # 为了简化，这里返回一个占位符
-    return {"year_pillar": "Geng Wu", "month_pillar": "Ding Mao", "day_pillar": "Xin You", "hour_pillar": "Bing Shen"}
+@metrics.timed("bazi")
+def calculate_bazi_pillars(birth_date, birth_time, birth_location, gender='unknown'):
+    """The Four Pillars and luck pillars from bazi_core, each as "Stem Branch"."""
+    from pillar_batch import chart, pillar_names
+    return pillar_names(*chart(datetime.combine(birth_date, birth_time), birth_location, gender))
 
 def calculate_pillars(event):
+    """
+    /calculate-pillars. A body with "records" (a list of {"birth_datetime", "birth_location",
+    "gender"}) is charted as a batch and answered in columns, with per-record errors; a body
+    with a single birth_datetime and birth_location gets that chart's pillars by name.
+    """
+    birth_datetime = None
     try:
         body = event.get('body', {})
         if isinstance(body, str):
             body = json.loads(body)
+
+        if 'records' in body:
+            return calculate_pillars_batch(body['records'])
+
         birth_datetime = body.get('birth_datetime')
         birth_location = body.get('birth_location')
 
@@ -444,62 +605,259 @@ def calculate_pillars(event):
         birth_time = birth_datetime_obj.time()
         birth_location = birth_location
 
-        pillars = calculate_bazi_pillars(birth_date, birth_time, birth_location)
+        pillars = calculate_bazi_pillars(birth_date, birth_time, birth_location, body.get('gender', 'unknown'))
         return {
             'statusCode': 200,
             'body': json.dumps(pillars),
             'headers': {'Access-Control-Allow-Origin': '*'}
         }
     except Exception as e:
-        logging.error(f"Error in calculate_pillars: {str(e)}")
+        # strptime errors repeat the raw value, so only the redacted field and the error type are logged
+        log_event(handler_logger, logging.ERROR, "Error in calculate_pillars", birth_datetime=birth_datetime,
+                  error=type(e).__name__)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)}),
             'headers': {'Access-Control-Allow-Origin': '*'}
         }
 
+def calculate_pillars_batch(records):
+    from pillar_batch import chart_records, CALCULATE_PILLARS_MAX_RECORDS
+    if not isinstance(records, list) or len(records) > CALCULATE_PILLARS_MAX_RECORDS:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': f"records must be a list of at most {CALCULATE_PILLARS_MAX_RECORDS} birth records"}),
+            'headers': {'Access-Control-Allow-Origin': '*'}
+        }
+    with metrics.span("bazi") as span:
+        result = chart_records(records)
+        span.set(Records=result['count'], Unique=result['unique'], RecordErrors=len(result['errors']))
+    log_event(handler_logger, logging.INFO, "Calculated pillars", records=result['count'], unique=result['unique'],
+              errors=len(result['errors']))
+    return {
+        'statusCode': 200,
+        # Thousands of rows: drop the default separators' spaces
+        'body': json.dumps(result, separators=(',', ':')),
+        'headers': {'Access-Control-Allow-Origin': '*'}
+    }
+
+def calendar_days(event):
+    """
+    /calendar: the days in a date range whose pillars pass the body's filters (e.g. day branches
+    that combine with, and do not clash with, a chart's day pillar), from the perpetual calendar.
+    """
+    from perpetual_calendar import CalendarQueryError, query_days
+    try:
+        body = event.get('body', {})
+        if isinstance(body, str):
+            body = json.loads(body)
+        with metrics.span("calendar") as span:
+            result = query_days(body)
+            span.set(Days=result['scanned'], Matches=result['count'])
+        log_event(handler_logger, logging.INFO, "Calendar query", days=result['scanned'], matches=result['count'])
+        return {
+            'statusCode': 200,
+            'body': json.dumps(result, separators=(',', ':')),
+            'headers': {'Access-Control-Allow-Origin': '*'}
+        }
+    except (CalendarQueryError, json.JSONDecodeError) as e:
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': str(e)}),
+            'headers': {'Access-Control-Allow-Origin': '*'}
+        }
+    except Exception as e:
+        logging.error(f"Error in calendar_days: {str(e)}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)}),
+            'headers': {'Access-Control-Allow-Origin': '*'}
+        }
+
+def fortune_stream(chunks, session, lang, fields):
+    """
+    Yield a streamed fortune's chunks, then mark the session delivered.
+
+    Model calls only start once the stream is read, so a shed or failed call surfaces here:
+    the turn then ends with the busy template and the session stays in delivering_fortune,
+    as in the buffered path, and the user can simply ask again. `fields` (the stream's header
+    fields) gets the final state for the done line.
+    """
+    unit_of_work = current_unit_of_work.get()
+
+    def chunks_then_deliver():
+        streamed = False
+        try:
+            for text in chunks:
+                streamed = streamed or bool(text)
+                yield text
+        except Exception as e:
+            if isinstance(e, ModelCallShed):
+                logging.warning(f"Fortune generation shed: {str(e)}")
+            else:
+                logging.error(f"Error while streaming fortune: {str(e)}")
+            yield ("\n\n" if streamed else "") + BUSY_RESPONSES[lang]
+            return
+        session['state'] = fields['state'] = 'delivered'
+        # The generator is read after the handler returns, possibly in another context (async_handler)
+        if unit_of_work is not None and unit_of_work.session_id == session['sessionId']:
+            unit_of_work.stage(session)
+        else:
+            update_session(session)
+
+    return chunks_then_deliver()
+
+def stream_response(fields, text_key, chunks, start_time):
+    """
+    Wrap a text generator as a streamed response.
+
+    The 'stream' value yields NDJSON lines: the response fields plus {"stream": text_key} first,
+    then one {"delta": ...} per chunk, then {"done": true} with the state the turn ended in
+    (chunks may update fields['state'] while streaming).
+    """
+    def lines():
+        yield (json.dumps(dict(fields, stream=text_key)) + "\n").encode("utf-8")
+        parts = []
+        try:
+            for text in chunks:
+                parts.append(text)
+                yield (json.dumps({"delta": text}) + "\n").encode("utf-8")
+        except Exception as e:
+            logging.error(f"Error while streaming {text_key}: {str(e)}")
+            yield (json.dumps({"error": str(e)}) + "\n").encode("utf-8")
+        log_event(handler_logger, logging.INFO, "Streamed response", verbose=True, **{text_key: "".join(parts)})
+        log_event(handler_logger, logging.INFO, "Request handled", seconds=round(time.time() - start_time, 3))
+        metrics.set_properties(State=fields.get('state'))
+        yield (json.dumps({"done": True, "state": fields.get('state')}) + "\n").encode("utf-8")
+
+    metrics.set_properties(State=fields.get('state'))
+    return {
+        'statusCode': 200,
+        'stream': lines(),
+        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/x-ndjson'}
+    }
+
+def request_metrics_properties(response):
+    """StatusCode and conversation State for a non-streamed handler response."""
+    if not response:
+        return {}
+    properties = {"StatusCode": response.get('statusCode')}
+    try:
+        state = json.loads(response['body']).get('state')
+    except (KeyError, TypeError, ValueError, AttributeError):
+        state = None
+    if state:
+        properties["State"] = state
+    return properties
+
 def lambda_handler(event, context):
+    deadline = start_request(context)
+    log_token = start_log_context(context)
+    metrics_token = metrics.start_metrics(event.get('path', '').strip() or "/",
+                                          RequestId=getattr(context, 'aws_request_id', None), Streaming=0)
+    response = None
+    try:
+        response = handle_request(event, context)
+        return response
+    finally:
+        flush_session()
+        end_request(deadline)
+        end_log_context(log_token)
+        if metrics_token is not None:
+            metrics.emit_metrics(metrics_token, **request_metrics_properties(response))
+
+def lambda_stream_handler(event, context):
+    """
+    Streaming entry point (Lambda response streaming / function URL): yields NDJSON byte lines.
+
+    Responses that are not streamed (errors, /calculate-pillars, /calendar) are sent as a single line
+    carrying the usual body plus statusCode and done. The session is written once the stream has
+    been read, since a streamed fortune only moves it to delivered after its last chunk.
+
+    The managed Python runtimes do not stream a handler's generator output (response streaming
+    is native to Node.js only); deploy this entry point behind the Lambda Web Adapter or on a
+    custom runtime, as dev_server.py does locally. Elsewhere use the buffered lambda_handler.
+    """
+    deadline = start_request(context)
+    log_token = start_log_context(context)
+    metrics_token = metrics.start_metrics(event.get('path', '').strip() or "/",
+                                          RequestId=getattr(context, 'aws_request_id', None), Streaming=1)
+    response = None
+    try:
+        response = handle_request(event, context, stream=True)
+        yield from ndjson_lines(response)
+    finally:
+        flush_session()
+        end_request(deadline)
+        end_log_context(log_token)
+        metrics.emit_metrics(metrics_token, StatusCode=response.get('statusCode') if response else None)
+
+def ndjson_lines(response):
+    """NDJSON byte lines for a handler response: its stream, or the whole body as one line."""
+    if response is None:
+        return
+    if 'stream' in response:
+        yield from response['stream']
+    else:
+        body = json.loads(response['body'])
+        yield (json.dumps(dict(body, statusCode=response['statusCode'], done=True)) + "\n").encode("utf-8")
+
+def handle_request(event, context, stream=False):
     start_time = time.time()
-    logging.info(f"Full event: {json.dumps(event)}")
+    log_event(handler_logger, logging.INFO, "Request received", verbose=True, path=event.get('path'), event=event)
 
     path = event.get('path', '').strip()
 
     if path == '/calculate-pillars':
         return calculate_pillars(event)
+    if path == '/calendar':
+        return calendar_days(event)
+
+    query, error_response = parse_query(event)
+    if error_response is not None:
+        return error_response
+
+    lang = 'en'
+    if query:
+        lang = detect_language(query)
+
+    session_id = event.get('sessionId')
+    session, session_id = get_session(session_id, event)
 
+    if not query:
+        raise ValueError("No query provided")
+
+    # 提取出生信息
+    extracted = extract_turn(query, lang, session)
+    return advance_conversation(query, lang, session, session_id, extracted, start_time, stream)
+
+@metrics.timed("parse")
+def parse_query(event):
+    """Return (query, None), or (None, 400 response) when the body cannot be parsed."""
     try:
         if 'query' in event:
             query = event['query'].strip()
-            logging.info(f"Direct query from event: {query}")
+            log_event(handler_logger, logging.INFO, "Direct query from event", verbose=True, query=query)
         else:
             body = event.get('body', {})
-            logging.info(f"Raw body: {body}")
             if isinstance(body, str):
                 body = json.loads(body)
-            logging.info(f"Parsed body: {body}")
+            if not isinstance(body, dict):
+                raise TypeError("the request body must be a JSON object")
+            log_event(handler_logger, logging.INFO, "Parsed body", verbose=True, body=body)
             query = body.get('query', '').strip()
     except (ValueError, json.JSONDecodeError, TypeError) as e:
         logging.error(f"Input error: {str(e)}")
-        return {
+        return None, {
             'statusCode': 400,
             'body': json.dumps({'response': f"Error: Invalid input - {str(e)}", 'state': 'delivered'}),
             'headers': {'Access-Control-Allow-Origin': '*'}
         }
+    return query, None
 
-    lang = 'en'
-    if query:
-        lang = detect_language(query)
-
-    session_id = event.get('sessionId')
-    session, session_id = get_session(session_id, event)
-
-    if not query:
-        raise ValueError("No query provided")
-
-    # 提取出生信息
-    birth_datetime = extract_datetime(query)
-    location = extract_location(query)
-    category = extract_category(query, lang)
+def advance_conversation(query, lang, session, session_id, extracted, start_time, stream=False):
+    """Apply one turn's extracted fields to the session state machine and build the response."""
+    birth_datetime, location, category, non_fortune_telling = extracted
 
     # 更新 session 中的必要信息
     if birth_datetime:
@@ -514,11 +872,14 @@ def lambda_handler(event, context):
         session['current_question_index'] = 0
         update_session(session)
 
-    if is_non_fortune_telling_query(query, lang):
-        bot_response = conversational_response(query, session, lang)
+    if non_fortune_telling:
+        bot_response = conversational_response(query, session, lang, stream=stream)
         update_session(session)
-        logging.info(f"Non-fortune-telling query detected. Returning response: {{'response': '{bot_response}', 'state': '{session['state']}', 'sessionId': '{session_id}', 'lang': '{lang}'}}")
-        logging.info(f"lambda_handler took {time.time() - start_time:.2f} seconds")
+        if stream:
+            return stream_response({'state': session['state'], 'sessionId': session_id, 'lang': lang}, 'response', bot_response, start_time)
+        log_event(handler_logger, logging.INFO, "Non-fortune-telling query; returning response", response=bot_response,
+                  state=session['state'], session_id=session_id, lang=lang)
+        log_event(handler_logger, logging.INFO, "Request handled", seconds=round(time.time() - start_time, 3))
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -545,6 +906,7 @@ def lambda_handler(event, context):
             missing_info.append("birth location (e.g., Beijing, China)")
         if NECESSARY_QUESTIONS[2] not in necessary_answers:
             missing_info.append("category (love, career, or health)")
+        missing_fields = [field for field in NECESSARY_QUESTIONS if field not in necessary_answers]
 
         if not missing_info:
             session['state'] = 'delivering_fortune'
@@ -558,21 +920,29 @@ def lambda_handler(event, context):
                     session['current_question_index'] = current_index
                     update_session(session)
                 if current_index < len(NECESSARY_QUESTIONS):
-                    missing_info_str = ", ".join(missing_info)
-                    if lang == 'en':
-                        prompt = f"""
-                        I need the following information to proceed with fortune-telling: {missing_info_str}. Please provide the missing details.
-                        Providing the exact time of birth will lead to a more accurate reading.
-                        """
+                    if MISSING_INFO_MODE == "llm":
+                        missing_info_str = ", ".join(missing_info)
+                        if lang == 'en':
+                            prompt = f"""
+                            I need the following information to proceed with fortune-telling: {missing_info_str}. Please provide the missing details.
+                            Providing the exact time of birth will lead to a more accurate reading.
+                            """
+                        else:
+                            prompt = f"""
+                            贫道需知以下信息以推演您的命运：{missing_info_str}。请提供缺失的细节。
+                            提供确切的出生时间将使预测更加准确。
+                            """
+                        next_question = conversational_response(prompt, session, lang, prompt_type="missing_info", stream=stream)
                     else:
-                        prompt = f"""
-                        贫道需知以下信息以推演您的命运：{missing_info_str}。请提供缺失的细节。
-                        提供确切的出生时间将使预测更加准确。
-                        """
-                    next_question = conversational_response(prompt, session, lang)
+                        next_question = missing_info_response(missing_fields, lang)
+                        if stream:
+                            next_question = iter([next_question])
                     update_session(session)
                     session['current_question_index'] = current_index + 1
-                    logging.info(f"Returning response: {{'nextQuestion': '{next_question}', 'state': 'collecting_necessary', 'sessionId': '{session_id}', 'lang': '{lang}'}}")
+                    if stream:
+                        return stream_response({'state': 'collecting_necessary', 'sessionId': session_id, 'lang': lang}, 'nextQuestion', next_question, start_time)
+                    log_event(handler_logger, logging.INFO, "Returning response", next_question=next_question,
+                              state='collecting_necessary', session_id=session_id, lang=lang)
                     return {
                         'statusCode': 200,
                         'body': json.dumps({
@@ -596,11 +966,10 @@ def lambda_handler(event, context):
 
         try:
             birth_datetime_obj = datetime.strptime(birth_datetime, "%Y-%m-%d %H:%M")
-            birth_date = birth_datetime_obj.date()
-            birth_time = birth_datetime_obj.time()
             birth_location = location
-        except ValueError as e:
-            logging.error(f"Invalid birth datetime format: {birth_datetime}, error: {str(e)}")
+        except ValueError:
+            # The ValueError's message repeats the value, so only the redacted field is logged
+            log_event(handler_logger, logging.ERROR, "Invalid birth datetime format", birth_datetime=birth_datetime)
             return {
                 'statusCode': 400,
                 'body': json.dumps({'response': "Error: Invalid birth date and time format. Please use YYYY-MM-DD HH:MM.", 'state': 'collecting_necessary'}),
@@ -608,7 +977,9 @@ def lambda_handler(event, context):
             }
 
         try:
-            pillars = calculate_bazi_pillars(birth_date, birth_time, birth_location)
+            import bazi_core
+            with metrics.span("bazi"):
+                chart, _, _ = bazi_core.compute_chart(birth_datetime_obj, birth_location)
         except Exception as e:
             logging.error(f"Error calculating BaZi pillars: {str(e)}")
             return {
@@ -617,14 +988,34 @@ def lambda_handler(event, context):
                 'headers': {'Access-Control-Allow-Origin': '*'}
             }
 
-        fortune_query = f"Provide a fortune-telling response for a person born on {birth_datetime} in {birth_location}, focusing on {category}."
-        fortune_response = invoke_bedrock_with_knowledge_base(fortune_query, KNOWLEDGE_BASE_ID, lang, category, birth_datetime, birth_location)
+        try:
+            fortune_response = generate_fortune(birth_datetime, birth_location, category, lang, chart=chart, stream=stream)
+        except ModelCallShed as e:
+            # 模型暂不可用：保持 delivering_fortune 状态，用户重试即可拿到运势
+            logging.warning(f"Fortune generation shed: {str(e)}")
+            update_session(session)
+            return {
+                'statusCode': 503,
+                'body': json.dumps({
+                    'response': BUSY_RESPONSES[lang],
+                    'state': 'delivering_fortune',
+                    'sessionId': session_id,
+                    'lang': lang
+                }),
+                'headers': {'Access-Control-Allow-Origin': '*', 'Retry-After': '5'}
+            }
+
+        if stream:
+            # Stays delivering_fortune until the whole fortune has been streamed (see fortune_stream)
+            fields = {'state': 'delivering_fortune', 'sessionId': session_id, 'lang': lang}
+            return stream_response(fields, 'response', fortune_stream(fortune_response, session, lang, fields), start_time)
 
         session['state'] = 'delivered'
         update_session(session)
 
-        logging.info(f"Returning fortune: {{'response': '{fortune_response}', 'state': 'delivered', 'sessionId': '{session_id}', 'lang': '{lang}'}}")
-        logging.info(f"lambda_handler took {time.time() - start_time:.2f} seconds")
+        log_event(handler_logger, logging.INFO, "Returning fortune", response=fortune_response,
+                  state='delivered', session_id=session_id, lang=lang)
+        log_event(handler_logger, logging.INFO, "Request handled", seconds=round(time.time() - start_time, 3))
         return {
             'statusCode': 200,
             'body': json.dumps({
@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+from functools import wraps
+from contextvars import ContextVar
+
+# 分阶段耗时与结构化指标：每个请求输出 CloudWatch EMF 格式的 JSON 行（"emf"），"memory" 留在进程内，"off" 关闭
+METRICS_SINK = os.environ.get("METRICS_SINK", "emf")
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "OracleMaster")
+# EMF accepts at most 100 values per metric in one document
+MAX_VALUES_PER_METRIC = 100
+
+current_request = ContextVar("current_request_metrics", default=None)
+current_span = ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed stage. String fields become CloudWatch dimensions and numeric fields metrics;
+    a span with dimensions (e.g. a model call's ModelId) is also emitted as its own document.
+    """
+
+    __slots__ = ("request", "name", "dimensions", "values", "start", "duration_ms", "_token")
+
+    def __init__(self, request, name, fields):
+        self.request = request
+        self.name = name
+        self.dimensions = {}
+        self.values = {}
+        self.duration_ms = None
+        self.set(**fields)
+
+    def set(self, **fields):
+        for key, value in fields.items():
+            (self.dimensions if isinstance(value, str) else self.values)[key] = value
+        return self
+
+    def add(self, key, n=1):
+        self.values[key] = self.values.get(key, 0) + n
+
+    def __enter__(self):
+        self._token = current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+        current_span.reset(self._token)
+        if exc_type is not None:
+            self.add("Errors")
+        self.request.spans.append(self)
+        return False
+
+
+class NullSpan:
+    """What span() returns when metrics are off or no request is being measured."""
+
+    __slots__ = ()
+
+    def set(self, **fields):
+        return self
+
+    def add(self, key, n=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class RequestMetrics:
+    def __init__(self, route, properties):
+        self.route = route
+        self.properties = properties
+        self.spans = []
+        self.start = time.perf_counter()
+
+    def documents(self, timestamp_ms=None):
+        """
+        The request's EMF documents: per-stage latencies (and counts such as session_put_Conflicts)
+        by Route, then one document per span with dimensions of its own.
+        """
+        timestamp_ms = timestamp_ms or int(time.time() * 1000)
+        stages = {"request": [(time.perf_counter() - self.start) * 1000]}
+        counts = {}
+        for span in self.spans:
+            stages.setdefault(span.name, []).append(span.duration_ms)
+            if not span.dimensions:
+                for key, value in span.values.items():
+                    counts[f"{span.name}_{key}"] = counts.get(f"{span.name}_{key}", 0) + value
+        request_metrics = {name: ("Milliseconds", durations[:MAX_VALUES_PER_METRIC]) for name, durations in stages.items()}
+        request_metrics.update((name, ("Count", value)) for name, value in counts.items())
+        # The conversation state the turn ended in, when known, gives per-transition percentiles too
+        dimension_sets = [["Route"], ["Route", "State"]] if "State" in self.properties else [["Route"]]
+        request_document = emf_document(timestamp_ms, dimension_sets, request_metrics, dict(self.properties, Route=self.route))
+        documents = [request_document]
+        for span in self.spans:
+            if span.dimensions:
+                metrics = {"Latency": ("Milliseconds", span.duration_ms)}
+                metrics.update((key, ("Count", value)) for key, value in span.values.items())
+                documents.append(emf_document(timestamp_ms, [["Route", "Stage"] + sorted(span.dimensions)], metrics,
+                                              dict(span.dimensions, Route=self.route, Stage=span.name)))
+        return documents
+
+
+def emf_document(timestamp_ms, dimension_sets, metrics, fields):
+    """metrics maps name -> (unit, value or list of values); fields holds the dimension values and properties."""
+    document = {
+        "_aws": {
+            "Timestamp": timestamp_ms,
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": dimension_sets,
+                "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in metrics.items()]
+            }]
+        }
+    }
+    document.update(fields)
+    for name, (_, value) in metrics.items():
+        document[name] = value[0] if isinstance(value, list) and len(value) == 1 else value
+    return document
+
+
+class StdoutSink:
+    """EMF documents as JSON lines on stdout, which Lambda ships to CloudWatch Logs for metric extraction."""
+
+    def write(self, documents):
+        sys.stdout.write("".join(json.dumps(document, separators=(",", ":")) + "\n" for document in documents))
+
+
+class MemorySink:
+    """Keeps documents in process, for benchmarks and local runs."""
+
+    def __init__(self):
+        self.documents = []
+
+    def write(self, documents):
+        self.documents.extend(documents)
+
+    def clear(self):
+        self.documents.clear()
+
+
+def build_sink(kind=METRICS_SINK):
+    if kind == "off":
+        return None
+    if kind == "memory":
+        return MemorySink()
+    return StdoutSink()
+
+
+sink = build_sink()
+
+
+def start_metrics(route, **properties):
+    """Begin measuring a request; returns a token for emit_metrics() (None when metrics are off)."""
+    if sink is None:
+        return None
+    return current_request.set(RequestMetrics(route, {key: value for key, value in properties.items() if value is not None}))
+
+
+def emit_metrics(token, **properties):
+    """Finish the request begun by start_metrics() and write its documents to the sink."""
+    if token is None:
+        return
+    request = current_request.get()
+    if request is None or sink is None:
+        current_request.reset(token)
+        return
+    set_properties(**properties)
+    current_request.reset(token)
+    sink.write(request.documents())
+
+
+def set_properties(**properties):
+    """Attach properties (RequestId, State, ...) to the current request's documents."""
+    request = current_request.get()
+    if request is not None:
+        request.properties.update((key, value) for key, value in properties.items() if value is not None)
+
+
+def span(name, **fields):
+    """A context manager timing one stage of the current request (a shared no-op outside one)."""
+    request = current_request.get()
+    if request is None:
+        return NULL_SPAN
+    return Span(request, name, fields)
+
+
+def active_span():
+    """The innermost open span in this context, or NULL_SPAN."""
+    return current_span.get() or NULL_SPAN
+
+
+def annotate(**fields):
+    """Set dimensions or values on the innermost open span."""
+    active_span().set(**fields)
+
+
+def increment(key, n=1):
+    active_span().add(key, n)
+
+
+def timed(name):
+    """Decorator: run the function inside span(name). Not for generator functions (only creation would be timed)."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if current_request.get() is None:
+                return function(*args, **kwargs)
+            with Span(current_request.get(), name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,278 @@
+import io
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from resilience import ModelCallShed, count, remaining_time
+
+# 模型网关：统一管理 Bedrock 客户端、模型 ID、并发上限、对冲请求与延迟直方图（可通过环境变量覆盖）
+SONNET_MODEL_ID = os.environ.get("SONNET_MODEL_ID", "us.anthropic.claude-3-5-sonnet-20240620-v1:0")
+HAIKU_MODEL_ID = os.environ.get("HAIKU_MODEL_ID", "us.anthropic.claude-3-haiku-20240307-v1:0")
+# Keep-alive pool per client: enough connections for every in-flight call plus hedges
+MODEL_POOL_CONNECTIONS = int(os.environ.get("MODEL_POOL_CONNECTIONS", "50"))
+MODEL_CONNECT_TIMEOUT = float(os.environ.get("MODEL_CONNECT_TIMEOUT", "2"))
+MODEL_READ_TIMEOUT = float(os.environ.get("MODEL_READ_TIMEOUT", "60"))
+# In-flight requests allowed per model (or knowledge base model ARN) in one container
+MODEL_MAX_IN_FLIGHT = int(os.environ.get("MODEL_MAX_IN_FLIGHT", "16"))
+# Calls with at most this many output tokens are latency-sensitive and get hedged
+HEDGE_MAX_TOKENS = int(os.environ.get("HEDGE_MAX_TOKENS", "150"))
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DELAY = 1.0
+HEDGE_MIN_DELAY = 0.02
+HEDGE_WORKERS = int(os.environ.get("HEDGE_WORKERS", "32"))
+# Hedging is opt-in: a JSON object mapping a model ID to a second inference profile (a
+# cross-region profile ID such as "eu.anthropic..." or an inference-profile ARN) that serves the
+# same model in this account and region. Base model IDs are not accepted: on-demand invocation
+# of these models may not be supported in the deployment region, and every hedge would fail
+MODEL_HEDGE_PROFILES = json.loads(os.environ.get("MODEL_HEDGE_PROFILES", "{}") or "{}")
+INFERENCE_PROFILE_PREFIXES = ("us.", "eu.", "apac.", "us-gov.", "global.", "arn:aws:bedrock:")
+
+
+class ConcurrencyLimited(ModelCallShed):
+    pass
+
+
+def inference_profiles(hedge_profiles):
+    """The hedge_profiles entries whose target is an inference profile; others are dropped with a warning."""
+    profiles = {}
+    for model_id, profile in (hedge_profiles or {}).items():
+        if isinstance(profile, str) and profile.startswith(INFERENCE_PROFILE_PREFIXES) and profile != model_id:
+            profiles[model_id] = profile
+        else:
+            logging.warning(f"Ignoring hedge profile {profile!r} for {model_id}: not a second inference profile")
+    return profiles
+
+
+def create_client(service, region_name):
+    """A boto3 client with a sized keep-alive pool; retries are left to resilience.call_with_budget."""
+    import boto3
+    from botocore.config import Config
+    config = Config(
+        max_pool_connections=MODEL_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=MODEL_CONNECT_TIMEOUT,
+        read_timeout=MODEL_READ_TIMEOUT,
+        retries={"max_attempts": 1, "mode": "standard"}
+    )
+    return boto3.client(service, region_name=region_name, config=config)
+
+
+def model_arn(model_id, region_name):
+    return f"arn:aws:bedrock:{region_name}::inference-profile/{model_id}"
+
+
+def request_body(messages, max_tokens, temperature):
+    return json.dumps({
+        "anthropic_version": "bedrock-2023-05-31",
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": 0.9
+    })
+
+
+class LatencyHistogram:
+    """Log-bucketed latency histogram: buckets grow by 2**0.25 (about 19%) from 1 ms to roughly 2.5 minutes."""
+
+    BOUNDS = [0.001 * 2 ** (i / 4) for i in range(70)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (seconds), or None when empty."""
+        with self._lock:
+            if not self.count:
+                return None
+            rank, seen = self.count * p / 100, 0
+            for i, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank and n:
+                    return min(self.BOUNDS[i], self.max) if i < len(self.BOUNDS) else self.max
+            return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else None,
+            "p50_ms": 1000 * (self.percentile(50) or 0),
+            "p95_ms": 1000 * (self.percentile(95) or 0),
+            "p99_ms": 1000 * (self.percentile(99) or 0),
+            "max_ms": 1000 * self.max
+        }
+
+
+class ModelGateway:
+    """
+    Single entry point for Bedrock model calls.
+
+    runtime() and agent_runtime() return the bedrock-runtime and bedrock-agent-runtime clients.
+    Each model ID gets at most max_in_flight concurrent calls; short calls (max_tokens <=
+    hedge_max_tokens) whose model has a hedge profile send a duplicate to that profile once the
+    primary has run longer than the model's p95 latency, and return whichever answers first.
+    The losing call cannot be cancelled once sent: it runs to completion on the hedge pool,
+    holding its in-flight slot and billed as usual, and its result is discarded.
+    """
+
+    def __init__(self, runtime, agent_runtime, max_in_flight=MODEL_MAX_IN_FLIGHT,
+                 hedge_profiles=MODEL_HEDGE_PROFILES, hedge_max_tokens=HEDGE_MAX_TOKENS):
+        self.runtime = runtime
+        self.agent_runtime = agent_runtime
+        self.max_in_flight = max_in_flight
+        self.hedge_profiles = inference_profiles(hedge_profiles)
+        self.hedge_max_tokens = hedge_max_tokens
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._limits = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="model-hedge")
+
+    def histogram(self, operation, model_id):
+        key = (operation, model_id)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram()
+            return self._histograms[key]
+
+    def _acquire(self, model_id, blocking=True):
+        """Take an in-flight slot for model_id (waiting no longer than the request deadline)."""
+        with self._lock:
+            if model_id not in self._limits:
+                self._limits[model_id] = threading.BoundedSemaphore(self.max_in_flight)
+            limit = self._limits[model_id]
+        timeout = max(0.0, min(remaining_time(), MODEL_READ_TIMEOUT))
+        if not (limit.acquire(timeout=timeout) if blocking else limit.acquire(blocking=False)):
+            if blocking:
+                count("shed_concurrency")
+            raise ConcurrencyLimited(f"Too many in-flight requests to {model_id}")
+        return limit
+
+    def hedge_delay(self, model_id):
+        histogram = self.histogram("invoke", model_id)
+        if histogram.count < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, histogram.percentile(HEDGE_PERCENTILE))
+
+    def invoke(self, model_id, messages, max_tokens=300, temperature=0.7, hedge=None):
+        """invoke_model; the returned "body" is already read into memory."""
+        body = request_body(messages, max_tokens, temperature)
+        if hedge is None:
+            hedge = max_tokens <= self.hedge_max_tokens
+        hedge_model_id = self.hedge_profiles.get(model_id) if hedge else None
+        if hedge_model_id is None:
+            return self._invoke_once(model_id, body)
+        return self._invoke_hedged(model_id, hedge_model_id, body)
+
+    def _invoke_once(self, model_id, body, blocking=True):
+        limit = self._acquire(model_id, blocking)
+        try:
+            start = time.perf_counter()
+            response = self.runtime().invoke_model(
+                body=body,
+                modelId=model_id,
+                accept="application/json",
+                contentType="application/json"
+            )
+            payload = response["body"].read()
+            self.histogram("invoke", model_id).record(time.perf_counter() - start)
+        finally:
+            limit.release()
+        return dict(response, body=io.BytesIO(payload))
+
+    def _invoke_hedged(self, model_id, hedge_model_id, body):
+        # Worker threads run in a copy of the caller's context so they see its request deadline
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._invoke_once, model_id, body)
+        done, _ = wait([primary], timeout=max(0.0, min(self.hedge_delay(model_id), remaining_time())))
+        if done:
+            return primary.result()
+        with self._lock:
+            self.hedges += 1
+        count("hedges")
+        # The duplicate only runs if the hedge profile has a free slot right now
+        secondary = self._hedge_pool.submit(contextvars.copy_context().run, self._invoke_once, hedge_model_id, body, False)
+        pending = {primary, secondary}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is secondary:
+                        with self._lock:
+                            self.hedge_wins += 1
+                        logging.info(f"Hedged request to {hedge_model_id} beat {model_id}")
+                    # Only a loser still queued is stopped; one already sent finishes unobserved
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                if future is secondary and not isinstance(future.exception(), ConcurrencyLimited):
+                    count("hedge_errors")
+                    logging.warning(f"Hedged request to {hedge_model_id} failed: {str(future.exception())}")
+        return primary.result()
+
+    def invoke_stream(self, model_id, messages, max_tokens=300, temperature=0.7):
+        """invoke_model_with_response_stream; the in-flight slot is held until the event stream ends."""
+        limit = self._acquire(model_id)
+        start = time.perf_counter()
+        try:
+            response = self.runtime().invoke_model_with_response_stream(
+                body=request_body(messages, max_tokens, temperature),
+                modelId=model_id,
+                accept="application/json",
+                contentType="application/json"
+            )
+        except Exception:
+            limit.release()
+            raise
+        self.histogram("stream_open", model_id).record(time.perf_counter() - start)
+        return dict(response, body=self._release_after(response["body"], limit, "stream", model_id, start))
+
+    def retrieve_and_generate(self, request, stream=False):
+        """Managed knowledge base call; latency and in-flight slots are tracked under the request's model ARN."""
+        model_id = request["retrieveAndGenerateConfiguration"]["knowledgeBaseConfiguration"]["modelArn"]
+        limit = self._acquire(model_id)
+        start = time.perf_counter()
+        try:
+            if stream:
+                response = self.agent_runtime().retrieve_and_generate_stream(**request)
+            else:
+                response = self.agent_runtime().retrieve_and_generate(**request)
+        except Exception:
+            limit.release()
+            raise
+        if stream:
+            return dict(response, stream=self._release_after(response["stream"], limit, "retrieve_and_generate_stream", model_id, start))
+        limit.release()
+        self.histogram("retrieve_and_generate", model_id).record(time.perf_counter() - start)
+        return response
+
+    def _release_after(self, events, limit, operation, model_id, start):
+        try:
+            yield from events
+        finally:
+            limit.release()
+            self.histogram(operation, model_id).record(time.perf_counter() - start)
+
+    def stats(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+        report = {f"{operation} {model_id}": histogram.summary() for (operation, model_id), histogram in sorted(histograms.items())}
+        report["hedges"] = self.hedges
+        report["hedge_wins"] = self.hedge_wins
+        return report
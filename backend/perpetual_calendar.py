@@ -0,0 +1,274 @@
+import os
+import sys
+import mmap
+import random
+import logging
+import datetime
+from array import array
+from functools import lru_cache
+
+import bazi_core
+from gazetteer import resolve_place
+from timezone_cache import intern_zone
+
+# 万年历：每天的年柱、月柱、日柱（六十甲子序号）预先算好，存为内存映射文件，支持按日期范围扫描与冲合筛选
+CALENDAR_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calendar_days.bin")
+CALENDAR_START_YEAR = 1900
+CALENDAR_END_YEAR = 2100
+# A day's pillars are those of a birth at noon here (the month pillar changes mid-day on a jie term day)
+CALENDAR_LOCATION = "Beijing"
+# CALENDAR_LOCATION's zone, used when the gazetteer (an optional artifact) cannot resolve the location
+CALENDAR_TIMEZONE = "Asia/Shanghai"
+CALENDAR_MAX_RESULTS = int(os.environ.get("CALENDAR_MAX_RESULTS", "3660"))
+# File layout: little-endian int64 ordinal of the first date and int64 day count, then one
+# column per pillar (year, month, day) of one byte per day holding its sexagenary index 0-59
+HEADER_BYTES = 16
+COLUMNS = ("year", "month", "day")
+PILLAR_NAMES = ("year", "month", "day", "hour")
+# Branch relations a day can have with a chart's pillar: the partner branch of a given branch
+RELATIONS = {"clash": bazi_core.clashing_branch, "combine": bazi_core.combining_branch}
+
+
+class CalendarQueryError(ValueError):
+    """A /calendar request that cannot be answered as asked (bad dates, range, chart or filter)."""
+
+
+def compute_days(start_year=CALENDAR_START_YEAR, end_year=CALENDAR_END_YEAR, location=CALENDAR_LOCATION):
+    """
+    The pillars of every date from January 1 of start_year to December 31 of end_year, at local
+    noon in location, through get_four_pillars_batch (the same arithmetic as get_four_pillars).
+    A location the gazetteer cannot resolve (or a missing gazetteer) falls back to CALENDAR_TIMEZONE.
+
+    Returns:
+        tuple: (ordinal of the first date, {"year": bytes, "month": bytes, "day": bytes}).
+    """
+    import numpy as np
+    first = datetime.date(start_year, 1, 1).toordinal()
+    last = datetime.date(end_year, 12, 31).toordinal()
+    place = resolve_place(location)
+    if place is not None:
+        timezone = place.timezone
+    else:
+        if location != CALENDAR_LOCATION:
+            logging.warning(f"Cannot resolve calendar location {location}; using {CALENDAR_TIMEZONE}")
+        timezone = CALENDAR_TIMEZONE
+    tz = intern_zone(timezone)
+    noons = [tz.localize(datetime.datetime.fromordinal(ordinal).replace(hour=12)).timestamp() for ordinal in range(first, last + 1)]
+    pillars = bazi_core.get_four_pillars_batch(noons, timezones=np.full(len(noons), timezone))
+    columns = {}
+    for name in COLUMNS:
+        cycle = (6 * pillars[f"{name}_stem"] - 5 * pillars[f"{name}_branch"]) % 60
+        columns[name] = cycle.astype(np.uint8).tobytes()
+    return first, columns
+
+
+def encode_days(first, columns):
+    header = array("q", [first, len(columns["day"])])
+    if sys.byteorder != "little":
+        header.byteswap()
+    return header.tobytes() + b"".join(columns[name] for name in COLUMNS)
+
+
+def write_calendar(path=CALENDAR_PATH, start_year=CALENDAR_START_YEAR, end_year=CALENDAR_END_YEAR):
+    """Build the calendar file for start_year..end_year."""
+    first, columns = compute_days(start_year, end_year)
+    with open(path, "wb") as f:
+        f.write(encode_days(first, columns))
+    logging.info(f"Wrote {len(columns['day'])} days ({start_year}-{end_year}) to {path}")
+
+
+class PerpetualCalendar:
+    """
+    Per-day year, month and day pillars as sexagenary indices, read straight from a mapped
+    calendar file (or bytes): numpy views over its columns, nothing decoded up front.
+    """
+
+    def __init__(self, data):
+        import numpy as np
+        header = array("q")
+        header.frombytes(bytes(data[:HEADER_BYTES]))
+        if sys.byteorder != "little":
+            header.byteswap()
+        self.first_ordinal, self.days = header
+        self.data = data
+        self.columns = {name: np.frombuffer(data, dtype=np.uint8, count=self.days, offset=HEADER_BYTES + i * self.days)
+                        for i, name in enumerate(COLUMNS)}
+
+    @property
+    def first_date(self):
+        return datetime.date.fromordinal(self.first_ordinal)
+
+    @property
+    def last_date(self):
+        return datetime.date.fromordinal(self.first_ordinal + self.days - 1)
+
+    def offset(self, date):
+        """Position of a date in the columns; ValueError outside the calendar."""
+        offset = date.toordinal() - self.first_ordinal
+        if not 0 <= offset < self.days:
+            raise ValueError(f"{date.isoformat()} is outside the calendar ({self.first_date.isoformat()} to {self.last_date.isoformat()})")
+        return offset
+
+    def pillars(self, date):
+        """(year, month, day) sexagenary indices of a date."""
+        offset = self.offset(date)
+        return tuple(int(self.columns[name][offset]) for name in COLUMNS)
+
+    def scan(self, start, end, day_mask=None, month_mask=None, year_mask=None):
+        """
+        Offsets of the dates from start to end (inclusive) whose pillars pass the masks: 60
+        booleans each, indexed by sexagenary index (None lets every pillar through).
+        """
+        import numpy as np
+        lo, hi = self.offset(start), self.offset(end) + 1
+        passed = np.ones(hi - lo, dtype=bool)
+        for name, mask in (("day", day_mask), ("month", month_mask), ("year", year_mask)):
+            if mask is not None:
+                passed &= np.asarray(mask, dtype=bool)[self.columns[name][lo:hi]]
+        return np.flatnonzero(passed) + lo
+
+
+@lru_cache(maxsize=None)
+def load_calendar(path=CALENDAR_PATH):
+    """The packaged calendar, memory-mapped (once); built in memory, slowly, when the file is missing."""
+    try:
+        with open(path, "rb") as f:
+            return PerpetualCalendar(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError) as e:
+        logging.warning(f"Calendar file unavailable ({str(e)}). Computing the calendar in memory.")
+        return PerpetualCalendar(encode_days(*compute_days()))
+
+
+def branch_mask(branches):
+    """60 booleans: the sexagenary indices whose branch is in branches."""
+    return [index % 12 in branches for index in range(60)]
+
+
+def relation_branches(relations, chart_branches):
+    """Branches standing in any of `relations` to any of chart_branches."""
+    unknown = [relation for relation in relations if relation not in RELATIONS]
+    if unknown:
+        raise CalendarQueryError(f"Unknown relation {unknown[0]!r}; use {' or '.join(RELATIONS)}")
+    return {RELATIONS[relation](branch) for relation in relations for branch in chart_branches}
+
+
+def day_mask(chart=None, relations=(), exclude=(), against=("day",), day_pillars=None):
+    """
+    60 booleans for the day column. With a chart, a day passes when its branch has one of
+    `relations` (if any are given) with the branch of one of the chart's `against` pillars and
+    none of `exclude`; day_pillars, when given, restricts days to those sexagenary indices.
+    """
+    mask = [True] * 60
+    if relations or exclude:
+        if chart is None:
+            raise CalendarQueryError("relations and exclude need a chart")
+        unknown = [name for name in against if name not in PILLAR_NAMES]
+        if unknown:
+            raise CalendarQueryError(f"Unknown pillar {unknown[0]!r} in against; use {', '.join(PILLAR_NAMES)}")
+        chart_branches = {getattr(chart, name) % 12 for name in against}
+        if relations:
+            mask = branch_mask(relation_branches(relations, chart_branches))
+        excluded = relation_branches(exclude, chart_branches)
+        mask = [passed and index % 12 not in excluded for index, passed in enumerate(mask)]
+    if day_pillars is not None:
+        allowed = set(day_pillars)
+        mask = [passed and index in allowed for index, passed in enumerate(mask)]
+    return mask
+
+
+def parse_date(value, field):
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise CalendarQueryError(f"Invalid {field} {value!r}; use YYYY-MM-DD") from None
+
+
+def query_chart(body):
+    """The Chart a query filters against: from "pillars" (sexagenary indices) or a birth "chart" record."""
+    if body.get("pillars") is not None:
+        pillars = body["pillars"]
+        try:
+            return bazi_core.Chart(*(int(pillars[name]) % 60 for name in PILLAR_NAMES))
+        except (KeyError, TypeError, ValueError):
+            raise CalendarQueryError("pillars must give year, month, day and hour sexagenary indices") from None
+    if body.get("chart") is not None:
+        from pillar_batch import RecordError, record_key
+        try:
+            birth_datetime, _, _ = record_key(body["chart"])
+        except RecordError as e:
+            raise CalendarQueryError(f"chart: {str(e)}") from None
+        return bazi_core.compute_chart(birth_datetime, body["chart"]["birth_location"])[0]
+    return None
+
+
+def as_list(value, field):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list):
+        raise CalendarQueryError(f"{field} must be a list")
+    return value
+
+
+def query_days(body, calendar=None):
+    """
+    Answer a /calendar request body: the dates from "start" to "end" (inclusive) that pass its
+    filters, up to "limit", with their year, month and day pillars in columns.
+    """
+    if not isinstance(body, dict):
+        raise CalendarQueryError("Body must be a JSON object")
+    calendar = calendar or load_calendar()
+    start = parse_date(body.get("start"), "start")
+    end = parse_date(body.get("end"), "end")
+    if end < start:
+        raise CalendarQueryError("end is before start")
+    limit = body.get("limit", CALENDAR_MAX_RESULTS)
+    if not isinstance(limit, int) or limit < 0:
+        raise CalendarQueryError("limit must be a non-negative integer")
+    limit = min(limit, CALENDAR_MAX_RESULTS)
+    day_pillars = body.get("day_pillars")
+    if day_pillars is not None and (not isinstance(day_pillars, list) or
+                                    not all(isinstance(pillar, int) and 0 <= pillar < 60 for pillar in day_pillars)):
+        raise CalendarQueryError("day_pillars must be a list of sexagenary indices 0-59")
+    mask = day_mask(query_chart(body), as_list(body.get("relations"), "relations"), as_list(body.get("exclude"), "exclude"),
+                    as_list(body.get("against", ["day"]), "against"), day_pillars)
+    try:
+        offsets = calendar.scan(start, end, mask)
+    except ValueError as e:
+        raise CalendarQueryError(str(e)) from None
+    shown = offsets[:limit]
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "scanned": (end - start).days + 1,
+        "count": len(offsets),
+        "truncated": len(offsets) > limit,
+        "stems": bazi_core.GAN,
+        "branches": bazi_core.ZHI,
+        "dates": [datetime.date.fromordinal(calendar.first_ordinal + int(offset)).isoformat() for offset in shown],
+        "columns": {name: calendar.columns[name][shown].tolist() for name in COLUMNS}
+    }
+
+
+def check_calendar(samples=2000, seed=0, calendar=None):
+    """Cross-check randomly sampled days against a chart for noon at CALENDAR_LOCATION; returns the number checked."""
+    calendar = calendar or load_calendar()
+    rng = random.Random(seed)
+    offsets = [0, calendar.days - 1] + [rng.randrange(calendar.days) for _ in range(samples)]
+    for offset in offsets:
+        date = datetime.date.fromordinal(calendar.first_ordinal + offset)
+        chart, _, _ = bazi_core.compute_chart(datetime.datetime(date.year, date.month, date.day, 12), CALENDAR_LOCATION)
+        expected = (chart.year, chart.month, chart.day)
+        if calendar.pillars(date) != expected:
+            raise AssertionError(f"{date.isoformat()}: calendar {calendar.pillars(date)}, get_four_pillars {expected}")
+    return len(offsets)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        print(f"Calendar OK: {check_calendar()} days match get_four_pillars")
+    else:
+        years = [int(arg) for arg in sys.argv[1:3]] or [CALENDAR_START_YEAR, CALENDAR_END_YEAR]
+        write_calendar(start_year=years[0], end_year=years[1])
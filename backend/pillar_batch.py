@@ -0,0 +1,113 @@
+import os
+import logging
+from datetime import datetime
+
+import bazi_core
+
+# 批量排盘：/calculate-pillars 一次接受多条出生记录，相同输入只算一次，逐条报错，按列返回
+CALCULATE_PILLARS_MAX_RECORDS = int(os.environ.get("CALCULATE_PILLARS_MAX_RECORDS", "5000"))
+GENDERS = ("male", "female", "unknown")
+LUCK_PILLAR_COUNT = 8
+# Columns of the batch response, one value per distinct record: pillars are sexagenary cycle
+# indices 0-59, whose stem is stems[i % 10] and branch branches[i % 12]
+PILLAR_COLUMNS = ["year", "month", "day", "hour"]
+
+
+class RecordError(ValueError):
+    """A birth record that cannot be charted; reported against its index, the batch carries on."""
+
+
+def parse_birth_datetime(value):
+    """A datetime from "YYYY-MM-DD HH:MM" or any ISO 8601 form (a trailing Z or offset makes it aware)."""
+    if not isinstance(value, str) or not value.strip():
+        raise RecordError("Missing birth_datetime")
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise RecordError(f"Invalid birth_datetime {value!r}; use YYYY-MM-DD HH:MM") from None
+
+
+def location_key(location):
+    """A hashable form of a location string or {"city", "longitude", "latitude"} dict."""
+    if isinstance(location, str) and location.strip():
+        return location.strip()
+    if isinstance(location, dict) and location:
+        return tuple(sorted((key, value) for key, value in location.items() if isinstance(value, (str, int, float))))
+    raise RecordError("Missing birth_location")
+
+
+def record_key(record):
+    """(birth datetime, location key, gender): records with equal keys get the same chart."""
+    if not isinstance(record, dict):
+        raise RecordError("Record must be an object")
+    gender = str(record.get("gender") or "unknown").lower()
+    if gender not in GENDERS:
+        raise RecordError(f"Invalid gender {record.get('gender')!r}; use male, female or unknown")
+    return parse_birth_datetime(record.get("birth_datetime")), location_key(record.get("birth_location")), gender
+
+
+def chart(birth_datetime, location, gender="unknown"):
+    """(Chart, local datetime, warning, luck pillar indices) for one birth."""
+    four_pillars, local_datetime, warning = bazi_core.compute_chart(birth_datetime, location)
+    return four_pillars, local_datetime, warning, bazi_core.luck_pillar_indices(four_pillars, gender, LUCK_PILLAR_COUNT)
+
+
+def pillar_names(four_pillars, local_datetime, warning, luck_pillars):
+    """The single-record response: each pillar as "Stem Branch"."""
+    names = four_pillars.names()
+    names["luck_pillars"] = [bazi_core.JIAZI_NAMES[pillar] for pillar in luck_pillars]
+    if warning:
+        names["warning"] = warning
+    return names
+
+
+def chart_records(records):
+    """
+    Chart a list of birth records ({"birth_datetime", "birth_location", "gender"}).
+
+    Returns a columnar dict: "row" gives each record's position in the columns (None when the
+    record failed), so identical records share one computed row; "columns" holds the four
+    pillars, UTC offset and luck pillars per row as cycle indices; "errors" and "warnings" are
+    [{"index", ...}] for the records concerned. A bad record never fails the batch.
+    """
+    rows = {}
+    row_of_record, errors, warnings = [], [], []
+    columns = {name: [] for name in PILLAR_COLUMNS + ["utc_offset", "luck"]}
+    row_warnings = {}
+    for index, record in enumerate(records):
+        try:
+            key = record_key(record)
+            row = rows.get(key)
+            if row is None:
+                birth_datetime, _, gender = key
+                four_pillars, local_datetime, warning, luck_pillars = chart(birth_datetime, record["birth_location"], gender)
+                row = rows[key] = len(rows)
+                for name, pillar in zip(PILLAR_COLUMNS, four_pillars):
+                    columns[name].append(pillar)
+                columns["utc_offset"].append(int(local_datetime.utcoffset().total_seconds()))
+                columns["luck"].append(luck_pillars)
+                if warning:
+                    row_warnings[row] = warning
+        except RecordError as e:
+            errors.append({"index": index, "error": str(e)})
+            row_of_record.append(None)
+            continue
+        except Exception as e:
+            logging.error(f"Error charting record {index}: {str(e)}")
+            errors.append({"index": index, "error": str(e)})
+            row_of_record.append(None)
+            continue
+        row_of_record.append(row)
+        if row in row_warnings:
+            warnings.append({"index": index, "warning": row_warnings[row]})
+    return {
+        "count": len(row_of_record),
+        "unique": len(rows),
+        "stems": bazi_core.GAN,
+        "branches": bazi_core.ZHI,
+        "luck_start_ages": [10 * i for i in range(1, LUCK_PILLAR_COUNT + 1)],
+        "row": row_of_record,
+        "columns": columns,
+        "errors": errors,
+        "warnings": warnings
+    }
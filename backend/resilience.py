@@ -0,0 +1,238 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+
+import metrics
+
+# 模型调用的弹性控制：请求截止时间、令牌桶限流、熔断器（可通过环境变量覆盖）
+# Used when there is no Lambda context (local runs, scripts)
+DEFAULT_REQUEST_BUDGET_SECONDS = float(os.environ.get("DEFAULT_REQUEST_BUDGET_SECONDS", "30"))
+# Time kept back from the Lambda deadline for writing the session and returning the response
+DEADLINE_SAFETY_MARGIN_SECONDS = float(os.environ.get("DEADLINE_SAFETY_MARGIN_SECONDS", "2"))
+# Model calls per second per container (0 disables the limiter) and the burst allowed above it
+BEDROCK_RATE_LIMIT = float(os.environ.get("BEDROCK_RATE_LIMIT", "10"))
+BEDROCK_RATE_BURST = int(os.environ.get("BEDROCK_RATE_BURST", "20"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+RETRYABLE_ERROR_CODES = {"ThrottlingException"}
+
+request_deadline = ContextVar("request_deadline", default=None)
+# A threading.Event set when the caller no longer wants this context's model calls (speculative work)
+call_cancelled = ContextVar("call_cancelled", default=None)
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+class ModelCallShed(Exception):
+    """A model call was not attempted (or abandoned) to protect the request or Bedrock; callers fall back to regex or templates."""
+
+
+class CircuitOpen(ModelCallShed):
+    pass
+
+
+class RateLimited(ModelCallShed):
+    pass
+
+
+class DeadlineExceeded(ModelCallShed):
+    pass
+
+
+class CallCancelled(ModelCallShed):
+    pass
+
+
+def count(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+
+
+def start_request(context=None):
+    """Set this request's model-call deadline from the Lambda context; returns a token for end_request()."""
+    if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        budget = context.get_remaining_time_in_millis() / 1000
+    else:
+        budget = DEFAULT_REQUEST_BUDGET_SECONDS
+    return request_deadline.set(time.monotonic() + budget - DEADLINE_SAFETY_MARGIN_SECONDS)
+
+
+def end_request(token):
+    request_deadline.reset(token)
+
+
+def check_cancelled():
+    """Raise CallCancelled when the current context's model calls have been cancelled."""
+    cancelled = call_cancelled.get()
+    if cancelled is not None and cancelled.is_set():
+        count("cancelled")
+        raise CallCancelled("Model call no longer needed")
+
+
+def remaining_time():
+    """Seconds left for model calls in the current request (infinite outside a request)."""
+    deadline = request_deadline.get()
+    return float("inf") if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    """Client-side rate limiter shared by every thread in the container."""
+
+    def __init__(self, rate=BEDROCK_RATE_LIMIT, burst=BEDROCK_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Take a token, waiting at most `timeout` seconds for one; returns False instead of waiting longer."""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if wait > timeout:
+                return False
+            # Reserve the token now (possibly going negative) so concurrent callers queue behind us
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and sheds calls for `reset_seconds`; then lets
+    a single trial call through (half-open), closing again if it succeeds.
+    """
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half_open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release_trial(self):
+        """Free a half-open trial slot whose call was shed before reaching Bedrock (not a failure)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or (self.opened_at is None and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    logging.warning(f"Bedrock circuit breaker opened after {self.failures} consecutive failures")
+                count("breaker_opened")
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+rate_limiter = TokenBucket()
+circuit_breaker = CircuitBreaker()
+
+
+def call_with_budget(operation, max_retries=10, base_delay=2, max_delay=120, limiter=None, breaker=None):
+    """
+    Call operation(), retrying throttling and unexpected errors with exponential backoff, but
+    only while the request deadline allows: a backoff that would outlive it is not slept.
+
+    Raises CircuitOpen, RateLimited, DeadlineExceeded or CallCancelled (all ModelCallShed)
+    instead of calling Bedrock when the breaker is open, no rate-limit token arrives in time,
+    time has run out, or the caller cancelled the call (checked before every attempt; a request
+    already sent to Bedrock is not recalled).
+    """
+    import botocore.exceptions
+    limiter = limiter or rate_limiter
+    breaker = breaker or circuit_breaker
+    for attempt in range(max_retries + 1):
+        check_cancelled()
+        # Shed early while open; a half-open trial is only claimed below, right before the call
+        if breaker.state == "open":
+            count("shed_breaker")
+            raise CircuitOpen("Bedrock circuit breaker is open")
+        remaining = remaining_time()
+        if remaining <= 0:
+            count("shed_deadline")
+            raise DeadlineExceeded("No time left in the request for a Bedrock call")
+        if not limiter.acquire(timeout=remaining):
+            count("shed_rate_limit")
+            raise RateLimited("Client-side Bedrock rate limit reached")
+        check_cancelled()
+        if not breaker.allow():
+            count("shed_breaker")
+            raise CircuitOpen("Bedrock circuit breaker is open")
+        count("calls")
+        try:
+            result = operation()
+        except botocore.exceptions.ClientError as e:
+            error_code = e.response['Error']['Code']
+            logging.error(f"Bedrock invocation failed on attempt {attempt + 1}/{max_retries + 1}: {error_code}")
+            if error_code not in RETRYABLE_ERROR_CODES:
+                breaker.record_success()
+                raise e
+            count("throttled")
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise e
+            error, label = e, error_code
+        except ModelCallShed:
+            # e.g. the gateway's ConcurrencyLimited: nothing reached Bedrock, so a trial proves nothing
+            breaker.release_trial()
+            raise
+        except Exception as e:
+            logging.error(f"Unexpected error during Bedrock invocation: {str(e)}")
+            count("errors")
+            breaker.record_failure()
+            if attempt == max_retries:
+                raise Exception(f"Max retries ({max_retries}) reached for Bedrock invocation: {str(e)}")
+            error, label = e, "Unexpected error"
+        else:
+            breaker.record_success()
+            return result
+        delay = min(base_delay * (2 ** attempt) + random.uniform(0, 1), max_delay)
+        if delay >= remaining_time():
+            count("shed_deadline")
+            raise DeadlineExceeded(f"Backoff of {delay:.2f} seconds would outlive the request deadline") from error
+        logging.warning(f"{label} on attempt {attempt + 1}/{max_retries + 1}. Retrying in {delay:.2f} seconds...")
+        count("retries")
+        metrics.increment("Retries")
+        time.sleep(delay)
+
+
+def stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    return dict(counters, breaker_state=circuit_breaker.state)
@@ -0,0 +1,67 @@
+import random
+from itertools import combinations
+
+# 缺失信息提示模板：按缺失字段组合 × 语言预先生成若干种说法，保持道长/神谕口吻
+MISSING_FIELD_ORDER = ("birth_datetime", "location", "category")
+
+FIELD_PHRASES = {
+    "en": {
+        "birth_datetime": "birth date and time (e.g., 1990-01-01 14:00)",
+        "location": "birth location (e.g., Beijing, China)",
+        "category": "category (love, career, or health)"
+    },
+    "zh": {
+        "birth_datetime": "出生日期与时辰（如 1990-01-01 14:00）",
+        "location": "出生地点（如 中国北京）",
+        "category": "所问之事（爱情、事业或健康）"
+    }
+}
+
+MISSING_INFO_TEMPLATES = {
+    "en": [
+        "The stars have begun to speak, but I still need your {fields} before I can read your fate. Please share the missing details.",
+        "To cast your Four Pillars I must first know your {fields}. Tell me, and the heavens will reveal the rest.",
+        "Your path is still veiled in mist. Share your {fields}, and I shall read what the heavens have written for you.",
+        "Every fortune begins with its roots. Before I consult the elements, please tell me your {fields}."
+    ],
+    "zh": [
+        "贫道需知以下信息以推演您的命运：{fields}。请补全缺失的细节。",
+        "天机已现端倪，尚缺{fields}，请施主告知，贫道方能为您排盘。",
+        "欲观四柱，先明根本。请告诉贫道您的{fields}。",
+        "命理如云中之月，还请施主告知{fields}，贫道再为您细细推演。"
+    ]
+}
+
+BIRTH_TIME_HINTS = {
+    "en": " Providing the exact time of birth will lead to a more accurate reading.",
+    "zh": "提供确切的出生时辰将使推演更加准确。"
+}
+
+
+def join_fields(phrases, lang):
+    if lang == "zh":
+        return phrases[0] if len(phrases) == 1 else "、".join(phrases[:-1]) + "以及" + phrases[-1]
+    if len(phrases) == 1:
+        return phrases[0]
+    return ", ".join(phrases[:-1]) + ("," if len(phrases) > 2 else "") + " and " + phrases[-1]
+
+
+def build_missing_info_variants():
+    """Every (language, missing fields) combination mapped to its finished response variants."""
+    variants = {}
+    for lang, phrases in FIELD_PHRASES.items():
+        for size in range(1, len(MISSING_FIELD_ORDER) + 1):
+            for fields in combinations(MISSING_FIELD_ORDER, size):
+                text = join_fields([phrases[field] for field in fields], lang)
+                hint = BIRTH_TIME_HINTS[lang] if "birth_datetime" in fields else ""
+                variants[(lang, fields)] = [template.format(fields=text) + hint for template in MISSING_INFO_TEMPLATES[lang]]
+    return variants
+
+
+MISSING_INFO_VARIANTS = build_missing_info_variants()
+
+
+def missing_info_response(missing_fields, lang):
+    """A randomly chosen oracle-voiced request for the missing fields (keys of MISSING_FIELD_ORDER)."""
+    fields = tuple(field for field in MISSING_FIELD_ORDER if field in missing_fields)
+    return random.choice(MISSING_INFO_VARIANTS[(lang if lang in FIELD_PHRASES else "en", fields)])
@@ -0,0 +1,114 @@
+import os
+import re
+import json
+import math
+import heapq
+import logging
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+# 本地知识库检索（BM25），替代托管知识库的检索环节
+# The managed knowledge base's own source, indexed in place (no second copy to drift from it). A
+# package without data/ sets KNOWLEDGE_BASE_PATH to where it bundles the file; when it cannot be
+# read get_index() returns None and answers use managed retrieval instead
+KNOWLEDGE_BASE_PATH = os.environ.get(
+    "KNOWLEDGE_BASE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "RAG", "knowledge_base.jsonl")
+)
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4"))
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[\u4e00-\u9fff]+')
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on",
+    "or", "the", "this", "to", "with", "your", "my", "me", "i", "what", "how", "about", "person"
+}
+
+# Chinese query terms mapped onto the English vocabulary of the knowledge base
+QUERY_EXPANSIONS = {
+    "事业": "career", "工作": "career work", "职业": "career", "财运": "wealth finances",
+    "爱情": "love relationship", "感情": "relationship", "婚姻": "relationship marriage",
+    "健康": "health", "身体": "health", "命运": "destiny", "运势": "luck destiny",
+    "五行": "five elements", "八字": "bazi", "四柱": "four pillars", "阴阳": "yin yang",
+    "天干": "heavenly stems", "地支": "earthly branches",
+    "木": "wood", "火": "fire", "土": "earth", "金": "metal", "水": "water"
+}
+
+
+def tokenize(text):
+    """
+    Bilingual tokenizer: lowercase English words (minus stopwords) plus Chinese character
+    unigrams and bigrams, so both "BaZi" and "八字" match their passages.
+    """
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if '\u4e00' <= run[0] <= '\u9fff':
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif run not in STOPWORDS:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """Inverted index over passages with Okapi BM25 scoring."""
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        """passages: list of {"id": str, "content": str}."""
+        self.passages = passages
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        lengths = []
+        for doc_idx, passage in enumerate(passages):
+            term_counts = Counter(tokenize(passage["content"]))
+            lengths.append(sum(term_counts.values()))
+            for term, tf in term_counts.items():
+                self.postings[term].append((doc_idx, tf))
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        # Precompute each document's length normalisation and each term's IDF
+        self.length_norms = [k1 * (1 - b + b * length / avg_length) if avg_length else k1 for length in lengths]
+        n = len(passages)
+        self.idf = {term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5)) for term, docs in self.postings.items()}
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        """Return up to k (score, passage) pairs, best first."""
+        scores = defaultdict(float)
+        terms = tokenize(query)
+        for term in list(terms):
+            if term in QUERY_EXPANSIONS:
+                terms.extend(QUERY_EXPANSIONS[term].split())
+        for term in set(terms):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_idx, tf in self.postings[term]:
+                scores[doc_idx] += idf * tf * (self.k1 + 1) / (tf + self.length_norms[doc_idx])
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(score, self.passages[doc_idx]) for doc_idx, score in best]
+
+
+def load_knowledge_base(path=None):
+    path = path or KNOWLEDGE_BASE_PATH
+    passages = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                passages.append(json.loads(line))
+    logging.info(f"Loaded {len(passages)} knowledge base passages from {path}")
+    return passages
+
+
+@lru_cache(maxsize=None)
+def get_index(path=None):
+    """The BM25 index over the knowledge base passages (built once), or None when they cannot be read."""
+    try:
+        return BM25Index(load_knowledge_base(path))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Local knowledge base unavailable ({str(e)}). Falling back to managed retrieval.")
+        return None
+
+
+def retrieve(query, k=RETRIEVAL_TOP_K):
+    """Top-k knowledge base passages for a query (callers check get_index() first)."""
+    return [passage for _, passage in get_index().search(query, k)]
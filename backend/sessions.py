@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import logging
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+
+import metrics
+
+# 会话存储配置（可通过环境变量覆盖）
+SESSION_STORE_BACKEND = os.environ.get("SESSION_STORE_BACKEND", "dynamodb")  # dynamodb | sqlite | memory
+SESSION_STORE_PATH = os.environ.get("SESSION_STORE_PATH", "/tmp/oracle_sessions.sqlite3")
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "1024"))
+# How long a warm container trusts its cached copy of a session without re-reading it
+SESSION_CACHE_MAX_AGE = int(os.environ.get("SESSION_CACHE_MAX_AGE", "300"))
+SESSION_TTL_SECONDS = 3600
+# Clean sessions are still rewritten when their TTL has less than this left, so they do not expire mid-conversation
+SESSION_TTL_REFRESH_MARGIN = int(os.environ.get("SESSION_TTL_REFRESH_MARGIN", "900"))
+SESSION_WRITE_ATTEMPTS = 3
+
+# sessionData encodings: a one-byte tag followed by compact JSON, raw or zlib-compressed
+RAW_JSON_TAG = b"J"
+ZLIB_JSON_TAG = b"Z"
+
+current_unit_of_work = ContextVar("current_unit_of_work", default=None)
+
+
+def new_session(session_id):
+    return {
+        'sessionId': session_id,
+        'state': 'collecting_necessary',
+        'current_question_index': 0,
+        'necessary_answers': {},
+        'category': None,
+        'optional_answers': {}
+    }
+
+
+def encode_session(session):
+    """Compact binary sessionData: tagged JSON without whitespace, compressed only when that is smaller."""
+    raw = json.dumps(session, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    compressed = zlib.compress(raw, 6)
+    if len(compressed) < len(raw):
+        return ZLIB_JSON_TAG + compressed
+    return RAW_JSON_TAG + raw
+
+
+def decode_session(data):
+    """Inverse of encode_session; also accepts the legacy json.dumps string and boto3 Binary values."""
+    if isinstance(data, str):
+        return json.loads(data)
+    data = bytes(getattr(data, "value", data))
+    if data[:1] == ZLIB_JSON_TAG:
+        return json.loads(zlib.decompress(data[1:]))
+    if data[:1] == RAW_JSON_TAG:
+        return json.loads(data[1:])
+    raise ValueError(f"Unknown sessionData encoding {data[:1]!r}")
+
+
+class SessionConflict(Exception):
+    """A conditional session write lost to a newer version."""
+
+
+def is_conditional_check_failure(error):
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+
+class SessionStore:
+    """
+    Versioned session persistence.
+
+    get() returns (session, version, expires_at) or None. put() writes version
+    expected_version + 1 and raises SessionConflict unless the stored version is
+    expected_version (0 meaning "no versioned copy yet").
+    """
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def put(self, session_id, session, expected_version, expires_at):
+        raise NotImplementedError
+
+
+class DynamoDBSessionStore(SessionStore):
+    """Sessions in a DynamoDB table keyed on `sessionId`, with `sessionData`, `version` and `ttl` attributes."""
+
+    def __init__(self, get_table):
+        self.get_table = get_table
+
+    def get(self, session_id):
+        item = self.get_table().get_item(Key={'sessionId': session_id}).get('Item')
+        if item is None:
+            return None
+        return decode_session(item['sessionData']), int(item.get('version', 0)), int(item.get('ttl', 0))
+
+    def put(self, session_id, session, expected_version, expires_at):
+        if expected_version:
+            condition = {'ConditionExpression': '#version = :expected',
+                         'ExpressionAttributeValues': {':expected': expected_version}}
+        else:
+            condition = {'ConditionExpression': 'attribute_not_exists(#version)'}
+        try:
+            self.get_table().put_item(
+                Item={
+                    'sessionId': session_id,
+                    'sessionData': encode_session(session),
+                    'ttl': expires_at,
+                    'version': expected_version + 1
+                },
+                ExpressionAttributeNames={'#version': 'version'},
+                **condition
+            )
+        except Exception as e:
+            if is_conditional_check_failure(e):
+                raise SessionConflict(session_id) from e
+            raise
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a local SQLite file, for local development and self-hosted runs."""
+
+    def __init__(self, path=SESSION_STORE_PATH):
+        import sqlite3
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions "
+                           "(session_id TEXT PRIMARY KEY, data BLOB, version INTEGER, expires_at INTEGER)")
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data, version, expires_at FROM sessions WHERE session_id = ?",
+                                     (session_id,)).fetchone()
+        if row is None or row[2] < time.time():
+            return None
+        return decode_session(row[0]), row[1], row[2]
+
+    def put(self, session_id, session, expected_version, expires_at):
+        data = encode_session(session)
+        with self._lock:
+            if expected_version:
+                cursor = self._conn.execute(
+                    "UPDATE sessions SET data = ?, version = ?, expires_at = ? WHERE session_id = ? AND version = ?",
+                    (data, expected_version + 1, expires_at, session_id, expected_version))
+            else:
+                # An expired row counts as absent, as it would once DynamoDB's TTL sweep removed it
+                cursor = self._conn.execute(
+                    "INSERT INTO sessions VALUES (?, ?, 1, ?) ON CONFLICT(session_id) DO UPDATE SET "
+                    "data = excluded.data, version = 1, expires_at = excluded.expires_at "
+                    "WHERE sessions.expires_at < ?",
+                    (session_id, data, expires_at, int(time.time())))
+            self._conn.commit()
+        if cursor.rowcount == 0:
+            raise SessionConflict(session_id)
+
+
+class InMemorySessionStore(SessionStore):
+    """Sessions in a process-local dict (single-container runs and tests)."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._items.get(session_id)
+        if item is None or item[2] < time.time():
+            return None
+        return decode_session(item[0]), item[1], item[2]
+
+    def put(self, session_id, session, expected_version, expires_at):
+        data = encode_session(session)
+        with self._lock:
+            item = self._items.get(session_id)
+            current = item[1] if item is not None and item[2] >= time.time() else 0
+            if current != expected_version:
+                raise SessionConflict(session_id)
+            self._items[session_id] = (data, expected_version + 1, expires_at)
+
+
+class CachedSessionStore(SessionStore):
+    """
+    In-container read-through cache in front of another SessionStore.
+
+    A warm container answers follow-up turns from its cached copy without reading the backing
+    store. The copy is checked by the version condition on the next write: if another container
+    has written since, the write raises SessionConflict, the entry is evicted and the unit of
+    work re-reads. Entries older than max_age are re-read regardless, bounding how stale a
+    read-only turn can be.
+    """
+
+    def __init__(self, store, maxsize=SESSION_CACHE_SIZE, max_age=SESSION_CACHE_MAX_AGE):
+        self.store = store
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and now - entry[3] < self.max_age and entry[2] >= now:
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+                data, version, expires_at, _ = entry
+                return decode_session(data), version, expires_at
+            self.misses += 1
+        loaded = self.store.get(session_id)
+        if loaded is None:
+            self.evict(session_id)
+        else:
+            self._remember(session_id, *loaded)
+        return loaded
+
+    def put(self, session_id, session, expected_version, expires_at):
+        try:
+            self.store.put(session_id, session, expected_version, expires_at)
+        except SessionConflict:
+            self.evict(session_id)
+            raise
+        self._remember(session_id, session, expected_version + 1, expires_at)
+
+    def evict(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def _remember(self, session_id, session, version, expires_at):
+        with self._lock:
+            self._entries[session_id] = (encode_session(session), version, expires_at, time.time())
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+
+def build_session_store(get_table, backend=SESSION_STORE_BACKEND, path=SESSION_STORE_PATH, cache_size=SESSION_CACHE_SIZE):
+    """The configured backend, wrapped in the in-container cache unless cache_size is 0."""
+    if backend == "sqlite":
+        store = SQLiteSessionStore(path)
+    elif backend == "memory":
+        store = InMemorySessionStore()
+    else:
+        store = DynamoDBSessionStore(get_table)
+    if cache_size > 0:
+        store = CachedSessionStore(store, cache_size)
+    return store
+
+
+class SessionUnitOfWork:
+    """
+    Loads a session once and writes it back at most once per request.
+
+    update_session() calls only stage a snapshot; flush() writes the last snapshot if it
+    differs from what was loaded (or the session is new, or its TTL is nearly up). Writes are
+    conditional on the session version; if another turn wrote first, the fields this turn
+    changed are merged onto the newer copy and the write is retried.
+    """
+
+    def __init__(self, store, session_id=None):
+        self.store = store
+        self.writes = 0
+        self.skipped_writes = 0
+        self.conflicts = 0
+        loaded = None
+        if session_id:
+            with metrics.span("session_get"):
+                loaded = store.get(session_id)
+        if loaded is not None:
+            self.session, self.version, self.expires_at = loaded
+            self.session_id = session_id
+            self.is_new = False
+        else:
+            self.session_id = str(uuid.uuid4())
+            self.session = new_session(self.session_id)
+            self.version, self.expires_at = 0, 0
+            self.is_new = True
+        self._loaded_data = json.dumps(self.session, sort_keys=True)
+        self._staged_data = self._loaded_data
+
+    def stage(self, session):
+        """Record the session as it should be persisted (the latest call wins)."""
+        self._staged_data = json.dumps(session, sort_keys=True)
+
+    def dirty_fields(self):
+        loaded, staged = json.loads(self._loaded_data), json.loads(self._staged_data)
+        return sorted(key for key in set(loaded) | set(staged) if loaded.get(key) != staged.get(key))
+
+    def needs_write(self):
+        return (self.is_new or self._staged_data != self._loaded_data
+                or self.expires_at - time.time() < SESSION_TTL_REFRESH_MARGIN)
+
+    def flush(self):
+        """Write the staged session if needed; returns True if a write happened."""
+        if not self.needs_write():
+            self.skipped_writes += 1
+            return False
+        staged = json.loads(self._staged_data)
+        dirty = self.dirty_fields()
+        with metrics.span("session_put") as span:
+            for attempt in range(SESSION_WRITE_ATTEMPTS):
+                expires_at = int(time.time()) + SESSION_TTL_SECONDS
+                try:
+                    self.store.put(self.session_id, staged, self.version, expires_at)
+                    break
+                except SessionConflict:
+                    if attempt == SESSION_WRITE_ATTEMPTS - 1:
+                        raise
+                    self.conflicts += 1
+                    span.add("Conflicts")
+                    logging.warning(f"Concurrent update to session {self.session_id}; merging fields {dirty} and retrying")
+                    staged = self._merge_latest(staged, dirty)
+        self.writes += 1
+        self.version += 1
+        self.expires_at = expires_at
+        self._loaded_data = self._staged_data = json.dumps(staged, sort_keys=True)
+        self.is_new = False
+        return True
+
+    def _merge_latest(self, staged, dirty):
+        """Re-read the session and apply this turn's changed top-level fields on top of it."""
+        loaded = self.store.get(self.session_id)
+        if loaded is None:
+            self.version = 0
+            return staged
+        latest, self.version, _ = loaded
+        for field in dirty:
+            if field in staged:
+                latest[field] = staged[field]
+            else:
+                latest.pop(field, None)
+        return latest
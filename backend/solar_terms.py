@@ -0,0 +1,166 @@
+import os
+import sys
+import datetime
+import math
+import random
+import logging
+from array import array
+from bisect import bisect_right
+
+# 节气表：从 TERM_TABLE_START_YEAR 年小寒起，每 15° 黄经一个节气
+# Solar terms (jieqi) table: one entry per 15 degrees of apparent solar longitude,
+# starting with Xiaohan (285 deg) of the first year in the table.
+TERM_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "solar_terms.bin")
+TERM_TABLE_START_YEAR = 1900
+TERM_TABLE_END_YEAR = 2100
+TERMS_PER_YEAR = 24
+FIRST_TERM_LONGITUDE = 285  # Xiaohan, the first term of every Gregorian year
+UNIX_EPOCH_JD = 2440587.5
+MEAN_SOLAR_MOTION = 360 / 365.2422  # degrees per day
+
+SOLAR_TERM_NAMES = [
+    "Xiaohan", "Dahan", "Lichun", "Yushui", "Jingzhe", "Chunfen",
+    "Qingming", "Guyu", "Lixia", "Xiaoman", "Mangzhong", "Xiazhi",
+    "Xiaoshu", "Dashu", "Liqiu", "Chushu", "Bailu", "Qiufen",
+    "Hanlu", "Shuangjiang", "Lidong", "Xiaoxue", "Daxue", "Dongzhi"
+]
+
+_term_table = None
+_term_table_start_year = None
+
+
+def sun_longitude(jd):
+    """Apparent geocentric ecliptic longitude of the Sun (degrees) at a Julian date."""
+    import ephem
+    date = ephem.Date(jd - 2415020.0)
+    sun = ephem.Sun(date)
+    ecliptic = ephem.Ecliptic(ephem.Equatorial(sun.ra, sun.dec, epoch=date), epoch=date)
+    return math.degrees(ecliptic.lon)
+
+
+def find_term_instant(target_longitude, jd_guess):
+    """Refine the Julian date at which the Sun reaches target_longitude, starting near jd_guess."""
+    jd = jd_guess
+    for _ in range(20):
+        delta = (target_longitude - sun_longitude(jd) + 180) % 360 - 180
+        jd += delta / MEAN_SOLAR_MOTION
+        if abs(delta) < 1e-6:
+            break
+    return jd
+
+
+def compute_solar_terms(start_year, end_year):
+    """
+    Compute the instants of all 24 solar terms for start_year..end_year (inclusive).
+
+    Returns:
+        array: Unix timestamps (int seconds, UTC), sorted, starting at Xiaohan of start_year.
+    """
+    timestamps = array("q")
+    # Xiaohan falls around January 5-6; the mean motion carries the guess forward from there.
+    jd = 2451545.0 + (start_year - 2000) * 365.2422 + 5
+    for i in range((end_year - start_year + 1) * TERMS_PER_YEAR):
+        longitude = (FIRST_TERM_LONGITUDE + 15 * i) % 360
+        jd = find_term_instant(longitude, jd)
+        timestamps.append(int(round((jd - UNIX_EPOCH_JD) * 86400)))
+        jd += 15 / MEAN_SOLAR_MOTION
+    return timestamps
+
+
+def write_term_table(path=TERM_TABLE_PATH, start_year=TERM_TABLE_START_YEAR, end_year=TERM_TABLE_END_YEAR):
+    """Build the solar term table and write it as little-endian int64: [start_year, end_year, *timestamps]."""
+    data = array("q", [start_year, end_year])
+    data.extend(compute_solar_terms(start_year, end_year))
+    if sys.byteorder != "little":
+        data.byteswap()
+    with open(path, "wb") as f:
+        data.tofile(f)
+    logging.info(f"Wrote {len(data) - 2} solar terms ({start_year}-{end_year}) to {path}")
+
+
+def load_term_table(path=TERM_TABLE_PATH):
+    """Load (once) the packaged solar term table. Returns (start_year, timestamps) or (None, None)."""
+    global _term_table, _term_table_start_year
+    if _term_table is None:
+        data = array("q")
+        try:
+            with open(path, "rb") as f:
+                data.frombytes(f.read())
+        except OSError as e:
+            logging.warning(f"Solar term table unavailable ({str(e)}). Falling back to ephem.")
+            _term_table = array("q")
+            return None, None
+        if sys.byteorder != "little":
+            data.byteswap()
+        _term_table_start_year = data[0]
+        _term_table = data[2:]
+    if not _term_table:
+        return None, None
+    return _term_table_start_year, _term_table
+
+
+def solar_month(jd):
+    """
+    Determine the solar (jieqi) month containing a Julian date.
+
+    Months begin at the "jie" terms: Lichun opens Yin, Jingzhe opens Mao, ..., Xiaohan opens Chou.
+
+    Returns:
+        tuple: (solar_year, month_branch_idx) where solar_year changes at Lichun and
+        month_branch_idx indexes ZHI (0 = Zi, 2 = Yin).
+    """
+    start_year, table = load_term_table()
+    if table is not None:
+        ts = (jd - UNIX_EPOCH_JD) * 86400
+        i = bisect_right(table, ts) - 1
+        if 0 <= i < len(table) - 1:
+            # Term index i counts from Xiaohan of start_year; index 2 is that year's Lichun.
+            months_since_lichun = (i - 2) // 2
+            return start_year + months_since_lichun // 12, (2 + months_since_lichun) % 12
+    return solar_month_ephem(jd)
+
+
+def solar_month_ephem(jd):
+    """Same as solar_month, computed directly with ephem (for dates outside the packaged table)."""
+    month_idx = int(((sun_longitude(jd) - 315) % 360) // 30)
+    # Zi/Chou months in January/February still belong to the previous solar year.
+    dt = datetime.datetime(1970, 1, 1) + datetime.timedelta(days=jd - UNIX_EPOCH_JD)
+    year = dt.year
+    if dt.month <= 2 and month_idx >= 10:
+        year -= 1
+    return year, (2 + month_idx) % 12
+
+
+def check_term_table(samples=200, tolerance_seconds=60, seed=0):
+    """Cross-check randomly sampled table instants against a fresh ephem computation."""
+    start_year, table = load_term_table()
+    if table is None:
+        raise RuntimeError("Solar term table is missing; run `python solar_terms.py` to build it.")
+    rng = random.Random(seed)
+    worst = 0.0
+    for i in rng.sample(range(len(table)), min(samples, len(table))):
+        jd = table[i] / 86400 + UNIX_EPOCH_JD
+        longitude = (FIRST_TERM_LONGITUDE + 15 * i) % 360
+        error = abs((sun_longitude(jd) - longitude + 180) % 360 - 180) / MEAN_SOLAR_MOTION * 86400
+        worst = max(worst, error)
+        if error > tolerance_seconds:
+            raise AssertionError(f"Solar term {i} ({SOLAR_TERM_NAMES[i % TERMS_PER_YEAR]}) off by {error:.1f}s")
+    # Cross-check the March equinox (Chunfen) directly against ephem's own solver.
+    import ephem
+    for year in rng.sample(range(start_year, start_year + len(table) // TERMS_PER_YEAR), 10):
+        equinox_jd = ephem.next_vernal_equinox(f"{year}/1/1") + 2415020.0
+        table_ts = table[(year - start_year) * TERMS_PER_YEAR + 5]
+        error = abs((equinox_jd - UNIX_EPOCH_JD) * 86400 - table_ts)
+        worst = max(worst, error)
+        if error > tolerance_seconds:
+            raise AssertionError(f"Chunfen {year} off by {error:.1f}s against ephem.next_vernal_equinox")
+    return worst
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        print(f"Solar term table OK, worst error {check_term_table():.1f}s")
+    else:
+        years = [int(arg) for arg in sys.argv[1:3]] or [TERM_TABLE_START_YEAR, TERM_TABLE_END_YEAR]
+        write_term_table(start_year=years[0], end_year=years[1])
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import zlib
+import random
+import hashlib
+import logging
+from contextvars import ContextVar
+
+# 结构化日志：记录延迟格式化，按 logger 配置级别，详细记录按请求抽样，大字段截断并哈希，出生信息只记录哈希
+# "text" keeps the runtime's line format with fields appended as key=value; "json" writes one JSON object per record
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Per-logger overrides, e.g. "oracle.extraction=WARNING,botocore=ERROR"
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# Share of requests whose verbose records (full events, extraction details) are kept, decided once per request
+LOG_VERBOSE_SAMPLE_RATE = float(os.environ.get("LOG_VERBOSE_SAMPLE_RATE", "1"))
+# Longer string fields are cut to this many characters plus their length and hash
+LOG_MAX_FIELD_CHARS = int(os.environ.get("LOG_MAX_FIELD_CHARS", "200"))
+# Fields that can carry birth data are never written, only their length and hash (to correlate records)
+REDACTED_FIELDS = {"event", "body", "query", "search_query", "birth_datetime", "birth_location", "location"}
+DIGEST_CHARS = 12
+
+log_context = ContextVar("log_context", default=None)
+# json.dumps with non-default options builds an encoder per call; records share one
+ENCODER = json.JSONEncoder(ensure_ascii=False, default=str)
+SORTED_ENCODER = json.JSONEncoder(ensure_ascii=False, default=str, sort_keys=True)
+
+
+def digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:DIGEST_CHARS]
+
+
+def render_field(key, value, max_chars=LOG_MAX_FIELD_CHARS):
+    """The loggable form of one field: redacted, truncated, or (for dicts) rendered key by key."""
+    if value is None:
+        return None
+    if key in REDACTED_FIELDS:
+        text = value if isinstance(value, str) else SORTED_ENCODER.encode(value)
+        return f"<redacted {len(text)} chars sha256:{digest(text)}>"
+    if isinstance(value, dict):
+        return {k: render_field(k, v, max_chars) for k, v in value.items()}
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}...<{len(value)} chars sha256:{digest(value)}>"
+    return value
+
+
+def rendered_fields(record):
+    fields = getattr(record, "fields", None)
+    if not fields:
+        return {}
+    return {key: render_field(key, value) for key, value in fields.items()}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request ID and the rendered fields."""
+
+    def format(self, record):
+        entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        context = log_context.get()
+        if context is not None and context["request_id"]:
+            entry["requestId"] = context["request_id"]
+        entry.update(rendered_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return ENCODER.encode(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """The wrapped formatter's line (the Lambda runtime's, when present) followed by key=value fields."""
+
+    def __init__(self, inner=None):
+        super().__init__(logging.BASIC_FORMAT)
+        self.inner = inner
+
+    def format(self, record):
+        line = self.inner.format(record) if self.inner is not None else super().format(record)
+        fields = rendered_fields(record)
+        if not fields:
+            return line
+        return line + "".join(f" {key}={ENCODER.encode(value)}" for key, value in fields.items())
+
+
+def parse_levels(levels):
+    """{"logger.name": level} from "name=LEVEL,name=LEVEL"."""
+    parsed = {}
+    for item in levels.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+def configure_logging(log_format=LOG_FORMAT, level=LOG_LEVEL, levels=LOG_LEVELS):
+    """
+    Install the formatter on the root handlers (adding a stderr handler when there is none, as
+    basicConfig would) and apply the root and per-logger levels. Safe to call more than once.
+    """
+    root = logging.getLogger()
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    for handler in root.handlers:
+        inner = handler.formatter
+        if isinstance(inner, (JsonFormatter, TextFormatter)):
+            inner = getattr(inner, "inner", None)
+        handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(inner))
+    root.setLevel(level)
+    for name, name_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(name_level)
+
+
+def start_log_context(context=None, sample_rate=None):
+    """
+    Open a request's logging context; returns a token for end_log_context(). Whether its verbose
+    records are kept is decided here, from the request ID when there is one so every log line
+    of a request (and every retry of it) agrees.
+    """
+    sample_rate = LOG_VERBOSE_SAMPLE_RATE if sample_rate is None else sample_rate
+    request_id = getattr(context, "aws_request_id", None)
+    if sample_rate >= 1:
+        verbose = True
+    elif request_id:
+        verbose = zlib.crc32(request_id.encode("utf-8")) / 2 ** 32 < sample_rate
+    else:
+        verbose = random.random() < sample_rate
+    return log_context.set({"request_id": request_id, "verbose": verbose})
+
+
+def end_log_context(token):
+    log_context.reset(token)
+
+
+def verbose_enabled():
+    """Outside a request (local runs, scripts) verbose records are always kept."""
+    context = log_context.get()
+    return context is None or context["verbose"]
+
+
+def log_event(logger, level, message, verbose=False, **fields):
+    """
+    Log message with structured fields. Nothing is formatted unless the record is emitted:
+    disabled levels and unsampled verbose records return after one check, and fields are
+    only rendered (redacted, truncated, serialized) by the formatter.
+    """
+    if not logger.isEnabledFor(level) or (verbose and not verbose_enabled()):
+        return
+    logger.log(level, message, extra={"fields": fields}, stacklevel=2)
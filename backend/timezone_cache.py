@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+import pytz
+
+# 时区缓存配置（可通过环境变量覆盖）
+TZ_CACHE_GRID = float(os.environ.get("TZ_CACHE_GRID", "0.01"))  # degrees, ~1 km
+TZ_CACHE_SIZE = int(os.environ.get("TZ_CACHE_SIZE", "4096"))
+TZ_CACHE_PATH = os.environ.get("TZ_CACHE_PATH")  # e.g. /tmp/tz_cache.json; unset disables persistence
+TZ_CACHE_AUTOSAVE_EVERY = int(os.environ.get("TZ_CACHE_AUTOSAVE_EVERY", "50"))
+
+_zones = {}
+
+
+def intern_zone(timezone_str):
+    """Return a shared pytz zone object for a timezone name (pytz.timezone is only called once per name)."""
+    zone = _zones.get(timezone_str)
+    if zone is None:
+        zone = _zones.setdefault(timezone_str, pytz.timezone(timezone_str))
+    return zone
+
+
+class TimezoneCache:
+    """
+    LRU cache of timezone names keyed by (lat, lng) snapped to a grid.
+
+    Misses resolve the timezone at the centre of the grid cell, so every point in a cell
+    shares one answer regardless of lookup order. With a path, entries are loaded on first
+    use and saved every `autosave_every` misses so new containers start warm.
+    """
+
+    def __init__(self, resolver, grid=TZ_CACHE_GRID, maxsize=TZ_CACHE_SIZE, path=TZ_CACHE_PATH,
+                 autosave_every=TZ_CACHE_AUTOSAVE_EVERY):
+        self.resolver = resolver
+        self.grid = grid
+        self.maxsize = maxsize
+        self.path = path
+        self.autosave_every = autosave_every
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._unsaved = 0
+        self._loaded = path is None
+        self._lock = threading.Lock()
+
+    def cell(self, lat, lng):
+        return round(lat / self.grid), round(lng / self.grid)
+
+    def lookup(self, lat, lng):
+        """Return (pytz zone or None, timezone name or None) for a coordinate."""
+        if not self._loaded:
+            self.load()
+        key = self.cell(lat, lng)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                timezone_str = self._entries[key]
+                return (intern_zone(timezone_str) if timezone_str else None), timezone_str
+        timezone_str = self.resolver(lat=key[0] * self.grid, lng=key[1] * self.grid)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = timezone_str
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            autosave = self.path is not None and self._unsaved >= self.autosave_every
+        if autosave:
+            self.save()
+        return (intern_zone(timezone_str) if timezone_str else None), timezone_str
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self._unsaved = 0
+
+    def load(self, path=None):
+        """
+        Load persisted entries (if the file exists and was written with the same grid) into the
+        room left in the cache; returns how many entries were kept.
+        """
+        path = path or self.path
+        self._loaded = True
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("grid") != self.grid:
+                logging.warning(f"Ignoring timezone cache {path}: grid {data.get('grid')} != {self.grid}")
+                return 0
+            with self._lock:
+                # Persisted entries are older than any resolved since start-up: they go to the LRU end
+                # and are the first dropped when the file and memory together exceed maxsize
+                loaded = OrderedDict(((lat_cell, lng_cell), timezone_str)
+                                     for lat_cell, lng_cell, timezone_str in data.get("entries", []))
+                for key in self._entries:
+                    loaded.pop(key, None)
+                room = max(0, self.maxsize - len(self._entries))
+                kept = list(loaded.items())[max(0, len(loaded) - room):] if room else []
+                self._entries = OrderedDict(kept + list(self._entries.items()))
+            logging.info(f"Loaded {len(kept)} timezone cache entries from {path}")
+            return len(kept)
+        except (OSError, ValueError, TypeError) as e:
+            logging.warning(f"Failed to load timezone cache {path}: {str(e)}")
+            return 0
+
+    def save(self, path=None):
+        """Atomically write the cache entries (in LRU order) to a JSON file."""
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            entries = [[lat_cell, lng_cell, timezone_str] for (lat_cell, lng_cell), timezone_str in self._entries.items()]
+            self._unsaved = 0
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"grid": self.grid, "entries": entries}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Failed to save timezone cache {path}: {str(e)}")